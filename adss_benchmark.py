@@ -0,0 +1,271 @@
+"""
+Offline replay harness and benchmark for the detection loop.
+
+Feeds a recorded clip or a synthetic frame sequence through the same pipeline and
+scoring logic as the live edge node, headless and as fast as possible, then reports
+frames/sec and p50/p95/p99 latency per stage as JSON.
+
+    python adss_benchmark.py --video drive.avi --labels drive_labels.csv --json report.json
+    python adss_benchmark.py --synthetic 500 --workers 2
+    python adss_benchmark.py --images frames/ --luma
+    python adss_benchmark.py --telemetry 5000
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+import cv2
+
+import drowsiness_edge_node as edge
+
+
+def load_labels(path):
+    """Ground truth CSV with a header row: frame,state (state is open / closed / none)."""
+    labels = {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            labels[int(row["frame"])] = row["state"].strip().lower()
+    return labels
+
+def eye_state(status):
+    if not status["face_detected"]: return "none"
+    return "open" if status["eyes_detected"] else "closed"
+
+def score_accuracy(predictions, labels):
+    confusion = {}
+    correct = 0
+    total = 0
+    for frame_idx, expected in labels.items():
+        predicted = predictions.get(frame_idx)
+        if predicted is None: continue
+        total += 1
+        correct += predicted == expected
+        key = f"{expected}->{predicted}"
+        confusion[key] = confusion.get(key, 0) + 1
+    return {
+        "labelled_frames": total,
+        "accuracy": round(correct / total, 4) if total else None,
+        "confusion": confusion
+    }
+
+def run_benchmark(source, source_name, fps=10.0, workers=1, labels=None, seed=0, backend="thread",
+                  eye_estimator="cascade", headless=False):
+    random.seed(seed) # Simulated CAN bus speed must be identical between runs.
+    clock = edge.ReplayClock(fps)
+    # Log, spool and incident files of a run are scratch data: keep them out of the working directory.
+    workdir = tempfile.mkdtemp(prefix="adss-benchmark-")
+    detector = edge.DrowsinessDetector(capture=source, clock=clock, log_file=os.path.join(workdir, edge.LOG_FILE),
+                                       evidence_dir=os.path.join(workdir, edge.EVIDENCE_DIR),
+                                       spool_path=os.path.join(workdir, edge.SPOOL_PATH))
+    try:
+        return _replay(detector, clock, source, source_name, workers, labels, backend, eye_estimator, headless)
+    finally:
+        source.release()
+        detector.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _replay(detector, clock, source, source_name, workers, labels, backend, eye_estimator, headless):
+    detector.profiler = edge.LatencyRecorder()
+    detector.eye_estimator = detector.create_eye_estimator(eye_estimator)
+    detector.governor = None # Full resolution, every frame: results must not depend on host load.
+    detector.headless = headless
+    if backend == "process":
+        detector.inference_backend = edge.ProcessInferenceBackend(processes=workers)
+        workers = detector.inference_backend.slot_count
+
+    predictions = {}
+    def on_result(seq, status):
+        predictions[seq] = eye_state(status)
+        clock.tick()
+
+    # Lossless queues: every recorded frame is scored, so frame index == sequence number.
+    pipeline = edge.FramePipeline(detector, source, inference_workers=workers, display=False,
+                                  lossless=True, on_result=on_result, frame_clock=clock.frame_time)
+    started = time.perf_counter()
+    pipeline_report = pipeline.run()
+    wall_time = time.perf_counter() - started
+    detector.bus.drain(timeout=10)
+    detector.black_box.stop_recording()
+    detector.black_box.encoder.flush(timeout=30)
+    detector.bus.close(timeout=10) # Delivers the EVIDENCE_SAVED of the last incident file.
+
+    frames = len(predictions)
+    report = {
+        "source": source_name,
+        "frames": frames,
+        "wall_time_s": round(wall_time, 3),
+        "fps": round(frames / wall_time, 2) if wall_time > 0 else 0.0,
+        "backend": backend,
+        "headless": headless,
+        "eye_state": detector.eye_estimator.stats(),
+        "lighting": detector.environment.stats(),
+        "workers": workers,
+        "stages": detector.profiler.summary(),
+        "pipeline": pipeline_report,
+        "incident_encoder": detector.black_box.encoder.stats(),
+        "incident_buffer": detector.black_box.buffer_stats(),
+        "events": detector.bus.stats(),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "machine": platform.machine()
+        }
+    }
+    if labels:
+        report["accuracy"] = score_accuracy(predictions, labels)
+    return report
+
+def headless_savings(hud_report, headless_report):
+    """Per-frame cost of the HUD, from two runs over the same frames."""
+    hud_ms = hud_report["stages"].get("hud_draw", {}).get("mean_ms", 0.0)
+    return {
+        "fps_with_hud": hud_report["fps"],
+        "fps_headless": headless_report["fps"],
+        "hud_draw_ms_per_frame": hud_ms,
+        "scoring_ms_with_hud": hud_report["pipeline"]["scoring"]["avg_ms"],
+        "scoring_ms_headless": headless_report["pipeline"]["scoring"]["avg_ms"]
+    }
+
+def telemetry_messages(count, seed=0, device_id="TRUCK-8842-X"):
+    """Uplink traffic shaped like a drive: a heartbeat every 10 s and bursts of alerts."""
+    rng = random.Random(seed)
+    start = time.time()
+    messages = []
+    t = 0.0
+    for i in range(count):
+        t += rng.uniform(0.5, 10.0)
+        if i % 4 == 0:
+            event = "HEARTBEAT"
+            data = {"status": "ok", "speed": rng.randint(0, 110), "mode": rng.choice(("PARKED", "CITY", "HIGHWAY")),
+                    "perclos": round(rng.random() * 0.3, 3),
+                    "metrics": {"fps": round(rng.uniform(8, 12), 1), "p95_ms": round(rng.uniform(20, 60), 2)}}
+        else:
+            event = "ALERT"
+            data = {"score": rng.randint(15, 40), "speed": rng.randint(0, 110)}
+            if rng.random() < 0.3: data["repeats"] = rng.randint(2, 6)
+        messages.append({
+            "device_id": device_id,
+            "timestamp": datetime.datetime.fromtimestamp(start + t).isoformat(),
+            "event": event,
+            "data": data
+        })
+    return messages
+
+def run_telemetry_benchmark(count, seed=0, batch_size=edge.PUBLISH_BATCH_SIZE):
+    """Bytes on the wire and codec throughput for each telemetry wire format."""
+    messages = telemetry_messages(count, seed)
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    device_id = messages[0]["device_id"]
+
+    json_codec = edge.JsonTelemetryCodec()
+    variants = [("json", json_codec.encode_batch, json_codec.decode_batch),
+                ("json+zlib", lambda d, m: zlib.compress(json_codec.encode_batch(d, m), 6),
+                 lambda data: json_codec.decode_batch(zlib.decompress(data)))]
+    for compression in (None, "zlib", "zstd"):
+        if compression == "zstd" and not edge.ZSTD_AVAILABLE: continue
+        for use_msgpack in ((False, True) if edge.MSGPACK_AVAILABLE else (False,)):
+            codec = edge.CompactTelemetryCodec(compression=compression, use_msgpack=use_msgpack)
+            name = f"compact+{compression or 'raw'}" + ("+msgpack" if use_msgpack else "")
+            variants.append((name, codec.encode_batch, codec.decode_batch))
+
+    results = {}
+    baseline = None
+    for name, encode, decode in variants:
+        t0 = time.perf_counter()
+        envelopes = [encode(device_id, batch) for batch in batches]
+        encode_time = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        decoded = [decode(envelope) for envelope in envelopes]
+        decode_time = time.perf_counter() - t0
+        if sum(len(m) for _, m in decoded) != len(messages):
+            raise RuntimeError(f"{name} lost messages in the round trip")
+
+        size = sum(len(envelope) for envelope in envelopes)
+        baseline = baseline or size
+        results[name] = {
+            "bytes": size,
+            "bytes_per_message": round(size / len(messages), 1),
+            "ratio_vs_json": round(size / baseline, 3),
+            "encode_msgs_per_sec": round(len(messages) / encode_time) if encode_time > 0 else None,
+            "decode_msgs_per_sec": round(len(messages) / decode_time) if decode_time > 0 else None
+        }
+    return {
+        "messages": len(messages),
+        "batch_size": batch_size,
+        "msgpack": edge.MSGPACK_AVAILABLE,
+        "zstd": edge.ZSTD_AVAILABLE,
+        "formats": results
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic frames through the detection loop.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--video", help="Recorded clip to replay.")
+    group.add_argument("--synthetic", type=int, metavar="N", help="Replay N synthetic frames.")
+    group.add_argument("--images", help="Replay the images of a directory, in name order.")
+    group.add_argument("--telemetry", type=int, metavar="N",
+                       help="Compare telemetry wire formats on N generated messages instead of replaying frames.")
+    parser.add_argument("--image", help="Still image used as the base of synthetic frames.")
+    parser.add_argument("--labels", help="Ground truth CSV (frame,state) for accuracy scoring.")
+    parser.add_argument("--fps", type=float, default=10.0, help="Simulated capture rate for time-based logic.")
+    parser.add_argument("--workers", type=int, default=1, help="Inference worker threads (or processes with --backend process).")
+    parser.add_argument("--backend", choices=("thread", "process"), default="thread")
+    parser.add_argument("--eye-estimator", choices=("cascade", "gradient"), default="cascade")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--headless", action="store_true", help="Skip HUD rendering, as in a fleet deployment.")
+    parser.add_argument("--luma", action="store_true", help="Capture single-channel luma frames (no cvtColor per frame).")
+    parser.add_argument("--compare-headless", action="store_true",
+                        help="Replay twice, with and without the HUD, and report the difference.")
+    parser.add_argument("--json", help="Write the report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    if args.telemetry:
+        text = json.dumps(run_telemetry_benchmark(args.telemetry, args.seed), indent=2)
+        if args.json:
+            with open(args.json, "w") as file:
+                file.write(text)
+        else:
+            print(text)
+        return 0
+
+    image = cv2.imread(args.image) if args.image else None
+    def open_source():
+        if args.video or args.images:
+            return edge.open_frame_source(args.video or args.images, grayscale=args.luma), args.video or args.images
+        return (edge.SyntheticFrameSource(count=args.synthetic, seed=args.seed, image=image, grayscale=args.luma),
+                f"synthetic:{args.synthetic}")
+
+    source, source_name = open_source()
+    if not source.isOpened():
+        print(f"Error: cannot open {source_name}")
+        return 1
+
+    labels = load_labels(args.labels) if args.labels else None
+    report = run_benchmark(source, source_name, args.fps, args.workers, labels, args.seed, args.backend,
+                           args.eye_estimator, headless=args.headless and not args.compare_headless)
+    if args.compare_headless:
+        source, source_name = open_source()
+        headless_report = run_benchmark(source, source_name, args.fps, args.workers, labels, args.seed,
+                                        args.backend, args.eye_estimator, headless=True)
+        report["headless_savings"] = headless_savings(report, headless_report)
+
+    text = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(text)
+        print(f"[BENCHMARK] {report['frames']} frames at {report['fps']} FPS. Report written to {args.json}")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
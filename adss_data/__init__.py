@@ -0,0 +1 @@
+"""Data files of the ADSS edge node: detector profiles and the cascades not bundled with OpenCV."""
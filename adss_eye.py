@@ -0,0 +1,132 @@
+import os
+import sys
+import signal
+import cv2
+import drowsiness_edge_node as edge
+
+#Simple eye monitor: face/eye boxes in a window, alarm when the eyes stay closed, "stop the vehicle" after that.
+#Detection runs on the edge node's EyeStateEngine, so this script only keeps its own frame counter and sounds.
+#	python adss_eye.py [clip] [--headless]   (installed: adss-eye)
+
+#Sounds for the vehicle start/stop demonstration and the alarm, looked up in $ADSS_SOUND_DIR (default: sounds/ next
+#to this script). A missing file or player falls back to a beep (see ADSS_ALARM in drowsiness_edge_node.py).
+SOUND_DIR = os.environ.get("ADSS_SOUND_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds"))
+START_SOUND = "carengine-5998.mp3"
+ALARM_SOUND = "loud-beepy-alarm-81101.mp3"
+STOP_SOUND = "cararriveandstop-6191.mp3"
+
+#Frames with closed eyes before the alarm plays (thrice), and before the vehicle is stopped
+ALARM_FRAMES = 200
+STOP_FRAMES = 204
+
+#Parameters of the "eye_py" detector profile, used when detector_profiles.json is not around
+EYE_PY_PROFILE = edge.DetectorProfile("eye_py",
+	edge.CascadeParams(scale_factor=1.3, min_neighbors=5, min_size=(200,200)),
+	edge.CascadeParams(scale_factor=1.3, min_neighbors=5, min_size=(50,50)))
+
+def create_engine():
+	#OpenCV's bundled face cascade and the tree-based eyeglasses eye cascade shipped in adss_data/
+	cascades = (edge.load_cascade(edge.FACE_CASCADE_FILE), edge.load_cascade("eye_tree.xml"))
+	try:
+		profile = edge.detector_profile("eye_py")
+	except ValueError:
+		profile = EYE_PY_PROFILE
+	#Every frame gets a full-frame face search and the eye cascade, as this script always did
+	return edge.EyeStateEngine(profile, cascades, tracking=False, eye_estimator="cascade")
+
+def play(alarm, name):
+	path = os.path.join(SOUND_DIR, name)
+	try:
+		if os.path.isfile(path) and alarm.play_file(path):
+			return
+		alarm.beep(*edge.ALARM_TONE)
+	except Exception as e:
+		print(f"Sound failed: {e}")
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[1:]
+	#Headless mode (--headless): no window and no overlays, stop with Ctrl+C or SIGTERM instead of 'q'
+	headless = "--headless" in argv
+	sources = [a for a in argv if a != "--headless"]
+	if headless:
+		def skip_drawing(img, *args, **kwargs):
+			return img
+		draw_text, draw_rect = skip_drawing, skip_drawing
+	else:
+		draw_text, draw_rect = cv2.putText, cv2.rectangle
+
+	running = [True]
+	def request_stop(signum, frame):
+		running[0] = False
+	signal.signal(signal.SIGINT, request_stop)
+	signal.signal(signal.SIGTERM, request_stop)
+
+	try:
+		engine = create_engine()
+	except (OSError, ValueError) as e:
+		sys.exit(f"Could not load the face/eye cascade files: {e}")
+	alarm = edge.create_alarm("pygame")
+
+	#Starting the video capture (pass a recorded clip path to replay it instead of the webcam)
+	cap = edge.open_frame_source(sources[0] if sources else 0)
+
+	#Variable store execution state
+	first_read = True
+	timer = 0
+
+	# JUST PLAYING A VEICHLE START MUSIC TO DEMONSTRATE THAT HERE WE WILL HAVE A CODE THAT TURNS A MOTOR ENGINE ON
+	print("Starting the veichle\n")
+	play(alarm, START_SOUND)
+
+	while running[0]:
+		ret, img = cap.read()
+		if not ret:
+			print("End of code")
+			break
+
+		#Faces, eyes and the lighting level (face boxes are contrast-normalized at night) for this frame
+		state = engine.process_frame(img, now=cap.grabbed_at)
+		if state.detections:
+			for (x,y,w,h), eyes in state.detections:
+				img = draw_rect(img,(x,y),(x+w,y+h),(0,255,0),2)
+
+				#Examining the length of eyes object for eyes
+				if len(eyes) >= 2:
+					#Check if program is running for detection
+					if first_read:
+						draw_text(img, "Eyes open!", (70,70), cv2.FONT_HERSHEY_PLAIN, 3, (255,255,255), 2)
+						timer = 0
+					else:
+						draw_text(img, "Eyes open!", (70,70), cv2.FONT_HERSHEY_PLAIN, 2, (255,255,255), 2)
+				elif first_read:
+					draw_text(img, "Eyes closed", (70,70), cv2.FONT_HERSHEY_PLAIN, 3, (255,255,255), 2)
+					timer += 1
+					print(timer)
+					if ALARM_FRAMES < timer < STOP_FRAMES:
+						# PLAYING AN ALARM THRICE TO ALERT THE DRIVER
+						play(alarm, ALARM_SOUND)
+					elif timer > STOP_FRAMES:
+						print("stopping the veichle")
+						# JUST PLAYING A VEICHLE STOP MUSIC TO DEMONSTRATE THAT HERE WE WILL HAVE A CODE THAT TURNS A MOTOR ENGINE OFF
+						play(alarm, STOP_SOUND)
+						running[0] = False
+		else:
+			draw_text(img, "No face detected", (100,100), cv2.FONT_HERSHEY_PLAIN, 3, (0,255,0), 2)
+
+		#Controlling the algorithm with keys
+		if headless:
+			continue
+		cv2.imshow('img', img)
+		a = cv2.waitKey(1)
+		if a == ord('q'):
+			break
+		elif a == ord('s') and first_read:
+			first_read = False
+
+	cap.release()
+	if not headless:
+		cv2.destroyAllWindows()
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -0,0 +1,53 @@
+"""
+Decodes captured telemetry uplink envelopes back into readable JSON, one message per line.
+
+Envelopes are what the edge node hands to the broker: either the compact binary format or a
+plain JSON array. Set TELEMETRY_CAPTURE_DIR in drowsiness_edge_node.py to have the broker
+stand-in save each one.
+
+    python decode_telemetry.py captures/envelope_000001.bin
+    python decode_telemetry.py captures/ --summary
+"""
+import argparse
+import json
+import os
+import sys
+
+import drowsiness_edge_node as edge
+
+
+def envelope_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".bin"):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode captured telemetry envelopes to JSON lines.")
+    parser.add_argument("paths", nargs="+", help="Envelope files or capture directories.")
+    parser.add_argument("--summary", action="store_true", help="Print per-envelope sizes instead of the messages.")
+    args = parser.parse_args()
+
+    failed = 0
+    for path in envelope_files(args.paths):
+        with open(path, "rb") as file:
+            data = file.read()
+        try:
+            device_id, messages = edge.decode_telemetry(data)
+        except ValueError as e:
+            print(f"Error: {path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        if args.summary:
+            print(f"{path}: {device_id}, {len(messages)} messages, {len(data)} bytes "
+                  f"({len(data) / max(1, len(messages)):.1f} B/msg)")
+        else:
+            for message in messages:
+                print(json.dumps(message))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,27 +5,61 @@ import datetime
 import json
 import threading
 import os
+import sys
+import importlib
 import csv
 import random
 import base64
+import queue
+import struct
+import zlib
+import hashlib
+import sqlite3
+import http.server
+import urllib.request
+import itertools
+import signal
+import math
+import asyncio
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
 from collections import deque
-from winsound import Beep 
 
-# Try to import pyttsx3 for Text-to-Speech.
+# Speech, microphone and audio libraries are imported when a service first needs them, so the
+# detection core (EyeStateEngine) imports and runs without them, on any platform.
+OPTIONAL_MODULE_HINTS = {
+    "pyttsx3": "Voice features will be text-only logs.",
+    "speech_recognition": "Driver cannot talk back.",
+    "pygame": "Sound files cannot be played.",
+    "winsound": "Windows beeps are unavailable."
+}
+_optional_modules = {}
+
+def optional_import(name):
+    """Imports an optional dependency on first use. Returns None, with a single warning, when it is missing."""
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = importlib.import_module(name)
+        except ImportError:
+            _optional_modules[name] = None
+            print(f"Warning: '{name}' not found. {OPTIONAL_MODULE_HINTS.get(name, '')}".rstrip())
+    return _optional_modules[name]
+
+# Optional faster encodings for the telemetry uplink (CompactTelemetryCodec falls back to JSON/zlib).
 try:
-    import pyttsx3
-    TTS_AVAILABLE = True
+    import msgpack
+    MSGPACK_AVAILABLE = True
 except ImportError:
-    TTS_AVAILABLE = False
-    print("Warning: 'pyttsx3' not found. Voice features will be text-only logs.")
+    MSGPACK_AVAILABLE = False
 
-# Try to import speech_recognition for Voice Commands.
 try:
-    import speech_recognition as sr
-    SR_AVAILABLE = True
+    import zstandard
+    ZSTD_AVAILABLE = True
 except ImportError:
-    SR_AVAILABLE = False
-    print("Warning: 'speech_recognition' not found. Driver cannot talk back.")
+    ZSTD_AVAILABLE = False
+
+BOOT_TIME = time.perf_counter() # Imports done; startup reports are measured from here.
 
 # --- IoT Simulation Configuration ---
 DEVICE_ID = "EYE_MONITOR_01"
@@ -34,29 +68,662 @@ IOT_ENDPOINT = "wss://mock-iot-broker.cloud/mqtt"
 LOG_FILE = "device_telemetry_log.csv"
 EVIDENCE_DIR = "forensic_evidence"
 
-if not os.path.exists(EVIDENCE_DIR):
-    os.makedirs(EVIDENCE_DIR)
+# --- Pipeline Configuration ---
+CAPTURE_QUEUE_DEPTH = 2   # Grabber -> inference. Oldest frame is dropped when full.
+RESULT_QUEUE_DEPTH = 8    # Inference -> scoring. Blocking, keeps every inferred frame.
+DISPLAY_QUEUE_DEPTH = 1   # Scoring -> display. Oldest frame is dropped when full.
+INFERENCE_WORKERS = 1
+INFERENCE_BACKEND = "thread"  # "process" runs the cascades in worker processes (see ProcessInferenceBackend).
+PROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MAX_FRAME_SHAPE = (1080, 1920) # Largest gray frame a shared-memory slot holds; bigger frames are downscaled to fit.
+PROCESS_JOB_TIMEOUT = 5.0 # Seconds a worker may spend on one frame before it is restarted and the frame skipped.
+ENCODER_QUEUE_DEPTH = 64  # Post-trigger frames waiting for the incident encoder before new ones are dropped.
+
+# --- Frame Source Configuration ---
+FRAME_SOURCE = 0          # Camera index, video file, rtsp:// URL, image directory, "synthetic:N" or "live:<source>".
+CAPTURE_LUMA = False      # Single-channel luma frames (native GREY/YUYV where the camera allows): no cvtColor, grayscale evidence.
+LIVE_STANDIN_FPS = 10.0   # Rate of "live:" stand-ins when the wrapped source does not report one.
+
+# --- Environment Configuration ---
+ENV_SAMPLE_STEP = 8       # Brightness is read from every Nth row and column (1/64 of the pixels at 8)...
+ENV_SMOOTHING = 0.25      # ...and folded into a running level with this weight per frame.
+ENV_NIGHT_LEVEL = 50      # Running luma level below which the cabin is NIGHT...
+ENV_GLARE_LEVEL = 200     # ...and above which it is GLARE.
+ENV_HYSTERESIS = 8        # Luma margin needed to leave NIGHT/GLARE again, so a level near a threshold doesn't flap.
+ROI_NORMALIZATION = "clahe" # Contrast normalization of face boxes before the eye search in NIGHT/GLARE: "clahe", "equalize" or None.
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (4, 4)
+
+# --- Local Log Configuration ---
+LOG_FLUSH_BATCH = 64              # Rows buffered before the log sink flushes early.
+LOG_FLUSH_INTERVAL = 2.0          # Seconds between flushes otherwise.
+LOG_MAX_BYTES = 5 * 1024 * 1024   # Rotate the active log once it grows past this size.
+LOG_ROTATE_DAILY = True
+LOG_BINARY = False                # Also write compact fixed-size records next to the CSV.
+BINARY_LOG_MAGIC = b"ADSSLOG1"
+BINARY_LOG_RECORD = struct.Struct("<dBii") # timestamp, event code, score, speed
+LOG_EVENT_CODES = {"ALERT": 1, "HEARTBEAT": 2, "STATUS_RESET": 3, "DRIVER_SIGNAL": 4, "EVIDENCE_CREATED": 5, "STARTUP": 6}
+
+# --- Store-and-Forward Configuration ---
+SPOOL_PATH = "telemetry_spool.db"
+SPOOL_MAX_MESSAGES = 100000   # Oldest spooled messages are evicted beyond this.
+PUBLISH_BATCH_SIZE = 500      # Messages per acknowledged publish.
+RECONNECT_BACKOFF_MIN = 1.0   # Seconds, doubled after every failed reconnect...
+RECONNECT_BACKOFF_MAX = 60.0  # ...up to this cap.
+TELEMETRY_WIRE_FORMAT = "compact" # "compact": batched binary envelope. "json": one verbose JSON array per batch.
+TELEMETRY_COMPRESSION = "zlib"  # "zlib", "zstd" (if zstandard is installed) or None. Compact format only.
+TELEMETRY_CAPTURE_DIR = None    # Directory where the broker stand-in saves every envelope (see decode_telemetry.py).
+
+# --- Evidence Upload Configuration ---
+EVIDENCE_UPLOAD_URL = os.environ.get("ADSS_EVIDENCE_URL") # e.g. "https://evidence.fleet.example". "standin" runs a LocalEvidenceServer (tests, benchmarks); None keeps incident files local.
+EVIDENCE_STANDIN_DIR = "evidence_cloud_standin" # Where the stand-in keeps received chunks and assembled files.
+EVIDENCE_CHUNK_SIZE = 256 * 1024    # Bytes per chunk; a dropped link costs at most one chunk.
+EVIDENCE_UPLOAD_WORKERS = 2         # Incident files uploaded concurrently.
+EVIDENCE_UPLOAD_BPS = 512 * 1024    # Shared upload bandwidth cap in bytes/s. None = unlimited.
+EVIDENCE_UPLOAD_TIMEOUT = 15        # Seconds per HTTP request.
+
+# --- Control Plane Configuration ---
+CONTROL_PLANE_WORKERS = 4         # Threads for the blocking calls (SQLite, HTTP, microphone) control-plane tasks await.
+CONTROL_PLANE_STOP_TIMEOUT = 3.0  # Seconds shutdown waits for cancelled tasks before abandoning them.
+HEARTBEAT_INTERVAL = 10.0         # Seconds between HEARTBEAT events. A control-plane timer in live runs.
+SPEECH_QUEUE_DEPTH = 4            # Phrases waiting for the TTS engine; the oldest is dropped beyond it.
+
+# --- Instrumentation Configuration ---
+METRICS_ENABLED = True
+METRICS_WINDOW = 512          # Samples kept per stage histogram.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9102           # None disables the local /metrics endpoint.
+
+# --- Multi-Cabin Configuration ---
+# One entry per camera, e.g. {"source": 0, "device_id": "BUS_12_SEAT_1"}.
+# Leave empty to run the single-camera edge node.
+CABIN_STREAMS = []
+
+# --- Detect-then-Track Configuration ---
+TRACKING_MODE = True
+KEYFRAME_INTERVAL = 10    # Full-frame face search every N frames, ROI search in between.
+TRACK_ROI_PADDING = 0.3   # ROI grows by this fraction of the last face box on every side.
+TRACK_SCALE_RANGE = 0.25  # ROI pyramid only covers faces within +/-25% of the last face size.
+
+# --- Eye-State Configuration ---
+EYE_STATE_ESTIMATOR = "cascade" # "gradient" replaces the per-face eye cascade with GradientEyeEstimator.
+EYE_BAND = (0.2, 0.5)           # Vertical slice of the face box that contains the eyes.
+EYE_PATCH_SIZE = (32, 12)       # Each eye is resized to this (w, h) before scoring.
+EYE_CLOSED_RATIO = 0.6          # Closed when openness drops below this fraction of the driver's open level.
+
+# --- Startup Configuration ---
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "adss_data") # Installed as the adss_data package.
+# Cascade files are looked up in order: $ADSS_CASCADE_DIR, next to this script, adss_data/, OpenCV's bundled data.
+CASCADE_DIRS = [
+    os.environ.get("ADSS_CASCADE_DIR", ""),
+    os.path.dirname(os.path.abspath(__file__)),
+    DATA_DIR,
+    getattr(getattr(cv2, "data", None), "haarcascades", "")
+]
+FACE_CASCADE_FILE = "haarcascade_frontalface_default.xml"
+EYE_CASCADE_FILE = "haarcascade_eye.xml"
+
+# --- Detector Profile Configuration ---
+# scaleFactor/minNeighbors/minSize/maxSize per camera, tuned offline with tune_profiles.py.
+DETECTOR_PROFILE_FILE = os.environ.get("ADSS_DETECTOR_PROFILES", os.path.join(DATA_DIR, "detector_profiles.json"))
+DETECTOR_PROFILE = "default"    # Used when neither the stream nor the file's "cameras" map names a profile.
+
+# --- Display Configuration ---
+HEADLESS = os.environ.get("ADSS_HEADLESS", "") == "1" # No window, no HUD drawing; stop with SIGINT/SIGTERM.
+
+# --- Alarm Configuration ---
+ALARM_BACKEND = os.environ.get("ADSS_ALARM", "auto") # "auto" (winsound on Windows, else the terminal bell), "winsound", "pygame", "bell" or "none".
+ALARM_TONE = (2500, 200)  # Frequency (Hz) and length (ms) of the drowsiness beep.
+
+# --- Debug Stream Configuration ---
+DEBUG_STREAM_HOST = "127.0.0.1" # Use "0.0.0.0" to reach the stream from the fleet network.
+DEBUG_STREAM_PORT = None        # e.g. 8090. None disables the MJPEG/SSE debug stream.
+DEBUG_STREAM_MAX_FPS = 5        # Upper bound for encoding and for every client.
+DEBUG_STREAM_MIN_FPS = 0.1      # Lowest rate a client may ask for with ?fps=N.
+DEBUG_STREAM_QUALITY = 70
+
+# --- Event Bus Configuration ---
+TELEMETRY_EVENTS = ("ALERT", "HEARTBEAT", "EVIDENCE_CREATED", "DRIVER_SIGNAL", "STATUS_RESET", "STARTUP")
+EVENT_BUS_WORKERS = 2           # Fixed handler threads per detector (voice, alarm, telemetry, evidence, log).
+EVENT_QUEUE_DEPTH = 32          # Per-subscriber queue bound; the oldest event is dropped beyond it.
+EVIDENCE_COOLDOWN = 30          # Seconds between black-box incident files.
+
+# --- Black Box Configuration ---
+BLACK_BOX_HUD = False           # Record incident video with the HUD overlay (forces HUD rendering every frame).
+BLACK_BOX_SECONDS = 5           # Pre-incident history kept in memory.
+BLACK_BOX_POST_SECONDS = 5      # Recorded after the trigger.
+BLACK_BOX_MODE = "raw"          # "raw": BGR ring (fixed, buffer_seconds * frame bytes). "jpeg": compressed ring.
+BLACK_BOX_JPEG_QUALITY = 80
+BLACK_BOX_SCALE = 1.0           # "jpeg" mode only: downscale factor applied before encoding.
+BLACK_BOX_MEMORY_CAP = 64 * 1024 * 1024 # "jpeg" mode only: bytes of encoded history; the oldest frames go first.
+
+# --- Fatigue Scoring Configuration ---
+SCORE_RATE = 10.0               # Score points per second of eye closure (1 point per frame at the original 10 FPS).
+EYE_STATE_TIME_CONSTANT = 0.15  # Seconds. Smoothing of raw per-frame open/closed readings.
+EYE_CLOSED_ON = 0.6             # Hysteresis: smoothed closed level needed to switch to CLOSED...
+EYE_CLOSED_OFF = 0.4            # ...and the level it must fall below to switch back to OPEN.
+PERCLOS_WINDOW = 60.0           # Seconds of face-visible time PERCLOS is measured over.
+PERCLOS_ADVISORY = 0.15         # Suggest a break above this share of eyes-closed time.
+FATIGUE_TREND_WINDOW = 10.0     # Seconds averaged for the predictive avg_fatigue.
+MAX_FRAME_GAP = 0.5             # Longer stalls count as this many seconds, so a hiccup cannot raise an alert.
+SOS_BLINK_RANGE = (0.2, 1.2)    # Closure length (seconds) counted as a deliberate SOS blink.
+ALERT_EVENT_INTERVAL = 0.5      # Seconds between ALERT events (alarm beep, telemetry, log) while alerting.
+
+# --- Performance Governor Configuration ---
+GOVERNOR_ENABLED = True
+GOVERNOR_PROFILES = {
+    # capture: requested camera resolution, downscale: detection resize factor, target_fps: frames analyzed per second
+    "PARKED":  {"capture": (320, 240), "downscale": 1.0, "target_fps": 2},
+    "CITY":    {"capture": (640, 480), "downscale": 1.0, "target_fps": 10},
+    "HIGHWAY": {"capture": (640, 480), "downscale": 1.0, "target_fps": 15},
+}
+GOVERNOR_MIN_DOWNSCALE = 0.6    # Lowest detection scale the governor may fall back to under CPU pressure.
+
+class BusEvent:
+    """One published event. `repeats` counts publishes merged into it while it was queued."""
+    __slots__ = ("type", "payload", "published_at", "repeats")
+
+    def __init__(self, event_type, payload):
+        self.type = event_type
+        self.payload = payload
+        self.published_at = time.perf_counter()
+        self.repeats = 1
+
+class EventSubscriber:
+    __slots__ = ("name", "handler", "event_types", "coalesce", "events", "scheduled",
+                 "delivered", "coalesced", "dropped", "errors")
+
+    def __init__(self, name, handler, event_types, coalesce):
+        self.name = name
+        self.handler = handler
+        self.event_types = set(event_types)
+        self.coalesce = set(coalesce)
+        self.events = deque()
+        self.scheduled = False # Queued for, or running on, a worker. Keeps delivery serial per subscriber.
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+
+class EventBus:
+    """
+    In-process publish/subscribe for alert side effects (voice, alarm, telemetry, evidence, log).
+    publish() only appends to bounded per-subscriber queues and never blocks the frame loop;
+    a fixed pool of workers runs the handlers. Each subscriber sees its events in order and
+    one at a time, different subscribers run in parallel. A coalescing event type that is
+    already queued for a subscriber is updated in place (latest payload, repeats + 1), and a
+    full queue drops its oldest event.
+    """
+    def __init__(self, workers=EVENT_BUS_WORKERS, max_pending=EVENT_QUEUE_DEPTH):
+        self.max_pending = max_pending
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.ready = queue.Queue()
+        self.latency = MetricsRegistry()
+        self.published = 0
+        self.closed = False
+        self.workers = [threading.Thread(target=self._worker_loop, name=f"event-bus-{i}", daemon=True)
+                        for i in range(max(1, workers))]
+        for w in self.workers:
+            w.start()
+
+    def subscribe(self, name, handler, event_types, coalesce=()):
+        with self.lock:
+            self.subscribers.append(EventSubscriber(name, handler, event_types, coalesce))
+
+    def publish(self, event_type, payload=None):
+        with self.lock:
+            if self.closed: return
+            self.published += 1
+            for sub in self.subscribers:
+                if event_type not in sub.event_types: continue
+                if event_type in sub.coalesce:
+                    queued = next((e for e in sub.events if e.type == event_type), None)
+                    if queued is not None:
+                        queued.payload = payload
+                        queued.repeats += 1
+                        sub.coalesced += 1
+                        continue
+                if len(sub.events) >= self.max_pending:
+                    sub.events.popleft()
+                    sub.dropped += 1
+                sub.events.append(BusEvent(event_type, payload))
+                if not sub.scheduled:
+                    sub.scheduled = True
+                    self.ready.put(sub)
+
+    def _worker_loop(self):
+        while True:
+            sub = self.ready.get()
+            if sub is None: return
+            with self.lock:
+                event = sub.events.popleft()
+
+            t0 = time.perf_counter()
+            self.latency.record(f"{sub.name}.wait", t0 - event.published_at)
+            try:
+                sub.handler(event)
+            except Exception as e:
+                sub.errors += 1
+                print(f"[EVENTS] {sub.name} failed on {event.type}: {e}")
+            self.latency.record(f"{sub.name}.handler", time.perf_counter() - t0)
+
+            with self.lock:
+                sub.delivered += 1
+                if sub.events:
+                    self.ready.put(sub)
+                else:
+                    sub.scheduled = False
+
+    def pending(self):
+        with self.lock:
+            return sum(len(sub.events) + sub.scheduled for sub in self.subscribers)
+
+    def drain(self, timeout=5):
+        """Waits (up to `timeout`) until every queued event is delivered. Returns True if nothing is left."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.01) # Handlers may still publish follow-ups (ALERT -> EVIDENCE_CREATED) while draining.
+        return not self.pending()
+
+    def close(self, timeout=5):
+        """Delivers what is queued (up to `timeout`), then stops accepting events and stops the workers."""
+        deadline = time.monotonic() + timeout
+        self.drain(timeout)
+        with self.lock:
+            self.closed = True
+        for _ in self.workers:
+            self.ready.put(None)
+        for w in self.workers:
+            w.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        stages = self.latency.snapshot()["stages"]
+        def p95_ms(stage):
+            return round(stages[stage]["p95"] * 1000, 2) if stage in stages else 0.0
+        with self.lock:
+            return {
+                "published": self.published,
+                "subscribers": {
+                    sub.name: {
+                        "delivered": sub.delivered,
+                        "coalesced": sub.coalesced,
+                        "dropped": sub.dropped,
+                        "errors": sub.errors,
+                        "queued": len(sub.events),
+                        "wait_p95_ms": p95_ms(f"{sub.name}.wait"),
+                        "handler_p95_ms": p95_ms(f"{sub.name}.handler")
+                    } for sub in self.subscribers
+                }
+            }
+
+class ControlPlane:
+    """
+    asyncio event loop on one thread, hosting the non-vision services (telemetry link,
+    evidence upload, speech, microphone start-up, heartbeat timer) as cancellable tasks.
+    Services wait on events and timers instead of waking up to poll. Blocking calls (SQLite,
+    HTTP, audio) are awaited on a small executor, so they never stall the loop.
+    Other threads reach the loop only through call() and spawn(). stop() cancels every
+    task and returns within `timeout`.
+    """
+    def __init__(self, name="control-plane", workers=CONTROL_PLANE_WORKERS):
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-io")
+        self.loop.set_default_executor(self.executor)
+        self.tasks = set()
+        self.closed = False
+        self.timer_runs = 0
+        self.blocking_calls = 0
+        self.stop_ms = None
+        self.thread = threading.Thread(target=self._run_loop, name=name, daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def call(self, fn, *args):
+        """Runs fn(*args) on the loop thread. The bridge for touching loop objects (events, queues) from other threads."""
+        if not self.closed: self.loop.call_soon_threadsafe(fn, *args)
+
+    def create(self, factory, *args):
+        """Builds a loop-bound object (asyncio.Event, Queue, ...) on the loop thread and returns it."""
+        async def build():
+            return factory(*args)
+        return asyncio.run_coroutine_threadsafe(build(), self.loop).result()
+
+    def spawn(self, coro, name=None):
+        """Starts a service task. Returns a concurrent.futures.Future; cancelling it cancels the task."""
+        return asyncio.run_coroutine_threadsafe(self._track(coro, name), self.loop)
+
+    def every(self, interval, fn, name=None):
+        """Calls fn() on the loop every `interval` seconds, on a fixed schedule."""
+        async def timer():
+            next_at = self.loop.time() + interval
+            while True:
+                await asyncio.sleep(max(0.0, next_at - self.loop.time()))
+                next_at += interval
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"[CONTROL] Timer {name or fn} failed: {e}")
+                self.timer_runs += 1
+        return self.spawn(timer(), name)
+
+    async def run_blocking(self, fn, *args):
+        self.blocking_calls += 1
+        return await self.loop.run_in_executor(self.executor, fn, *args)
+
+    @staticmethod
+    async def wait(event, timeout=None):
+        """Waits for an asyncio.Event. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _track(self, coro, name):
+        task = asyncio.current_task()
+        if name: task.set_name(name)
+        self.tasks.add(task)
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[CONTROL] Task {task.get_name()} failed: {e}")
+            raise
+        finally:
+            self.tasks.discard(task)
+
+    def stop(self, timeout=CONTROL_PLANE_STOP_TIMEOUT):
+        """Cancels every task, stops the loop and returns within `timeout` seconds."""
+        if self.closed: return
+        t0 = time.perf_counter()
+        async def cancel_all():
+            tasks = [t for t in self.tasks if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            if tasks: await asyncio.wait(tasks, timeout=timeout)
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_all(), self.loop).result(timeout)
+        except concurrent.futures.TimeoutError:
+            print(f"[CONTROL] {self.name}: tasks still running after {timeout}s, abandoned.")
+        self.closed = True
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(max(0.0, timeout - (time.perf_counter() - t0)))
+        # Blocking calls already running finish on their own (bounded by their timeouts); queued ones are dropped.
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if not self.thread.is_alive(): self.loop.close()
+        self.stop_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    def stats(self):
+        return {
+            "tasks": len(self.tasks),
+            "timer_runs": self.timer_runs,
+            "blocking_calls": self.blocking_calls,
+            "stop_ms": self.stop_ms
+        }
+
+class TelemetryLogSink:
+    """
+    Background writer for the local redundant log.
+    log() only appends a tuple to an in-memory batch. A worker thread flushes the batch when it
+    reaches LOG_FLUSH_BATCH rows or every LOG_FLUSH_INTERVAL seconds, keeps the file open between
+    flushes and rotates it by size or by date. With binary=True every row is also written as a
+    fixed-size record (see BINARY_LOG_RECORD) to a sibling .bin file.
+    """
+    def __init__(self, path=LOG_FILE, device_id=DEVICE_ID, flush_batch=LOG_FLUSH_BATCH,
+                 flush_interval=LOG_FLUSH_INTERVAL, max_bytes=LOG_MAX_BYTES,
+                 rotate_daily=LOG_ROTATE_DAILY, binary=LOG_BINARY):
+        self.path = path
+        self.binary_path = os.path.splitext(path)[0] + ".bin" if binary else None
+        self.device_id = device_id
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+
+        self.batch = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.csv_file = None
+        self.bin_file = None
+        self.opened_on = None
+        self.rows_written = 0
+        self.flushes = 0
+        self.worker = threading.Thread(target=self._flush_loop, daemon=True)
+        self.worker.start()
+
+    def log(self, event, score, speed):
+        with self.cond:
+            self.batch.append((time.time(), event, score, speed))
+            if len(self.batch) >= self.flush_batch:
+                self.cond.notify()
+
+    def close(self, timeout=5):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.worker.join(timeout)
+
+    def _flush_loop(self):
+        while True:
+            with self.cond:
+                if not self.closed and len(self.batch) < self.flush_batch:
+                    self.cond.wait(self.flush_interval)
+                rows, self.batch = self.batch, []
+                closed = self.closed
+            if rows:
+                try:
+                    self._write(rows)
+                except Exception as e:
+                    print(f"[LOG] Write failed, {len(rows)} rows lost: {e}")
+            if closed:
+                self._close_files()
+                return
+
+    def _write(self, rows):
+        self._rotate_if_needed()
+        if self.csv_file is None: self._open_files()
+
+        writer = csv.writer(self.csv_file)
+        for ts, event, score, speed in rows:
+            writer.writerow([datetime.datetime.fromtimestamp(ts).isoformat(), self.device_id, event, score, speed])
+        self.csv_file.flush()
+
+        if self.bin_file:
+            self.bin_file.write(b"".join(
+                BINARY_LOG_RECORD.pack(ts, LOG_EVENT_CODES.get(event, 0), int(score), int(speed))
+                for ts, event, score, speed in rows))
+            self.bin_file.flush()
+
+        self.rows_written += len(rows)
+        self.flushes += 1
+
+    def _open_files(self):
+        new_file = not os.path.exists(self.path)
+        self.csv_file = open(self.path, mode='a', newline='')
+        if new_file:
+            csv.writer(self.csv_file).writerow(["Timestamp", "Device_ID", "Event", "Score", "Speed"])
+        if self.binary_path:
+            new_bin = not os.path.exists(self.binary_path)
+            self.bin_file = open(self.binary_path, mode='ab')
+            if new_bin:
+                # Header carries the device identity once instead of per record.
+                device = self.device_id.encode()
+                self.bin_file.write(BINARY_LOG_MAGIC + bytes([len(device)]) + device)
+        self.opened_on = datetime.date.today()
+
+    def _close_files(self):
+        for f in (self.csv_file, self.bin_file):
+            if f: f.close()
+        self.csv_file = None
+        self.bin_file = None
+
+    def _rotate_if_needed(self):
+        if not os.path.exists(self.path): return
+        stale = self.rotate_daily and self.opened_on is not None and self.opened_on != datetime.date.today()
+        if not stale and os.path.getsize(self.path) < self.max_bytes: return
+
+        self._close_files()
+        paths = [path for path in (self.path, self.binary_path) if path and os.path.exists(path)]
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Two rotations in the same second get a counter, so neither file nor its .bin sibling is overwritten.
+        for n in itertools.count():
+            suffix = stamp if n == 0 else f"{stamp}_{n}"
+            targets = [f"{stem}_{suffix}{ext}" for stem, ext in map(os.path.splitext, paths)]
+            if not any(os.path.exists(target) for target in targets): break
+        for path, target in zip(paths, targets):
+            os.replace(path, target)
+        print(f"[LOG] Rotated {self.path}")
+
+def read_binary_log(path):
+    """Decodes a binary telemetry log into (device_id, [(timestamp, event, score, speed), ...])."""
+    names = {code: name for name, code in LOG_EVENT_CODES.items()}
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(BINARY_LOG_MAGIC):
+        raise ValueError(f"{path} is not a binary telemetry log")
+    offset = len(BINARY_LOG_MAGIC)
+    device_len = data[offset]
+    device_id = data[offset + 1:offset + 1 + device_len].decode()
+    body = data[offset + 1 + device_len:]
+    usable = len(body) - len(body) % BINARY_LOG_RECORD.size
+    rows = [(ts, names.get(code, "UNKNOWN"), score, speed)
+            for ts, code, score, speed in BINARY_LOG_RECORD.iter_unpack(body[:usable])]
+    return device_id, rows
+
+class AlarmBackend:
+    """Driver alarm output. This base backend is silent; the others bring their own audio library."""
+    name = "none"
+
+    def beep(self, frequency, duration_ms):
+        pass
+
+    def play_file(self, path):
+        """Plays a sound file to the end. Returns False when this backend cannot play it."""
+        return False
+
+class TerminalBellAlarm(AlarmBackend):
+    """BEL on the terminal. Every platform, no dependencies."""
+    name = "bell"
+
+    def beep(self, frequency, duration_ms):
+        print("\a", end="", flush=True)
+
+class WinsoundAlarm(AlarmBackend):
+    """winsound.Beep and PlaySound (WAV only) on Windows."""
+    name = "winsound"
+
+    def __init__(self, winsound):
+        self.winsound = winsound
+
+    def beep(self, frequency, duration_ms):
+        self.winsound.Beep(frequency, duration_ms)
+
+    def play_file(self, path):
+        if not path.lower().endswith(".wav"): return False
+        self.winsound.PlaySound(path, self.winsound.SND_FILENAME)
+        return True
+
+class PygameAlarm(AlarmBackend):
+    """pygame.mixer on any platform: synthesized tones, and MP3/OGG/WAV files. The mixer opens on first use."""
+    name = "pygame"
+
+    def __init__(self, pygame, sample_rate=22050):
+        self.pygame = pygame
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock() # One sound at a time, like winsound.
+
+    def _mixer(self):
+        if not self.pygame.mixer.get_init():
+            self.pygame.mixer.init(frequency=self.sample_rate, size=-16, channels=1)
+        return self.pygame.mixer
+
+    def beep(self, frequency, duration_ms):
+        with self.lock:
+            rate, _, channels = self._mixer().get_init()
+            t = np.arange(int(rate * duration_ms / 1000)) / rate
+            wave = (np.sin(2 * np.pi * frequency * t) * 16000).astype(np.int16)
+            if channels > 1: wave = np.repeat(wave[:, None], channels, axis=1)
+            self.pygame.sndarray.make_sound(wave).play()
+            self.pygame.time.wait(duration_ms)
+
+    def play_file(self, path):
+        with self.lock:
+            sound = self._mixer().Sound(path)
+            sound.play()
+            self.pygame.time.wait(int(sound.get_length() * 1000))
+        return True
+
+ALARM_BACKENDS = ("auto", "winsound", "pygame", "bell", "none")
+
+def create_alarm(kind=None):
+    """Builds an ALARM_BACKEND alarm. A backend whose library is missing falls back to the terminal bell."""
+    kind = kind or ALARM_BACKEND
+    if kind not in ALARM_BACKENDS: raise ValueError(f"Unknown alarm backend '{kind}', expected one of {ALARM_BACKENDS}")
+    if kind == "auto": kind = "winsound" if sys.platform == "win32" else "bell"
+    if kind == "none": return AlarmBackend()
+    if kind == "bell": return TerminalBellAlarm()
+    module = optional_import(kind)
+    if module is None: return TerminalBellAlarm()
+    return WinsoundAlarm(module) if kind == "winsound" else PygameAlarm(module)
 
 class DriverVoiceAssistant:
     """
     The 'Chatbot' for the car (Output).
     Uses Text-to-Speech to communicate context-aware warnings.
+    Phrases are queued to a 'tts' task on the control plane, which speaks them one at a time
+    on a single thread that owns the engine.
     """
-    def __init__(self):
+    def __init__(self, control):
+        self.control = control
         self.engine = None
-        if TTS_AVAILABLE:
-            try:
-                self.engine = pyttsx3.init()
-                self.engine.setProperty('rate', 150) # Speaking speed
-                voices = self.engine.getProperty('voices')
-                if len(voices) > 1:
-                    self.engine.setProperty('voice', voices[1].id)
-            except Exception as e:
-                print(f"TTS Init Failed: {e}")
-        
+        self.init_ms = None
+        self.ready = threading.Event()
         self.last_speech_time = 0
         self.last_warning_time = 0 # Throttles critical alerts
-        self.lock = threading.Lock()
+        self.dropped = 0
+        self.tts = optional_import("pyttsx3")
+
+        # pyttsx3.init() can take seconds and runAndWait() blocks while speaking, so both run on
+        # the engine's own thread and never delay the first frame or the control-plane loop.
+        if self.tts:
+            self.speech = control.create(asyncio.Queue)
+            self.engine_thread = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+            self.speech_task = control.spawn(self._speech_task(), "tts")
+        else:
+            self.ready.set()
+
+    def _init_engine(self):
+        t0 = time.perf_counter()
+        try:
+            engine = self.tts.init()
+            engine.setProperty('rate', 150) # Speaking speed
+            voices = engine.getProperty('voices')
+            if len(voices) > 1:
+                engine.setProperty('voice', voices[1].id)
+            self.engine = engine
+        except Exception as e:
+            print(f"TTS Init Failed: {e}")
+        self.init_ms = round((time.perf_counter() - t0) * 1000, 1)
+        self.ready.set()
+
+    def attach(self, bus):
+        bus.subscribe("voice", self.on_event, ("ALERT", "ADVISORY", "ENV_CHANGE", "SOS_REQUEST"), coalesce=("ALERT",))
+
+    def on_event(self, event):
+        if event.type == "ALERT":
+            self.warn_drowsy(event.payload["speed"])
+        elif event.type == "ADVISORY":
+            self.suggest_break()
+        elif event.type == "ENV_CHANGE":
+            self.chat_environment(event.payload["env"])
+        elif event.type == "SOS_REQUEST":
+            self.speak("SOS sequence detected. Say Confirm to send help, or Cancel to abort.", priority=True)
 
     def speak(self, text, priority=False):
         # Don't spam the driver. Minimum 5 seconds between non-priority messages.
@@ -66,16 +733,38 @@ class DriverVoiceAssistant:
         print(f"\n[ASSISTANT] 🗣️ '{text}'")
         self.last_speech_time = time.time()
 
-        if self.engine:
-            threading.Thread(target=self._speak_thread, args=(text,), daemon=True).start()
+        if self.tts:
+            self.control.call(self._queue_speech, text)
 
-    def _speak_thread(self, text):
-        with self.lock:
-            try:
-                self.engine.say(text)
-                self.engine.runAndWait()
-            except:
-                pass
+    def _queue_speech(self, text):
+        if self.speech.qsize() >= SPEECH_QUEUE_DEPTH:
+            self.speech.get_nowait()
+            self.dropped += 1
+        self.speech.put_nowait(text)
+
+    async def _speech_task(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.engine_thread, self._init_engine)
+            # Messages issued during startup were queued and are spoken now.
+            while True:
+                text = await self.speech.get()
+                if self.engine: await loop.run_in_executor(self.engine_thread, self._say, text)
+        except RuntimeError:
+            pass # close() shut the engine thread down.
+
+    def _say(self, text):
+        try:
+            self.engine.say(text)
+            self.engine.runAndWait()
+        except:
+            pass
+
+    def close(self):
+        """The 'tts' task is cancelled with the control plane; a phrase being spoken is not waited for."""
+        if self.tts:
+            self.speech_task.cancel()
+            self.engine_thread.shutdown(wait=False, cancel_futures=True)
 
     def warn_drowsy(self, speed):
         # Prevent "Driver you are drifting off" spam.
@@ -113,27 +802,47 @@ class DriverVoiceListener:
     """
     def __init__(self, detector_ref):
         self.detector = detector_ref
+        self.sr = None
         self.recognizer = None
         self.microphone = None
         self.stop_listening = None
-        
-        if SR_AVAILABLE:
-            try:
-                self.recognizer = sr.Recognizer()
-                self.recognizer.energy_threshold = 4000 # Adjust for background noise
-                self.microphone = sr.Microphone()
-            except Exception as e:
-                print(f"Mic Init Failed: {e}")
+        self.stopped = False
+        self.init_ms = None
 
     def start(self):
-        if not SR_AVAILABLE or not self.microphone: return
+        """Opens and calibrates the microphone from a control-plane task; returns immediately."""
+        self.sr = optional_import("speech_recognition")
+        if not self.sr: return
+        self.detector.control.spawn(self._start_task(), "microphone")
+
+    async def _start_task(self):
+        await self.detector.control.run_blocking(self._start_listening)
+
+    def stop(self):
+        """Ends background recognition without waiting for a phrase in progress."""
+        self.stopped = True
+        if self.stop_listening:
+            self.stop_listening(wait_for_stop=False)
+            self.stop_listening = None
+
+    def _start_listening(self):
+        t0 = time.perf_counter()
+        try:
+            self.recognizer = self.sr.Recognizer()
+            self.recognizer.energy_threshold = 4000 # Adjust for background noise
+            self.microphone = self.sr.Microphone()
+        except Exception as e:
+            print(f"Mic Init Failed: {e}")
+            return
 
         print("[LISTENER] Calibrating microphone for ambient noise...")
         with self.microphone as source:
             self.recognizer.adjust_for_ambient_noise(source, duration=1)
-        
+        if self.stopped: return # Shut down while calibrating.
+
         # listening in background using a non-blocking thread
         self.stop_listening = self.recognizer.listen_in_background(self.microphone, self.callback)
+        self.init_ms = round((time.perf_counter() - t0) * 1000, 1)
         print("[LISTENER] Voice Command System Active. Waiting for commands...")
 
     def callback(self, recognizer, audio):
@@ -143,9 +852,9 @@ class DriverVoiceListener:
             command = recognizer.recognize_google(audio).lower()
             print(f"[DRIVER] 🗣️ Said: '{command}'")
             self.process_command(command)
-        except sr.UnknownValueError:
+        except self.sr.UnknownValueError:
             pass # Speech was unintelligible
-        except sr.RequestError:
+        except self.sr.RequestError:
             print("[LISTENER] Speech Service Unavailable")
         except Exception as e:
             pass
@@ -176,342 +885,3586 @@ class DriverVoiceListener:
             self.detector.trigger_sos_manual("Direct Voice Command")
 
 
-class IoTClient:
+class TelemetrySpool:
     """
-    Simulates a robust network client with Store-and-Forward capabilities.
+    Disk-backed FIFO of outbound telemetry (SQLite in WAL mode).
+    Survives restarts and long outages. Once max_messages is exceeded the oldest rows are
+    evicted and counted, rather than silently lost from a small in-memory deque.
     """
-    def __init__(self, device_id, detector_ref):
-        self.device_id = device_id
-        self.connected = False
-        self.detector_ref = detector_ref 
+    def __init__(self, path=SPOOL_PATH, max_messages=SPOOL_MAX_MESSAGES):
+        self.path = path
+        self.max_messages = max_messages
         self.lock = threading.Lock()
-        self.offline_buffer = deque(maxlen=100) 
-        threading.Thread(target=self._network_manager_loop, daemon=True).start()
+        self.evicted = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL)")
+        self.db.commit()
 
-    def _network_manager_loop(self):
-        while True:
-            # Simulate Random Network Dropouts
-            if random.random() < 0.05: 
-                self.connected = not self.connected
-            
-            # Flush Buffer if Online
-            if self.connected and len(self.offline_buffer) > 0:
-                with self.lock:
-                    while len(self.offline_buffer) > 0:
-                        self.offline_buffer.popleft()
-                        time.sleep(0.05) 
-            
-            # Simulate Cloud Commands
-            if self.connected and random.random() < 0.02:
-                pass 
+    def extend(self, messages):
+        """Appends a batch of messages in one transaction."""
+        if not messages: return
+        with self.lock:
+            self.db.executemany("INSERT INTO spool (body) VALUES (?)", [(json.dumps(m),) for m in messages])
+            overflow = self._count() - self.max_messages
+            if overflow > 0:
+                self.db.execute("DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (overflow,))
+                self.evicted += overflow
+            self.db.commit()
 
-            time.sleep(1)
+    def peek_batch(self, limit):
+        """Oldest messages first as [(row_id, message), ...]. Rows stay spooled until ack()."""
+        with self.lock:
+            rows = self.db.execute("SELECT id, body FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(body)) for row_id, body in rows]
 
-    def publish_telemetry(self, event_type, payload):
-        message = {
-            "device_id": self.device_id,
-            "timestamp": datetime.datetime.now().isoformat(),
-            "event": event_type,
-            "data": payload
-        }
+    def ack(self, last_id):
+        """Removes every message up to and including last_id once the broker has confirmed them."""
         with self.lock:
-            if not self.connected:
-                self.offline_buffer.append(message)
-    
-    def upload_evidence(self, filename):
-        threading.Thread(target=self._mock_file_upload, args=(filename,)).start()
+            self.db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self.db.commit()
 
-    def _mock_file_upload(self, filename):
-        time.sleep(3) 
-        print(f"[FORENSICS] Upload Complete: {filename} archived in cloud.")
+    def _count(self):
+        return self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
 
+    def __len__(self):
+        with self.lock:
+            return self._count()
 
-class BlackBoxRecorder:
-    """Forensic Event Data Recorder."""
-    def __init__(self, buffer_seconds=5, fps=10):
-        self.buffer_len = buffer_seconds * fps
-        self.frame_buffer = deque(maxlen=self.buffer_len)
-        self.is_recording = False
-        self.post_trigger_frames = 0
-        self.target_post_frames = buffer_seconds * fps
-        self.writer = None
-        self.lock = threading.Lock()
+    def close(self):
+        with self.lock:
+            self.db.close()
 
-    def add_frame(self, frame):
-        if self.is_recording:
-            if self.writer:
-                self.writer.write(frame)
-                self.post_trigger_frames += 1
-                if self.post_trigger_frames >= self.target_post_frames:
-                    self.stop_recording()
-        else:
-            with self.lock:
-                self.frame_buffer.append(frame.copy())
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
 
-    def trigger_incident_save(self, frame_size):
-        if self.is_recording: return 
-        self.is_recording = True
-        self.post_trigger_frames = 0
-        
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.current_filename = f"{EVIDENCE_DIR}/incident_{timestamp}.avi"
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.writer = cv2.VideoWriter(self.current_filename, fourcc, 10.0, frame_size)
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80: return value, pos
+        shift += 7
 
-        with self.lock:
-            for saved_frame in self.frame_buffer:
-                self.writer.write(saved_frame)
-            self.frame_buffer.clear()
-        
-        print(f"\n[BLACK-BOX] INCIDENT TRIGGERED! Recording evidence to {self.current_filename}")
-        return self.current_filename
+def _timestamp_ms(timestamp):
+    if isinstance(timestamp, (int, float)): return int(timestamp * 1000)
+    return int(datetime.datetime.fromisoformat(timestamp).timestamp() * 1000)
 
-    def stop_recording(self):
-        if self.writer:
-            self.writer.release()
-            print(f"[BLACK-BOX] Evidence Saved.")
-            self.writer = None
-        self.is_recording = False
-        return self.current_filename
+class JsonTelemetryCodec:
+    """The original wire format: a JSON array of full messages (device_id and ISO timestamp in each)."""
+    name = "json"
 
-class VehicleTelemetry:
-    """Simulates CAN Bus Speed."""
-    def __init__(self):
-        self.speed = 0 
-        self.target_speed = 60
-        self.last_update = time.time()
-        
-    def update(self):
-        if time.time() - self.last_update > 0.5:
-            if random.random() < 0.1:
-                self.target_speed = random.randint(0, 120)
-            if self.speed < self.target_speed:
-                self.speed += random.randint(1, 5)
-            elif self.speed > self.target_speed:
-                self.speed -= random.randint(1, 5)
-            self.last_update = time.time()
-        return self.speed
+    def encode_batch(self, device_id, messages):
+        return json.dumps(messages).encode()
 
-class DrowsinessDetector:
-    def __init__(self):
-        self.iot = IoTClient(DEVICE_ID, self)
-        self.vehicle = VehicleTelemetry()
-        self.voice = DriverVoiceAssistant() 
-        self.listener = DriverVoiceListener(self) # NEW: Voice Listener
-        self.cap = cv2.VideoCapture(0)
-        self.init_log_file()
-        self.black_box = BlackBoxRecorder(buffer_seconds=5, fps=10)
-        
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-        
-        self.score = 0
-        self.threshold = 15
-        self.font = cv2.FONT_HERSHEY_COMPLEX_SMALL
-        self.last_heartbeat = time.time()
-        
-        self.blink_timestamps = deque(maxlen=10) 
-        self.fatigue_history = deque(maxlen=100) 
-        self.max_score_in_closure = 0 
-        self.eyes_previously_closed = False
-        self.last_evidence_time = 0
-        self.last_advisory_time = 0
-        self.current_env = "DAY"
-        self.sos_verification_pending = False # Prevents spamming
+    def decode_batch(self, data):
+        messages = json.loads(data)
+        return (messages[0]["device_id"] if messages else None), messages
 
-    def init_log_file(self):
-        if not os.path.exists(LOG_FILE):
-            with open(LOG_FILE, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Timestamp", "Device_ID", "Event", "Score", "Speed"])
+class CompactTelemetryCodec:
+    """
+    Batched binary envelope for constrained uplinks.
+    Header: magic, flags (compression, payload encoding), device_id once. Body: message count,
+    base timestamp in epoch ms, then per message a zigzag varint timestamp delta, a one-byte
+    event code (LOG_EVENT_CODES, name spelled out only for unknown events) and the payload as
+    MessagePack (when installed) or compact JSON. The body is zlib- or zstd-compressed.
+    Timestamps keep millisecond precision.
+    """
+    name = "compact"
+    MAGIC = b"ADT1"
+    HEADER = struct.Struct("<4sBH")
+    COMPRESSION_CODES = {None: 0, "zlib": 1, "zstd": 2}
 
-    def log_locally(self, event, score, speed):
-        try:
-            with open(LOG_FILE, mode='a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([datetime.datetime.now().isoformat(), DEVICE_ID, event, score, speed])
-        except Exception:
-            pass
+    def __init__(self, compression=TELEMETRY_COMPRESSION, use_msgpack=MSGPACK_AVAILABLE):
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            compression = "zlib" # zstandard not installed.
+        self.compression = compression
+        self.use_msgpack = use_msgpack and MSGPACK_AVAILABLE
+        self.event_names = {code: name for name, code in LOG_EVENT_CODES.items()}
 
-    def update_threshold(self, new_val):
-        self.threshold = new_val
+    def encode_batch(self, device_id, messages):
+        body = bytearray()
+        _write_varint(body, len(messages))
+        previous = _timestamp_ms(messages[0]["timestamp"]) if messages else 0
+        _write_varint(body, previous)
+        for message in messages:
+            ts = _timestamp_ms(message["timestamp"])
+            delta = ts - previous
+            _write_varint(body, (delta << 1) ^ (delta >> 63)) # Zigzag: clocks can step backwards.
+            previous = ts
+            code = LOG_EVENT_CODES.get(message["event"], 0)
+            body.append(code)
+            if code == 0:
+                name = message["event"].encode()
+                _write_varint(body, len(name))
+                body += name
+            if self.use_msgpack:
+                payload = msgpack.packb(message["data"])
+            else:
+                payload = json.dumps(message["data"], separators=(",", ":")).encode()
+            _write_varint(body, len(payload))
+            body += payload
 
-    def play_alarm(self):
-        try:
-            Beep(2500, 200) 
-        except:
-            print("\a")
-            
-    def check_blink_patterns(self):
-        if len(self.blink_timestamps) < 4: return
-        times = list(self.blink_timestamps)[-4:]
-        if times[-1] - times[0] < 2.5:
-            if not self.sos_verification_pending:
-                print("\n*** RAPID BLINK DETECTED: REQUESTING CONFIRMATION ***")
-                self.request_sos_confirmation()
-            self.blink_timestamps.clear() 
+        if self.compression == "zlib":
+            body = zlib.compress(bytes(body), 6)
+        elif self.compression == "zstd":
+            body = zstandard.ZstdCompressor(level=3).compress(bytes(body))
+        flags = self.COMPRESSION_CODES[self.compression] | (4 if self.use_msgpack else 0)
+        device = device_id.encode()
+        return self.HEADER.pack(self.MAGIC, flags, len(device)) + device + bytes(body)
 
-    def request_sos_confirmation(self):
-        self.sos_verification_pending = True
-        self.voice.speak("SOS sequence detected. Say Confirm to send help, or Cancel to abort.", priority=True)
+    def decode_batch(self, data):
+        magic, flags, device_len = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            raise ValueError("Not a compact telemetry envelope")
+        pos = self.HEADER.size
+        device_id = bytes(data[pos:pos + device_len]).decode()
+        body = bytes(data[pos + device_len:])
+        if flags & 3 == 1:
+            body = zlib.decompress(body)
+        elif flags & 3 == 2:
+            if not ZSTD_AVAILABLE:
+                raise ValueError("Envelope is zstd-compressed but zstandard is not installed")
+            body = zstandard.ZstdDecompressor().decompress(body)
+        if flags & 4 and not MSGPACK_AVAILABLE:
+            raise ValueError("Envelope payloads are MessagePack but msgpack is not installed")
 
-    def trigger_sos_manual(self, method):
-        self.sos_verification_pending = False
-        self.voice.speak("SOS Signal Confirmed. Sending Emergency Alert.", priority=True)
-        self.iot.publish_telemetry("DRIVER_SIGNAL", {"type": "SOS", "method": method})
+        count, pos = _read_varint(body, 0)
+        ts, pos = _read_varint(body, pos)
+        messages = []
+        for _ in range(count):
+            zigzag, pos = _read_varint(body, pos)
+            ts += (zigzag >> 1) ^ -(zigzag & 1)
+            code = body[pos]
+            pos += 1
+            if code == 0:
+                length, pos = _read_varint(body, pos)
+                event = body[pos:pos + length].decode()
+                pos += length
+            else:
+                event = self.event_names.get(code, f"EVENT_{code}")
+            length, pos = _read_varint(body, pos)
+            raw = body[pos:pos + length]
+            pos += length
+            messages.append({
+                "device_id": device_id,
+                "timestamp": datetime.datetime.fromtimestamp(ts / 1000).isoformat(timespec="milliseconds"),
+                "event": event,
+                "data": msgpack.unpackb(raw) if flags & 4 else json.loads(raw)
+            })
+        return device_id, messages
 
-    def cancel_sos(self):
-        self.sos_verification_pending = False
-        self.voice.speak("SOS Request Cancelled.", priority=True)
+def create_telemetry_codec(wire_format=None):
+    if (wire_format or TELEMETRY_WIRE_FORMAT) == "json":
+        return JsonTelemetryCodec()
+    return CompactTelemetryCodec()
 
-    def reset_alert_state(self, source):
-        self.score = 0
-        self.iot.publish_telemetry("STATUS_RESET", {"source": source})
+def decode_telemetry(data):
+    """Decodes one uplink envelope of either wire format. Returns (device_id, messages)."""
+    if bytes(data[:4]) == CompactTelemetryCodec.MAGIC:
+        return CompactTelemetryCodec().decode_batch(data)
+    return JsonTelemetryCodec().decode_batch(data)
 
-    def analyze_environment(self, gray_frame):
-        avg_brightness = np.mean(gray_frame)
-        status = "DAY"
-        if avg_brightness < 50: status = "NIGHT"
-        elif avg_brightness > 200: status = "GLARE"
-        
-        # Voice Trigger for Environment Change
-        if status != self.current_env:
-             self.voice.chat_environment(status)
-             self.current_env = status
-             
-        return avg_brightness, status
+class LocalBrokerStandIn:
+    """
+    In-process stand-in for the cloud MQTT broker.
+    Simulates link dropouts (about `outage_rate` toggles per second, like the old client
+    loop did) and acknowledges whole batches, so the store-and-forward path can be
+    exercised without a network.
+    """
+    def __init__(self, outage_rate=0.05, capture_dir=TELEMETRY_CAPTURE_DIR):
+        self.outage_rate = outage_rate
+        self.capture_dir = capture_dir
+        if capture_dir: os.makedirs(capture_dir, exist_ok=True)
+        self.online = False
+        self.last_check = time.time()
+        self.received = 0
+        self.bytes_received = 0
+        self.batches = 0
+        self.lock = threading.Lock()
 
-    def run(self):
-        if not self.cap.isOpened():
-            print("Error: Webcam not found.")
-            return
+    def _update_link(self):
+        now = time.time()
+        if random.random() < self.outage_rate * (now - self.last_check):
+            self.online = not self.online
+        self.last_check = now
 
-        self.listener.start() # Start listening in background
-        self.voice.speak("System Online. Voice Commands Active.")
-        print(f"System Active. CAN Bus Link Established.")
+    def connect(self):
+        with self.lock:
+            self._update_link()
+            if not self.online and random.random() < 0.5:
+                self.online = True # Reconnect attempts succeed half the time once the tunnel clears.
+            if not self.online:
+                raise ConnectionError("broker unreachable")
+
+    def publish_batch(self, envelope, count):
+        """Takes one encoded envelope of `count` messages. Returns the number acknowledged, or raises ConnectionError."""
+        with self.lock:
+            self._update_link()
+            if not self.online:
+                raise ConnectionError("link dropped during publish")
+            if self.capture_dir:
+                with open(os.path.join(self.capture_dir, f"envelope_{self.batches:06d}.bin"), "wb") as file:
+                    file.write(envelope)
+            self.received += count
+            self.bytes_received += len(envelope)
+            self.batches += 1
+            return count
+
+class BandwidthLimiter:
+    """Token bucket shared by every upload. reserve() says how long to wait before sending `amount` bytes."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.throttled = 0.0
+
+    def reserve(self, amount):
+        """Takes `amount` bytes from the bucket. Returns the seconds to wait before sending them."""
+        if not self.rate: return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount # May go negative; later callers wait the debt off.
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.throttled += delay
+        return delay
+
+class UploadProgressStore:
+    """
+    Persistent evidence upload state (SQLite, normally the telemetry spool database).
+    A file is 'recording' while the black box is still writing it, 'ready' once it is closed,
+    then 'done' (or 'missing' if it disappeared). Its chunk manifest and every acknowledged
+    chunk are recorded, so an upload resumes at the first unsent chunk after a dropped link
+    or a reboot.
+    """
+    def __init__(self, path=SPOOL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS uploads (path TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                        "file_id TEXT, size INTEGER, chunk_size INTEGER, bytes_sent INTEGER NOT NULL DEFAULT 0, "
+                        "added REAL NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS upload_chunks (path TEXT NOT NULL, idx INTEGER NOT NULL, "
+                        "hash TEXT NOT NULL, done INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (path, idx))")
+        # Whoever was writing these files is gone; upload what made it to disk.
+        self.db.execute("UPDATE uploads SET state = 'ready' WHERE state = 'recording'")
+        self.db.commit()
+
+    def add(self, path, state):
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO uploads (path, state, added) VALUES (?, ?, ?)", (path, state, time.time()))
+            self.db.execute("UPDATE uploads SET state = ? WHERE path = ? AND state = 'recording'", (state, path))
+            self.db.commit()
+
+    def next_ready(self, exclude=()):
+        """Oldest ready file not in `exclude`, or None."""
+        with self.lock:
+            rows = self.db.execute("SELECT path FROM uploads WHERE state = 'ready' ORDER BY added").fetchall()
+        return next((path for path, in rows if path not in exclude), None)
+
+    def set_manifest(self, path, file_id, size, chunk_size, hashes):
+        with self.lock:
+            self.db.execute("DELETE FROM upload_chunks WHERE path = ?", (path,))
+            self.db.executemany("INSERT INTO upload_chunks (path, idx, hash) VALUES (?, ?, ?)",
+                                [(path, i, h) for i, h in enumerate(hashes)])
+            self.db.execute("UPDATE uploads SET file_id = ?, size = ?, chunk_size = ? WHERE path = ?",
+                            (file_id, size, chunk_size, path))
+            self.db.commit()
+
+    def manifest(self, path):
+        """(file_id, size, chunk_size, [(idx, hash, done), ...]), or None if the file has not been hashed yet."""
+        with self.lock:
+            row = self.db.execute("SELECT file_id, size, chunk_size FROM uploads WHERE path = ?", (path,)).fetchone()
+            if row is None or row[0] is None: return None
+            chunks = self.db.execute("SELECT idx, hash, done FROM upload_chunks WHERE path = ? ORDER BY idx", (path,)).fetchall()
+        return row[0], row[1], row[2], [(idx, digest, bool(done)) for idx, digest, done in chunks]
+
+    def chunk_done(self, path, idx, nbytes):
+        with self.lock:
+            self.db.execute("UPDATE upload_chunks SET done = 1 WHERE path = ? AND idx = ?", (path, idx))
+            self.db.execute("UPDATE uploads SET bytes_sent = bytes_sent + ? WHERE path = ?", (nbytes, path))
+            self.db.commit()
+
+    def chunks_missing(self, path, hashes):
+        """The server does not have these chunks (any more); send them again."""
+        with self.lock:
+            self.db.executemany("UPDATE upload_chunks SET done = 0 WHERE path = ? AND hash = ?", [(path, h) for h in hashes])
+            self.db.commit()
+
+    def finish(self, path, state="done"):
+        with self.lock:
+            self.db.execute("UPDATE uploads SET state = ? WHERE path = ?", (state, path))
+            self.db.execute("DELETE FROM upload_chunks WHERE path = ?", (path,))
+            self.db.commit()
+
+    def counts(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT state, COUNT(*) FROM uploads GROUP BY state").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class LocalEvidenceServer:
+    """
+    HTTP stand-in for the cloud evidence endpoint, for offline runs and tests.
+    PUT /chunks/<sha256> stores one chunk (the body must match its hash; a chunk already held is
+    acknowledged without being stored again). POST /evidence/<file_id> with the JSON manifest
+    {"name", "size", "chunks": [sha256, ...]} answers {"complete", "missing"} and assembles the
+    file under root/files once nothing is missing. failure_rate drops that share of requests
+    without a response, like a flaky cellular link.
+    """
+    def __init__(self, root=EVIDENCE_STANDIN_DIR, host="127.0.0.1", port=0, failure_rate=0.0):
+        self.root = root
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.chunks_received = 0
+        self.bytes_received = 0
+        self.duplicates = 0
+        self.files_completed = 0
+        self.dropped = 0
+        os.makedirs(os.path.join(root, "chunks"), exist_ok=True)
+        os.makedirs(os.path.join(root, "files"), exist_ok=True)
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_PUT(self):
+                body = self._read_body()
+                if body is None: return
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 2 or parts[0] != "chunks":
+                    return self._reply(404, {"error": "unknown path"})
+                self._reply(*server._store_chunk(parts[1], body))
+
+            def do_POST(self):
+                body = self._read_body()
+                if body is None: return
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 2 or parts[0] != "evidence":
+                    return self._reply(404, {"error": "unknown path"})
+                try:
+                    manifest = json.loads(body)
+                except ValueError:
+                    return self._reply(400, {"error": "manifest is not JSON"})
+                self._reply(*server._commit(parts[1], manifest))
+
+            def _read_body(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if random.random() < server.failure_rate:
+                    with server.lock:
+                        server.dropped += 1
+                    self.close_connection = True # Hang up without answering.
+                    return None
+                return body
+
+            def _reply(self, code, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.root, "chunks", digest)
+
+    def _store_chunk(self, digest, body):
+        if hashlib.sha256(body).hexdigest() != digest:
+            return 400, {"error": "chunk does not match its hash"}
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            with self.lock:
+                self.duplicates += 1
+            return 200, {"stored": False}
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(body)
+        os.replace(tmp, path)
+        with self.lock:
+            self.chunks_received += 1
+            self.bytes_received += len(body)
+        return 201, {"stored": True}
+
+    def _commit(self, file_id, manifest):
+        chunks = manifest.get("chunks", [])
+        if evidence_file_id(chunks) != file_id:
+            return 400, {"error": "file_id does not match the chunk list"}
+        missing = [digest for digest in chunks if not os.path.exists(self._chunk_path(digest))]
+        if missing:
+            return 200, {"complete": False, "missing": missing}
+        target = os.path.join(self.root, "files", f"{file_id[:16]}_{os.path.basename(manifest.get('name', 'evidence'))}")
+        if not os.path.exists(target):
+            with open(target + ".tmp", "wb") as out:
+                for digest in chunks:
+                    with open(self._chunk_path(digest), "rb") as file:
+                        out.write(file.read())
+            if os.path.getsize(target + ".tmp") != manifest.get("size"):
+                os.remove(target + ".tmp")
+                return 400, {"error": "assembled size does not match the manifest"}
+            os.replace(target + ".tmp", target)
+            with self.lock:
+                self.files_completed += 1
+        return 200, {"complete": True, "missing": []}
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
 
+    def stats(self):
+        with self.lock:
+            return {
+                "chunks_received": self.chunks_received,
+                "bytes_received": self.bytes_received,
+                "duplicate_chunks": self.duplicates,
+                "files_completed": self.files_completed,
+                "dropped_requests": self.dropped
+            }
+
+def evidence_file_id(chunk_hashes):
+    """Content identity of a file: the SHA-256 of its chunk hashes, in order."""
+    return hashlib.sha256("".join(chunk_hashes).encode()).hexdigest()
+
+class EvidenceUploader:
+    """
+    Chunked, resumable upload of incident files.
+    Files are split into chunk_size pieces identified by their SHA-256, so a chunk the server
+    already holds (from an interrupted attempt or an identical file) is never sent twice.
+    Progress lives in an UploadProgressStore; a dropped link only loses the chunk in flight.
+    At most `workers` files upload at once, all sharing one BandwidthLimiter, and failures
+    back off exponentially like the telemetry link. base_url="standin" starts a LocalEvidenceServer
+    stand-in; with no base_url nothing is uploaded, but ready files are still recorded, so a
+    later run with an endpoint sends them. Workers are ControlPlane tasks: they sleep until a
+    file is ready, and HTTP and SQLite calls run on the control plane's executor.
+    """
+    def __init__(self, progress, base_url=EVIDENCE_UPLOAD_URL, workers=EVIDENCE_UPLOAD_WORKERS,
+                 chunk_size=EVIDENCE_CHUNK_SIZE, rate=EVIDENCE_UPLOAD_BPS, timeout=EVIDENCE_UPLOAD_TIMEOUT,
+                 control=None):
+        self.progress = progress
+        self.standin = LocalEvidenceServer() if base_url == "standin" else None
+        self.base_url = (self.standin.url if self.standin else base_url or "").rstrip("/") or None
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.limiter = BandwidthLimiter(rate)
+        self.control = control or ControlPlane("evidence-upload")
+        self.owns_control = control is None
+        self.wake = self.control.create(asyncio.Event) # A file became ready.
+        self.stop_event = self.control.create(asyncio.Event)
+        self.claim_lock = self.control.create(asyncio.Lock)
+        self.active = set() # Files currently claimed by a worker.
+
+        self.files_uploaded = 0
+        self.chunks_sent = 0
+        self.chunks_skipped = 0
+        self.bytes_sent = 0
+        self.retries = 0
+        workers = max(1, workers) if self.base_url else 0
+        self.workers = [self.control.spawn(self._worker(), f"evidence-upload-{i}") for i in range(workers)]
+
+    def enqueue(self, path):
+        """Registers an incident file that is still being written. It is uploaded after file_ready()."""
+        self.progress.add(path, "recording")
+
+    def file_ready(self, path):
+        self.progress.add(path, "ready")
+        if not self.base_url:
+            print(f"[FORENSICS] {path} kept on the device: no EVIDENCE_UPLOAD_URL configured.")
+        self.control.call(self.wake.set)
+
+    async def _next_file(self):
+        """Claims the oldest ready file no other worker has, waiting until there is one. None once stopping."""
+        while not self.stop_event.is_set():
+            async with self.claim_lock:
+                self.wake.clear()
+                path = await self.control.run_blocking(self.progress.next_ready, frozenset(self.active))
+                if path is not None:
+                    self.active.add(path)
+                    return path
+            await self.wake.wait()
+        return None
+
+    async def _pause(self, seconds):
+        """Sleeps unless the uploader is stopped first."""
+        if seconds > 0: await self.control.wait(self.stop_event, seconds)
+
+    async def _worker(self):
+        backoff = RECONNECT_BACKOFF_MIN
         while True:
-            ret, frame = self.cap.read()
-            if not ret: break
+            path = await self._next_file()
+            if path is None: return
+            sent = self.chunks_sent
+            try:
+                if await self._upload(path):
+                    backoff = RECONNECT_BACKOFF_MIN
+            except (OSError, ValueError) as e: # URLError, HTTPError and dropped connections are OSErrors.
+                self.retries += 1
+                if self.chunks_sent > sent: backoff = RECONNECT_BACKOFF_MIN # Flaky, not down.
+                print(f"[FORENSICS] Upload of {path} interrupted ({e}); resuming in {backoff:.0f}s.")
+                await self._pause(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+            finally:
+                self.active.discard(path)
+                self.wake.set() # The file is free again for whichever worker is idle.
 
-            height, width = frame.shape[:2]
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            current_speed = self.vehicle.update()
-            
-            # ADAPTIVE THRESHOLD LOGIC
-            if current_speed < 5:
-                self.threshold = 999 # Parked
-                drive_mode = "PARKED"
-            elif current_speed > 80:
-                self.threshold = 10 # Highway
-                drive_mode = "HIGHWAY"
+    def _stop(self):
+        self.stop_event.set()
+        self.wake.set()
+
+    def _hash_file(self, path):
+        hashes = []
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(self.chunk_size)
+                if not data: break
+                hashes.append(hashlib.sha256(data).hexdigest())
+        file_id = evidence_file_id(hashes)
+        self.progress.set_manifest(path, file_id, os.path.getsize(path), self.chunk_size, hashes)
+        return self.progress.manifest(path)
+
+    def _request(self, method, url_path, body, content_type="application/octet-stream"):
+        request = urllib.request.Request(self.base_url + url_path, data=body, method=method,
+                                         headers={"Content-Type": content_type})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read() or b"{}")
+
+    def _commit(self, path, file_id, size, chunks):
+        manifest = {"name": os.path.basename(path), "size": size, "chunks": [digest for _, digest, _ in chunks]}
+        return self._request("POST", f"/evidence/{file_id}", json.dumps(manifest).encode(), "application/json")
+
+    def _send_chunk(self, path, idx, digest, chunk_size):
+        with open(path, "rb") as file:
+            file.seek(idx * chunk_size)
+            data = file.read(chunk_size)
+        if hashlib.sha256(data).hexdigest() != digest:
+            self.progress.set_manifest(path, None, None, None, []) # File changed on disk, hash it again.
+            raise ValueError("file changed since it was hashed")
+        self._request("PUT", f"/chunks/{digest}", data)
+        self.progress.chunk_done(path, idx, len(data))
+        return len(data)
+
+    async def _upload(self, path):
+        """Sends whatever the server is missing. Returns True once the file is complete on the server."""
+        run = self.control.run_blocking
+        if not os.path.exists(path):
+            print(f"[FORENSICS] {path} no longer exists, upload abandoned.")
+            await run(self.progress.finish, path, "missing")
+            return True
+        manifest = await run(self.progress.manifest, path) or await run(self._hash_file, path)
+        file_id, size, chunk_size, chunks = manifest
+
+        # Ask first: after a reboot or a lost acknowledgement the server may already hold chunks.
+        missing = set((await run(self._commit, path, file_id, size, chunks))["missing"])
+        for idx, digest, done in chunks:
+            if self.stop_event.is_set(): return False
+            if done or digest not in missing:
+                if not done:
+                    await run(self.progress.chunk_done, path, idx, 0)
+                    self.chunks_skipped += 1
+                continue
+            await self._pause(self.limiter.reserve(min(chunk_size, size - idx * chunk_size)))
+            if self.stop_event.is_set(): return False
+            nbytes = await run(self._send_chunk, path, idx, digest, chunk_size)
+            self.chunks_sent += 1
+            self.bytes_sent += nbytes
+
+        result = await run(self._commit, path, file_id, size, chunks)
+        if not result["complete"]:
+            await run(self.progress.chunks_missing, path, result["missing"])
+            raise ValueError(f"server is still missing {len(result['missing'])} chunks")
+        await run(self.progress.finish, path)
+        self.files_uploaded += 1
+        print(f"[FORENSICS] Upload Complete: {path} archived in cloud ({size} bytes, {len(chunks)} chunks).")
+        return True
+
+    def stats(self):
+        stats = {
+            "endpoint": self.base_url,
+            "files": self.progress.counts(),
+            "active": len(self.active),
+            "files_uploaded": self.files_uploaded,
+            "chunks_sent": self.chunks_sent,
+            "chunks_skipped": self.chunks_skipped,
+            "bytes_sent": self.bytes_sent,
+            "retries": self.retries,
+            "throttled_s": round(self.limiter.throttled, 2)
+        }
+        if self.standin: stats["standin"] = self.standin.stats()
+        return stats
+
+    def close(self, timeout=5):
+        """Stops after the chunk in flight (cancelled after `timeout`); the rest resumes on the next start."""
+        self.control.call(self._stop)
+        concurrent.futures.wait(self.workers, timeout)
+        for w in self.workers:
+            w.cancel()
+        if self.owns_control: self.control.stop()
+        if self.standin: self.standin.stop()
+        self.progress.close()
+
+class IoTClient:
+    """
+    Network client with Store-and-Forward capabilities.
+    publish_telemetry() is an in-memory append. The link task on the control plane moves messages
+    into a persistent spool and drains it in acknowledged batches, reconnecting with exponential
+    backoff. It sleeps until a message is published instead of polling.
+    """
+    def __init__(self, device_id, detector_ref, broker=None, spool=None, codec=None, uploader=None,
+                 control=None):
+        self.device_id = device_id
+        self.codec = codec or create_telemetry_codec()
+        self.connected = False
+        self.detector_ref = detector_ref
+        self.lock = threading.Lock()
+        self.pending = deque() # Not yet spooled.
+        self.broker = broker or LocalBrokerStandIn()
+        self.spool = spool if spool is not None else TelemetrySpool()
+        self.control = control or ControlPlane(f"iot-{device_id}")
+        self.owns_control = control is None
+        self.uploader = uploader or EvidenceUploader(UploadProgressStore(getattr(self.spool, "path", SPOOL_PATH)),
+                                                     control=self.control)
+        self.wake = self.control.create(asyncio.Event)
+        self.wake_requested = False # Set by publishers, so a burst schedules one wake-up.
+        self.closing = self.control.create(asyncio.Event)
+        self.stop_event = threading.Event() # Checked by the blocking drain between batches.
+        self.published = 0
+        self.bytes_sent = 0
+        self.reconnects = 0
+        self.worker = self.control.spawn(self._network_task(), f"iot-link-{device_id}")
+
+    async def _network_task(self):
+        run = self.control.run_blocking
+        backoff = RECONNECT_BACKOFF_MIN
+        while not self.stop_event.is_set():
+            self.wake_requested = False
+            self.wake.clear()
+            await run(self._spool_pending)
+
+            if not self.connected:
+                try:
+                    await run(self.broker.connect)
+                    self.connected = True
+                    self.reconnects += 1
+                    backoff = RECONNECT_BACKOFF_MIN
+                except ConnectionError:
+                    await self.control.wait(self.closing, backoff * random.uniform(0.5, 1.0))
+                    backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                    continue
+
+            await run(self._drain_spool)
+            if not self.connected:
+                # The link dropped mid-drain: reconnect after a backoff, not on the next publish.
+                await self.control.wait(self.closing, backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+            await self.wake.wait()
+
+    def _stop(self):
+        self.closing.set()
+        self.wake.set()
+
+    def _spool_pending(self):
+        with self.lock:
+            batch = list(self.pending)
+            self.pending.clear()
+        try:
+            self.spool.extend(batch)
+        except Exception as e:
+            print(f"[IOT] Spool write failed: {e}")
+            with self.lock:
+                self.pending.extendleft(reversed(batch))
+
+    def _drain_spool(self):
+        while self.connected and not self.stop_event.is_set():
+            batch = self.spool.peek_batch(PUBLISH_BATCH_SIZE)
+            if not batch: return
+            envelope = self.codec.encode_batch(self.device_id, [m for _, m in batch])
+            try:
+                acked = self.broker.publish_batch(envelope, len(batch))
+            except ConnectionError:
+                self.connected = False
+                return
+            if acked:
+                self.spool.ack(batch[acked - 1][0])
+                self.published += acked
+                self.bytes_sent += len(envelope)
+
+    def publish_telemetry(self, event_type, payload):
+        t0 = time.perf_counter()
+        message = {
+            "device_id": self.device_id,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "event": event_type,
+            "data": payload
+        }
+        with self.lock:
+            self.pending.append(message)
+        if not self.wake_requested:
+            self.wake_requested = True
+            self.control.call(self.wake.set)
+        profiler = getattr(self.detector_ref, "profiler", None)
+        if profiler: profiler.record("telemetry_publish", time.perf_counter() - t0)
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "pending": len(self.pending),
+            "spooled": len(self.spool),
+            "evicted": self.spool.evicted,
+            "published": self.published,
+            "wire_format": self.codec.name,
+            "bytes_sent": self.bytes_sent,
+            "reconnects": self.reconnects,
+            "evidence": self.uploader.stats()
+        }
+
+    def close(self, timeout=5):
+        """Stops the link task (cancelled after `timeout`) and persists anything not yet spooled."""
+        self.stop_event.set()
+        self.control.call(self._stop)
+        concurrent.futures.wait([self.worker], timeout)
+        self.worker.cancel()
+        self.uploader.close(timeout)
+        self._spool_pending()
+        self.spool.close()
+        if self.owns_control: self.control.stop()
+
+    def attach(self, bus):
+        bus.subscribe("telemetry", self._on_event, TELEMETRY_EVENTS, coalesce=("ALERT", "HEARTBEAT"))
+        bus.subscribe("uploader", self._on_evidence, ("EVIDENCE_CREATED", "EVIDENCE_SAVED"))
+
+    def _on_event(self, event):
+        payload = event.payload
+        if event.repeats > 1:
+            payload = dict(payload, repeats=event.repeats)
+        self.publish_telemetry(event.type, payload)
+
+    def _on_evidence(self, event):
+        # Registered when recording starts, uploaded once the encoder has closed the file.
+        if event.type == "EVIDENCE_CREATED":
+            self.uploader.enqueue(event.payload["filename"])
+        else:
+            self.uploader.file_ready(event.payload["filename"])
+
+    def upload_evidence(self, filename):
+        """Queues a finished file for chunked upload. Returns immediately."""
+        self.uploader.file_ready(filename)
+
+
+class IncidentEncoder:
+    """
+    Background XVID encoder for black-box incidents.
+    The frame loop only enqueues jobs; VideoWriter writes and the final release() happen on
+    this worker, so disk I/O never runs on the capture or scoring threads. Enqueueing never
+    blocks: when too many frames are pending the newest one is dropped and counted.
+    """
+    def __init__(self, max_pending=ENCODER_QUEUE_DEPTH):
+        self.max_pending = max_pending
+        self.jobs = deque()
+        self.cond = threading.Condition()
+        self.pending_frames = 0
+        self.busy = False
+        self.writer = None
+        self.frame_size = None
+        self.filename = None
+        self.on_closed = None # Called with the filename on the encoder thread once a file is complete.
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.frames_written = 0
+        self.encode_time = 0.0
+        self.files_completed = 0
+        self.thread = threading.Thread(target=self._encode_loop, name="incident-encoder", daemon=True)
+        self.thread.start()
+
+    def open(self, filename, frame_size, fps=10.0):
+        self._submit(("open", filename, frame_size, fps))
+
+    def write_backlog(self, chunks):
+        """Queues pre-trigger frames. The encoder takes ownership of the arrays, they must not be reused."""
+        self._submit(("backlog", chunks))
+
+    def write_encoded_backlog(self, blobs):
+        """Queues JPEG-encoded pre-trigger frames; they are decoded on the encoder thread."""
+        self._submit(("encoded_backlog", blobs))
+
+    def write(self, frame):
+        return self._submit(("frame", frame), droppable=True)
+
+    def close(self):
+        self._submit(("close",))
+
+    def stop(self, timeout=None):
+        """Ends the encoder thread after the jobs queued so far."""
+        self._submit(("stop",))
+        self.thread.join(timeout)
+
+    def _submit(self, job, droppable=False):
+        with self.cond:
+            if droppable:
+                if self.pending_frames >= self.max_pending:
+                    self.dropped += 1
+                    return False
+                self.pending_frames += 1
+                self.enqueued += 1
+                self.high_water = max(self.high_water, self.pending_frames)
+            self.jobs.append(job)
+            self.cond.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """Waits until every queued job is encoded. For shutdown only, never call from the frame loop."""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.jobs and not self.busy, timeout)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending_frames": self.pending_frames,
+                "high_water": self.high_water,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "frames_written": self.frames_written,
+                "avg_write_ms": round(1000 * self.encode_time / self.frames_written, 2) if self.frames_written else 0.0,
+                "files_completed": self.files_completed
+            }
+
+    def _encode_loop(self):
+        while True:
+            with self.cond:
+                while not self.jobs:
+                    self.busy = False
+                    self.cond.notify_all()
+                    self.cond.wait()
+                job = self.jobs.popleft()
+                if job[0] == "stop":
+                    self.busy = False
+                    self.cond.notify_all()
+                    return
+                self.busy = True
+                if job[0] == "frame": self.pending_frames -= 1
+
+            t0 = time.perf_counter()
+            written = 0
+            try:
+                if job[0] == "open":
+                    _, filename, frame_size, fps = job
+                    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+                    self.writer = cv2.VideoWriter(filename, fourcc, fps, frame_size)
+                    self.filename = filename
+                    self.frame_size = tuple(frame_size)
+                elif job[0] == "backlog" and self.writer:
+                    for chunk in job[1]:
+                        for saved_frame in chunk:
+                            self._write_frame(saved_frame)
+                            written += 1
+                elif job[0] == "encoded_backlog" and self.writer:
+                    for blob in job[1]:
+                        self._write_frame(cv2.imdecode(np.frombuffer(blob, dtype=np.uint8), cv2.IMREAD_COLOR))
+                        written += 1
+                elif job[0] == "frame" and self.writer:
+                    self._write_frame(job[1])
+                    written = 1
+                elif job[0] == "close" and self.writer:
+                    self.writer.release()
+                    self.writer = None
+                    with self.cond:
+                        self.files_completed += 1
+                    print(f"[BLACK-BOX] Evidence Saved.")
+                    if self.on_closed: self.on_closed(self.filename)
+            except Exception as e:
+                print(f"[BLACK-BOX] Encoder error: {e}")
+
+            if written:
+                with self.cond:
+                    self.frames_written += written
+                    self.encode_time += time.perf_counter() - t0
+
+    def _write_frame(self, frame):
+        # VideoWriter silently drops frames of another size, which happens when the
+        # governor switches capture resolution mid-incident.
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        if frame.ndim == 2: frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) # Luma capture; the writer expects BGR.
+        self.writer.write(frame)
+
+class CompressedFrameRing:
+    """
+    Pre-incident frames kept JPEG-encoded, for long black-box windows on small devices.
+    add() copies the frame into one of a few preallocated staging buffers and returns; a
+    worker thread encodes it. The oldest frames are evicted beyond max_frames or max_bytes,
+    so memory stays within a fixed budget however long the window is. When the encoder
+    falls behind, new frames are dropped (and counted) rather than queued.
+    """
+    def __init__(self, max_frames, max_bytes=BLACK_BOX_MEMORY_CAP, quality=BLACK_BOX_JPEG_QUALITY,
+                 scale=BLACK_BOX_SCALE, staging=4):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.scale = scale
+        self.staging = staging
+        self.allocated = 0
+        self.free = [] # Staging buffers ready for reuse.
+        self.pending = deque()
+        self.frames = deque() # Encoded frames, oldest first.
+        self.bytes = 0
+        self.busy = False
+        self.cond = threading.Condition()
+
+        self.encoded = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.encode_time = 0.0
+        threading.Thread(target=self._encode_loop, daemon=True).start()
+
+    def add(self, frame):
+        with self.cond:
+            buf = self._take_buffer(frame)
+            if buf is None:
+                self.dropped += 1
+                return False
+        np.copyto(buf, frame) # Outside the lock; the HUD is drawn onto `frame` afterwards.
+        with self.cond:
+            self.pending.append(buf)
+            self.cond.notify_all()
+        return True
+
+    def _take_buffer(self, frame):
+        for i, buf in enumerate(self.free):
+            if buf.shape == frame.shape and buf.dtype == frame.dtype:
+                return self.free.pop(i)
+        if self.allocated < self.staging:
+            self.allocated += 1
+            return np.empty_like(frame)
+        if self.free:
+            self.free.pop() # Frame shape changed, replace a stale buffer.
+            return np.empty_like(frame)
+        return None
+
+    def _encode_loop(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.busy = False
+                    self.cond.notify_all()
+                    self.cond.wait()
+                buf = self.pending.popleft()
+                self.busy = True
+
+            t0 = time.perf_counter()
+            image = buf
+            if self.scale < 1.0:
+                image = cv2.resize(buf, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            ok, blob = cv2.imencode(".jpg", image, self.params)
+            elapsed = time.perf_counter() - t0
+
+            with self.cond:
+                self.free.append(buf)
+                if not ok:
+                    self.dropped += 1
+                    continue
+                self.frames.append(blob.tobytes())
+                self.bytes += len(self.frames[-1])
+                self.encoded += 1
+                self.encode_time += elapsed
+                while self.frames and (len(self.frames) > self.max_frames or self.bytes > self.max_bytes):
+                    self.bytes -= len(self.frames.popleft())
+                    self.evicted += 1
+
+    def drain(self, timeout=1.0):
+        """Waits until every staged frame is encoded, so a trigger sees the complete history."""
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def take(self):
+        """Removes and returns the encoded frames, oldest first."""
+        with self.cond:
+            blobs = list(self.frames)
+            self.frames.clear()
+            self.bytes = 0
+            return blobs
+
+    def stats(self):
+        with self.cond:
+            return {
+                "frames": len(self.frames),
+                "bytes": self.bytes,
+                "avg_frame_kb": round(self.bytes / len(self.frames) / 1024, 1) if self.frames else 0.0,
+                "encoded": self.encoded,
+                "dropped": self.dropped,
+                "evicted": self.evicted,
+                "avg_encode_ms": round(1000 * self.encode_time / self.encoded, 2) if self.encoded else 0.0
+            }
+
+class BlackBoxRecorder:
+    """
+    Forensic Event Data Recorder.
+    In "raw" mode pre-incident frames live in a preallocated [buffer_len, H, W, 3] ring that is
+    written in place, so steady-state memory is fixed and buffering a frame allocates nothing.
+    In "jpeg" mode they go to a CompressedFrameRing, which holds a much longer window within
+    BLACK_BOX_MEMORY_CAP and is decoded into the incident file on trigger.
+    """
+    def __init__(self, buffer_seconds=BLACK_BOX_SECONDS, fps=10, evidence_dir=EVIDENCE_DIR,
+                 mode=BLACK_BOX_MODE, post_seconds=BLACK_BOX_POST_SECONDS):
+        self.buffer_len = buffer_seconds * fps
+        self.evidence_dir = evidence_dir
+        os.makedirs(evidence_dir, exist_ok=True)
+        self.compressed = CompressedFrameRing(self.buffer_len) if mode == "jpeg" else None
+        self.ring = None # Raw mode. Allocated on the first frame, reallocated only if the frame shape changes.
+        self.ring_head = 0 # Next slot to write.
+        self.ring_count = 0
+        self.is_recording = False
+        self.post_trigger_frames = 0
+        self.target_post_frames = post_seconds * fps
+        self.encoder = IncidentEncoder()
+        self.encoder.on_closed = self._on_file_saved
+        self.current_filename = None
+        self.frame_size = None
+        self.bus = None
+        self.clock = time.time
+        self.cooldown = EVIDENCE_COOLDOWN
+        self.last_evidence_time = None
+        self.lock = threading.RLock() # The frame loop and the event bus ('black_box' subscriber) both start/stop recordings.
+
+    def attach(self, bus, clock=time.time, cooldown=EVIDENCE_COOLDOWN):
+        self.bus = bus
+        self.clock = clock
+        self.cooldown = cooldown
+        bus.subscribe("black_box", self.on_alert, ("ALERT",), coalesce=("ALERT",))
+
+    def on_alert(self, event):
+        now = self.clock()
+        if self.frame_size is None: return
+        if self.last_evidence_time is not None and now - self.last_evidence_time <= self.cooldown: return
+        filename = self.trigger_incident_save(self.frame_size)
+        if filename is None: return
+        self.last_evidence_time = now
+        self.bus.publish("EVIDENCE_CREATED", {"filename": filename, "speed": event.payload["speed"]})
+
+    def _on_file_saved(self, filename):
+        if self.bus: self.bus.publish("EVIDENCE_SAVED", {"filename": filename})
+
+    def add_frame(self, frame):
+        self.frame_size = (frame.shape[1], frame.shape[0])
+        with self.lock:
+            if self.is_recording:
+                # Copied because the HUD is drawn onto this frame after it is buffered.
+                self.encoder.write(frame.copy())
+                self.post_trigger_frames += 1
+                if self.post_trigger_frames >= self.target_post_frames:
+                    self.stop_recording()
+            elif self.compressed:
+                self.compressed.add(frame)
             else:
-                self.threshold = 20 # City
-                drive_mode = "CITY"
-            
-            luminance, env_status = self.analyze_environment(gray)
-            self.black_box.add_frame(frame)
-            faces = self.face_cascade.detectMultiScale(gray, minNeighbors=5, scaleFactor=1.1, minSize=(25,25))
-            
-            cv2.rectangle(frame, (0,height-60), (width,height), (0,0,0), -1) 
-            cv2.rectangle(frame, (0,0), (width, 40), (0,0,0), -1)
-            
-            if time.time() - self.last_heartbeat > 10:
-                self.iot.publish_telemetry("HEARTBEAT", {
-                    "status": "ok", 
-                    "speed": current_speed,
-                    "mode": drive_mode
-                })
-                self.last_heartbeat = time.time()
-
-            face_detected = False
-            eyes_detected = False
-
-            for (x, y, w, h) in faces:
-                face_detected = True
-                cv2.rectangle(frame, (x, y), (x+w, y+h), (100, 100, 100), 1)
-                roi_gray = gray[y:y+h, x:x+w]
-                eyes = self.eye_cascade.detectMultiScale(roi_gray, minNeighbors=10)
-                for (ex, ey, ew, eh) in eyes:
-                    eyes_detected = True
-                    cv2.rectangle(frame[y:y+h, x:x+w], (ex, ey), (ex+ew, ey+eh), (0, 255, 0), 2)
-
-            # Scoring Logic
-            if face_detected:
-                if not eyes_detected:
-                    self.score += 1
-                    self.max_score_in_closure = max(self.max_score_in_closure, self.score)
-                    self.eyes_previously_closed = True
-                    cv2.putText(frame, "EYES CLOSED", (10, height-20), self.font, 1, (0, 0, 255), 2)
-                else:
-                    if self.eyes_previously_closed:
-                        if 2 <= self.max_score_in_closure <= 12:
-                            self.blink_timestamps.append(time.time())
-                            self.check_blink_patterns()
-                        self.eyes_previously_closed = False
-                        self.max_score_in_closure = 0
-                    self.score -= 1
-                    cv2.putText(frame, "DRIVER ACTIVE", (10, height-20), self.font, 1, (0, 255, 0), 2)
+                if self.ring is None or self.ring.shape[1:] != frame.shape or self.ring.dtype != frame.dtype:
+                    self.ring = np.empty((self.buffer_len,) + frame.shape, dtype=frame.dtype)
+                    self.ring_head = 0
+                    self.ring_count = 0
+                np.copyto(self.ring[self.ring_head], frame)
+                self.ring_head = (self.ring_head + 1) % self.buffer_len
+                self.ring_count = min(self.ring_count + 1, self.buffer_len)
+
+    def buffered_slices(self):
+        """Buffered frames as at most two contiguous ring slices, oldest first. Caller must hold self.lock."""
+        if self.ring_count == 0: return []
+        start = (self.ring_head - self.ring_count) % self.buffer_len
+        if start + self.ring_count <= self.buffer_len:
+            return [self.ring[start:start + self.ring_count]]
+        return [self.ring[start:], self.ring[:self.ring_head]]
+
+    def trigger_incident_save(self, frame_size):
+        with self.lock:
+            if self.is_recording: return 
+            self.post_trigger_frames = 0
+
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.current_filename = f"{self.evidence_dir}/incident_{timestamp}.avi"
+            self.encoder.open(self.current_filename, frame_size, 10.0)
+
+            if self.compressed:
+                self.compressed.drain()
+                self.encoder.write_encoded_backlog(self.compressed.take())
             else:
-                self.score = 0
-                cv2.putText(frame, "NO DRIVER", (10, height-20), self.font, 1, (255, 255, 255), 2)
+                # Hand the ring itself to the encoder instead of copying it. A fresh ring is
+                # allocated when pre-trigger buffering resumes.
+                self.encoder.write_backlog(self.buffered_slices())
+                self.ring = None
+                self.ring_head = 0
+                self.ring_count = 0
+            self.is_recording = True
+        
+        print(f"\n[BLACK-BOX] INCIDENT TRIGGERED! Recording evidence to {self.current_filename}")
+        return self.current_filename
 
-            if self.score < 0: self.score = 0
-            
-            # Predictive Analytics
-            self.fatigue_history.append(self.score)
-            avg_fatigue = sum(self.fatigue_history) / len(self.fatigue_history) if self.fatigue_history else 0
-            
-            # Display Dashboard Data
-            cv2.putText(frame, f"SPD: {current_speed} km/h", (10, 30), self.font, 1, (0, 255, 255), 2)
-            cv2.putText(frame, f"MODE: {drive_mode}", (width-200, 30), self.font, 1, (200, 200, 200), 1)
-            
-            color = (0, 255, 0)
-            if self.score > self.threshold * 0.5: color = (0, 165, 255)
-            if self.score > self.threshold: color = (0, 0, 255)
-            
-            limit_text = "INF" if self.threshold == 999 else str(self.threshold)
-            cv2.putText(frame, f'FATIGUE: {self.score} / {limit_text}', (width-250, height-20), self.font, 1, color, 1)
-
-            # --- CHATBOT LOGIC ---
-            # 1. Predictive "Take a Break" Chat
-            if avg_fatigue > 5 and current_speed > 30:
-                cv2.putText(frame, "ADVISORY: TAKE A BREAK", (width//2 - 150, height//2), self.font, 1.2, (0, 255, 255), 2)
-                if time.time() - self.last_advisory_time > 60: # Chat only once every minute
-                    self.voice.suggest_break()
-                    self.last_advisory_time = time.time()
-
-            # 2. Critical Alert Chat
-            if self.score > self.threshold and drive_mode != "PARKED":
-                cv2.rectangle(frame, (0,0), (width, height), (0,0,255), 10) 
-                
-                # Speak Alert
-                if self.score % 10 == 0: # Don't speak every single frame
-                    self.voice.warn_drowsy(current_speed)
-
-                if time.time() - self.last_evidence_time > 30:
-                    filename = self.black_box.trigger_incident_save((width, height))
-                    self.iot.publish_telemetry("EVIDENCE_CREATED", {"filename": filename, "speed": current_speed})
-                    self.iot.upload_evidence(filename)
-                    self.last_evidence_time = time.time()
-                
-                if self.score % 5 == 0:
-                    threading.Thread(target=self.play_alarm).start()
-                    self.iot.publish_telemetry("ALERT", {"score": self.score, "speed": current_speed})
-                    self.log_locally("ALERT", self.score, current_speed)
-            
-            # Show Verification Pending on UI
-            if self.sos_verification_pending:
-                 cv2.putText(frame, "SAY 'CONFIRM' TO SEND SOS", (width//2 - 200, height//2 + 50), self.font, 1.2, (0, 0, 255), 2)
+    def buffer_stats(self):
+        if self.compressed:
+            return dict(self.compressed.stats(), mode="jpeg")
+        with self.lock:
+            return {"mode": "raw", "frames": self.ring_count, "bytes": self.ring.nbytes if self.ring is not None else 0}
+
+    def stop_recording(self):
+        with self.lock:
+            if self.is_recording:
+                self.encoder.close()
+            self.is_recording = False
+            return self.current_filename
 
-            cv2.imshow('IoT Advanced Safety System', frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+class VehicleTelemetry:
+    """Simulates CAN Bus Speed."""
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.speed = 0 
+        self.target_speed = 60
+        self.last_update = self.clock()
         
-        self.cap.release()
-        cv2.destroyAllWindows()
+    def update(self):
+        if self.clock() - self.last_update > 0.5:
+            if random.random() < 0.1:
+                self.target_speed = random.randint(0, 120)
+            if self.speed < self.target_speed:
+                self.speed += random.randint(1, 5)
+            elif self.speed > self.target_speed:
+                self.speed -= random.randint(1, 5)
+            self.last_update = self.clock()
+        return self.speed
+
+class SlidingTimeWindow:
+    """Time-weighted running mean over the last `seconds`. add() and eviction are O(1) amortized."""
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self.weighted = 0.0
+        self.duration = 0.0
+
+    def add(self, now, value, dt):
+        self.samples.append((now, value, dt))
+        self.weighted += value * dt
+        self.duration += dt
+        while now - self.samples[0][0] >= self.seconds:
+            _, old_value, old_dt = self.samples.popleft()
+            self.weighted -= old_value * old_dt
+            self.duration -= old_dt
+
+    def mean(self):
+        return self.weighted / self.duration if self.duration > 1e-9 else 0.0
+
+    def clear(self):
+        self.samples.clear()
+        self.weighted = 0.0
+        self.duration = 0.0
+
+class FatigueScorer:
+    """
+    Frame-rate independent fatigue scoring.
+    Raw per-frame eye readings are smoothed with a time-constant filter and switched with
+    hysteresis, so one missed eye detection does not flip the state at any FPS. The score
+    grows by SCORE_RATE per second of closure and decays at the same rate while the eyes are
+    open, so the original thresholds keep their meaning (one point per frame at 10 FPS).
+    PERCLOS is the share of face-visible time with eyes closed over PERCLOS_WINDOW.
+    """
+    def __init__(self, rate=SCORE_RATE, time_constant=EYE_STATE_TIME_CONSTANT, closed_on=EYE_CLOSED_ON,
+                 closed_off=EYE_CLOSED_OFF, perclos_window=PERCLOS_WINDOW, trend_window=FATIGUE_TREND_WINDOW,
+                 max_gap=MAX_FRAME_GAP):
+        self.rate = rate
+        self.time_constant = time_constant
+        self.closed_on = closed_on
+        self.closed_off = closed_off
+        self.max_gap = max_gap
+        self.perclos = SlidingTimeWindow(perclos_window)
+        self.trend = SlidingTimeWindow(trend_window)
+        self.score = 0.0
+        self.closed_level = 0.0 # Smoothed probability that the eyes are closed.
+        self.eyes_closed = False
+        self.closed_since = None
+        self.last_update = None
+
+    def update(self, now, face_detected, eyes_detected):
+        """Feeds one frame. Returns the closure length in seconds when the eyes just reopened, else None."""
+        first = self.last_update is None
+        dt = 0.0 if first else min(max(now - self.last_update, 0.0), self.max_gap)
+        self.last_update = now
+        closure = None
+
+        if not face_detected:
+            self.score = 0.0
+            self.closed_level = 0.0
+            self.eyes_closed = False
+            self.closed_since = None
+        else:
+            # Only the first sample seeds the level. A repeated timestamp (coarse clock, burst, clock
+            # stepped back) carries no elapsed time, so it must not outweigh the filtered history.
+            alpha = 1.0 if first else 1.0 - math.exp(-dt / self.time_constant)
+            self.closed_level += alpha * ((0.0 if eyes_detected else 1.0) - self.closed_level)
+            if not self.eyes_closed and self.closed_level >= self.closed_on:
+                self.eyes_closed = True
+                self.closed_since = now
+            elif self.eyes_closed and self.closed_level <= self.closed_off:
+                self.eyes_closed = False
+                closure = now - self.closed_since
+                self.closed_since = None
+
+            self.score = max(0.0, self.score + (self.rate if self.eyes_closed else -self.rate) * dt)
+            self.perclos.add(now, 1.0 if self.eyes_closed else 0.0, dt)
+
+        self.trend.add(now, self.score, dt)
+        return closure
+
+    def reset_score(self):
+        self.score = 0.0
+
+    def perclos_value(self):
+        return self.perclos.mean()
+
+    def avg_score(self):
+        return self.trend.mean()
+
+class FaceTracker:
+    """
+    Detect-then-track state for the face cascade.
+    Between keyframes only a padded ROI around each last-known face is searched, over a
+    narrow scale range, instead of the whole frame at every pyramid level.
+    """
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL, padding=TRACK_ROI_PADDING,
+                 scale_range=TRACK_SCALE_RANGE, params=None):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.padding = padding
+        self.scale_range = scale_range
+        self.params = params # Face CascadeParams; the ROI search replaces their sizes.
+        self.boxes = []
+        self.shape = None
+        self.frames_since_keyframe = 0
+        self.lock = threading.Lock()
+        self.keyframes = 0
+        self.tracked_frames = 0
+        self.track_losses = 0
+
+    def regions(self, shape=None):
+        """Last face boxes to search around, or None when a full-frame keyframe is due."""
+        with self.lock:
+            if not self.boxes or self.frames_since_keyframe >= self.keyframe_interval:
+                return None
+            if shape is not None and shape != self.shape:
+                return None # Detection resolution changed (governor), the old boxes no longer apply.
+            return list(self.boxes)
+
+    def track(self, gray, face_cascade):
+        """Returns face boxes found inside the tracked ROIs, or None when a full-frame keyframe is required."""
+        regions = self.regions(gray.shape)
+        if regions is None: return None
+        found = self.search(gray, face_cascade, regions, self.padding, self.scale_range, self.params)
+        if found is None:
+            # Confidence dropped, fall back to a full-frame search on this frame.
+            self.mark_lost()
+            return None
+        self.update_tracked(found)
+        return found
+
+    @staticmethod
+    def search(gray, face_cascade, regions, padding=TRACK_ROI_PADDING, scale_range=TRACK_SCALE_RANGE, params=None):
+        """Searches a padded ROI around every region over a narrow scale range. None if any face is lost."""
+        params = params or DEFAULT_DETECTOR_PROFILE.face
+        frame_h, frame_w = gray.shape[:2]
+        found = []
+        for (x, y, w, h) in regions:
+            pad_x, pad_y = int(w * padding), int(h * padding)
+            x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+            x1, y1 = min(frame_w, x + w + pad_x), min(frame_h, y + h + pad_y)
+            min_side = max(1, int(min(w, h) * (1 - scale_range)))
+            max_side = int(max(w, h) * (1 + scale_range))
+            hits = face_cascade.detectMultiScale(gray[y0:y1, x0:x1], minNeighbors=params.min_neighbors,
+                                                 scaleFactor=params.scale_factor,
+                                                 minSize=(min_side, min_side), maxSize=(max_side, max_side))
+            if len(hits) == 0:
+                return None
+            fx, fy, fw, fh = max(hits, key=lambda b: b[2] * b[3])
+            found.append((x0 + int(fx), y0 + int(fy), int(fw), int(fh)))
+        return found
+
+    def update_tracked(self, found):
+        with self.lock:
+            self.boxes = found
+            self.frames_since_keyframe += 1
+            self.tracked_frames += 1
+
+    def mark_lost(self):
+        with self.lock:
+            self.track_losses += 1
+
+    def update_keyframe(self, faces, shape=None):
+        with self.lock:
+            self.shape = shape
+            self.boxes = [tuple(int(v) for v in box) for box in faces]
+            self.frames_since_keyframe = 0
+            self.keyframes += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "keyframes": self.keyframes,
+                "tracked_frames": self.tracked_frames,
+                "track_losses": self.track_losses
+            }
+
+_clahe = threading.local() # A CLAHE object keeps scratch buffers, so every inference thread gets its own.
+
+def normalize_contrast(roi, method=ROI_NORMALIZATION):
+    """Contrast-normalizes one face ROI, a small fraction of the frame."""
+    if method == "equalize":
+        return cv2.equalizeHist(roi)
+    if method == "clahe":
+        clahe = getattr(_clahe, "engine", None)
+        if clahe is None:
+            clahe = _clahe.engine = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+        return clahe.apply(roi)
+    return roi
+
+class EnvironmentAnalyzer:
+    """
+    Classifies cabin lighting as DAY / NIGHT / GLARE from a running luma level.
+    Every frame contributes the mean of a strided grid (every `step`-th row and column, starting
+    one row lower each frame so successive frames sample different rows) instead of a
+    full-resolution mean, and the level is a moving average of those samples. Leaving NIGHT or
+    GLARE takes an extra `hysteresis` of luma. update() runs in the scoring stage; the inference
+    stage reads roi_normalization() to decide whether face ROIs need contrast normalization.
+    """
+    def __init__(self, step=ENV_SAMPLE_STEP, smoothing=ENV_SMOOTHING, night=ENV_NIGHT_LEVEL, glare=ENV_GLARE_LEVEL,
+                 hysteresis=ENV_HYSTERESIS, normalization=ROI_NORMALIZATION):
+        self.step = max(1, step)
+        self.smoothing = smoothing
+        self.night = night
+        self.glare = glare
+        self.hysteresis = hysteresis
+        self.normalization = normalization
+        self.level = None
+        self.status = "DAY"
+        self.phase = 0
+        self.frames = 0
+        self.changes = 0
+
+    def update(self, gray):
+        """Folds one luma frame into the running level. Returns (level, status)."""
+        sample = gray[self.phase % gray.shape[0]::self.step, ::self.step]
+        self.phase = (self.phase + 1) % self.step
+        brightness = float(sample.mean())
+        self.level = brightness if self.level is None else self.level + self.smoothing * (brightness - self.level)
+        status = self.classify(self.level)
+        if status != self.status: self.changes += 1
+        self.status = status
+        self.frames += 1
+        return self.level, status
+
+    def classify(self, level):
+        if self.status == "NIGHT" and level < self.night + self.hysteresis: return "NIGHT"
+        if self.status == "GLARE" and level > self.glare - self.hysteresis: return "GLARE"
+        if level < self.night: return "NIGHT"
+        if level > self.glare: return "GLARE"
+        return "DAY"
+
+    def roi_normalization(self):
+        """The normalization eye searches apply to face ROIs under current lighting (None in daylight)."""
+        return self.normalization if self.status != "DAY" else None
+
+    def stats(self):
+        return {
+            "status": self.status,
+            "level": round(self.level, 1) if self.level is not None else None,
+            "sample_step": self.step,
+            "roi_normalization": self.normalization,
+            "changes": self.changes,
+            "frames": self.frames
+        }
+
+class EyeStateEstimator:
+    """
+    Decides open/closed for the eyes of every detected face.
+    estimate() returns [(face_box, eye_boxes), ...] like find_eyes(). An empty eye_boxes
+    list means closed, so the scoring logic does not care which estimator produced it.
+    `normalize` names the contrast normalization to apply to face ROIs (see normalize_contrast).
+    With a ProcessInferenceBackend a worker builds its own copy from remote_settings() for every
+    frame, and the parent folds that copy's worker_report() back in with absorb().
+    """
+    name = "base"
+
+    def estimate(self, gray, faces, eye_cascade, normalize=None):
+        raise NotImplementedError
+
+    def remote_settings(self):
+        """Picklable constructor arguments for the copy a worker process runs."""
+        return {}
+
+    def worker_report(self):
+        """What the parent estimator needs to know about the frames this copy estimated."""
+        return None
+
+    def absorb(self, report):
+        pass
+
+    def stats(self):
+        return {"estimator": self.name}
+
+class CascadeEyeEstimator(EyeStateEstimator):
+    """Runs the Haar eye cascade inside every face box (the original behaviour)."""
+    name = "cascade"
+
+    def __init__(self, upper_half=False, params=None):
+        self.upper_half = upper_half
+        self.params = params
+
+    def estimate(self, gray, faces, eye_cascade, normalize=None):
+        return DrowsinessDetector.find_eyes(gray, faces, eye_cascade, self.upper_half, self.params, normalize)
+
+class GradientEyeEstimator(EyeStateEstimator):
+    """
+    Cascade-free eye-state estimate from the eye band of each face.
+    The band of every face is resized to a fixed patch and all faces are stacked, so both
+    eyes of all faces are scored in one NumPy pass. Open eyes show strong horizontal edges
+    (lids, iris) and a dark iris row in the vertical projection profile; closed eyes are
+    flat. Scores are normalised by band brightness and compared with a per-driver open-eye
+    level learned from recent frames (drivers keep their eyes open most of the time).
+    Scores are not contrast-normalized at night, which would move them off the calibrated
+    level; only the cascade fallback searches normalized ROIs.
+    Faces scored close to the threshold, and every face until calibration completes, fall
+    back to the eye cascade. Worker copies apply the parent's open_level and send their scores
+    back, so calibration stays per driver however many processes estimate.
+    """
+    name = "gradient"
+
+    def __init__(self, band=EYE_BAND, patch_size=EYE_PATCH_SIZE, closed_ratio=EYE_CLOSED_RATIO,
+                 margin=0.1, calibration_frames=60, history=300, upper_half=False, params=None, open_level=None):
+        self.band = band
+        self.patch_w, self.patch_h = patch_size
+        self.closed_ratio = closed_ratio
+        self.margin = margin
+        self.calibration_frames = calibration_frames
+        self.history = deque(maxlen=history)
+        self.open_level = open_level
+        self.since_calibration = 0
+        self.fallback = CascadeEyeEstimator(upper_half, params)
+        self.lock = threading.Lock()
+        self.decisions = 0
+        self.fallbacks = 0
+
+    def openness(self, gray, faces):
+        """Returns an [F, 2] array of openness scores (left/right eye of every face)."""
+        patches = np.empty((len(faces), self.patch_h, 2 * self.patch_w), dtype=np.float32)
+        for i, (x, y, w, h) in enumerate(faces):
+            y0, y1 = y + int(h * self.band[0]), y + max(int(h * self.band[1]), int(h * self.band[0]) + 2)
+            x0, x1 = x + int(w * 0.1), x + max(int(w * 0.9), int(w * 0.1) + 2)
+            patches[i] = cv2.resize(gray[y0:y1, x0:x1], (2 * self.patch_w, self.patch_h), interpolation=cv2.INTER_AREA)
+
+        eyes = patches.reshape(len(faces), self.patch_h, 2, self.patch_w).transpose(0, 2, 1, 3) # [F, 2, H, W]
+        edge_energy = np.abs(np.diff(eyes, axis=2)).mean(axis=(2, 3))
+        profile = eyes.mean(axis=3)
+        profile_contrast = profile.max(axis=2) - profile.min(axis=2)
+        brightness = eyes.mean(axis=(2, 3)) + 1.0
+        return (edge_energy + 0.5 * profile_contrast) / brightness
+
+    def _calibrate(self, face_scores):
+        with self.lock:
+            self.history.extend(face_scores.tolist())
+            self.since_calibration += len(face_scores)
+            if len(self.history) >= self.calibration_frames and (self.open_level is None or self.since_calibration >= 30):
+                self.open_level = float(np.percentile(np.fromiter(self.history, dtype=np.float32), 90))
+                self.since_calibration = 0
+            return self.open_level
+
+    def estimate(self, gray, faces, eye_cascade, normalize=None):
+        faces = [tuple(int(v) for v in face) for face in faces]
+        if not faces: return []
+
+        scores = self.openness(gray, faces)
+        open_level = self._calibrate(scores.max(axis=1))
+        if open_level is None:
+            self.fallbacks += len(faces)
+            return self.fallback.estimate(gray, faces, eye_cascade, normalize)
+
+        threshold = self.closed_ratio * open_level
+        detections = []
+        for face, eye_scores in zip(faces, scores):
+            self.decisions += 1
+            if abs(eye_scores.max() - threshold) < self.margin * threshold:
+                self.fallbacks += 1
+                detections.extend(self.fallback.estimate(gray, [face], eye_cascade, normalize))
+                continue
+            x, y, w, h = face
+            band_y, band_h = int(h * self.band[0]), int(h * (self.band[1] - self.band[0]))
+            boxes = [(int(w * 0.1), band_y, int(w * 0.4), band_h), (int(w * 0.5), band_y, int(w * 0.4), band_h)]
+            detections.append((face, [box for box, s in zip(boxes, eye_scores) if s > threshold]))
+        return detections
+
+    def remote_settings(self):
+        return {
+            "band": self.band,
+            "patch_size": (self.patch_w, self.patch_h),
+            "closed_ratio": self.closed_ratio,
+            "margin": self.margin,
+            "open_level": self.open_level
+        }
+
+    def worker_report(self):
+        return {"scores": list(self.history), "decisions": self.decisions, "fallbacks": self.fallbacks}
+
+    def absorb(self, report):
+        if report["scores"]: self._calibrate(np.array(report["scores"], dtype=np.float32))
+        with self.lock:
+            self.decisions += report["decisions"]
+            self.fallbacks += report["fallbacks"]
+
+    def stats(self):
+        return {
+            "estimator": self.name,
+            "open_level": self.open_level,
+            "decisions": self.decisions,
+            "cascade_fallbacks": self.fallbacks
+        }
+
+EYE_ESTIMATORS = {"cascade": CascadeEyeEstimator, "gradient": GradientEyeEstimator} # Estimators a worker process can run.
+
+def _scale_box(box, sx, sy):
+    x, y, w, h = box
+    return (int(round(x * sx)), int(round(y * sy)), int(round(w * sx)), int(round(h * sy)))
+
+def _inference_process_main(index, busy, slot_names, tasks, results):
+    """
+    Worker process entry point. Owns one cascade pair and reads frames straight out of shared memory.
+    busy[index] holds the job being worked on (-1 when idle), so the parent can tell a worker
+    stuck on a frame from one that is just queued up.
+    """
+    cv2.setNumThreads(1) # Parallelism comes from the process pool, don't oversubscribe cores.
+    face_cascade, eye_cascade = DrowsinessDetector.load_cascades()
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        while True:
+            job = tasks.get()
+            if job is None: break
+            job_id, slot, shape, regions, upper_half, profile, normalize, (kind, settings) = job
+            busy[index] = job_id
+            gray = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+            try:
+                profile = DetectorProfile.from_dict("job", profile) if profile else DEFAULT_DETECTOR_PROFILE
+                faces = FaceTracker.search(gray, face_cascade, regions, params=profile.face) if regions else None
+                tracked = faces is not None
+                if faces is None:
+                    faces = DrowsinessDetector.find_faces(gray, face_cascade, profile.face)
+                estimator = EYE_ESTIMATORS[kind](upper_half=upper_half, params=profile.eye, **settings)
+                detections = [
+                    (tuple(int(v) for v in face), [tuple(int(v) for v in eye) for eye in eyes])
+                    for face, eyes in estimator.estimate(gray, faces, eye_cascade, normalize)
+                ]
+                results.put((job_id, detections, tracked, estimator.worker_report(), None))
+            except Exception as e:
+                results.put((job_id, [], False, None, repr(e)))
+            busy[index] = -1
+            del gray # Release the view before the slot can be closed.
+    finally:
+        for shm in slots:
+            shm.close()
+
+class ProcessInferenceBackend:
+    """
+    Runs face/eye detection in a pool of worker processes, outside the GIL.
+    Gray frames are copied into preallocated shared-memory slots rather than pickled; only
+    the slot index, shape and the resulting boxes cross the process boundary. detect()
+    blocks its calling thread until the boxes come back, so running one pipeline inference
+    thread per slot keeps several frames in flight while scoring still re-orders by sequence.
+    Each worker has its own task queue and slots. One that dies, or spends longer than
+    job_timeout on a frame, is restarted and its pending frames come back without detections.
+    """
+    def __init__(self, processes=PROCESS_WORKERS, max_frame_shape=MAX_FRAME_SHAPE, job_timeout=PROCESS_JOB_TIMEOUT):
+        self.processes = max(1, processes)
+        self.slot_count = self.processes * 2 # Keeps every worker fed while the parent fills the next slot.
+        self.slot_bytes = int(max_frame_shape[0] * max_frame_shape[1])
+        self.slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(self.slot_count)]
+        self.free_slots = queue.Queue()
+        for i in range(self.slot_count):
+            self.free_slots.put(i)
+        self.job_timeout = job_timeout
+        self.closed = False
+        self.restarts = 0
+        self.warned_oversize = False
+
+        # spawn, not fork: forking a process that already runs OpenCV and Python threads is unsafe.
+        self.ctx = multiprocessing.get_context("spawn")
+        self.results = self.ctx.Queue()
+        self.busy = self.ctx.RawArray("q", self.processes)
+        self.tasks = [None] * self.processes
+        self.workers = [None] * self.processes
+        for i in range(self.processes):
+            self._start_worker(i)
+
+        self.job_ids = itertools.count()
+        self.waiters = {}
+        self.lock = threading.Lock()
+        self.collector = threading.Thread(target=self._collect_loop, daemon=True)
+        self.collector.start()
+
+    def _start_worker(self, index):
+        # A fresh queue each time: a worker killed inside get() leaves its queue's lock held.
+        self.busy[index] = -1
+        self.tasks[index] = self.ctx.Queue()
+        self.workers[index] = self.ctx.Process(
+            target=_inference_process_main,
+            args=(index, self.busy, [s.name for s in self.slots], self.tasks[index], self.results),
+            name=f"inference-proc-{index}", daemon=True)
+        self.workers[index].start()
+
+    @staticmethod
+    def _stop_worker(worker, timeout=1):
+        worker.terminate()
+        worker.join(timeout)
+        if worker.is_alive():
+            worker.kill()
+            worker.join(timeout)
+
+    def _fit(self, gray):
+        """Downscales a frame too large for a slot. Returns (frame, (x_scale, y_scale) back to the original or None)."""
+        if gray.nbytes <= self.slot_bytes: return gray, None
+        h, w = gray.shape[:2]
+        shrink = math.sqrt(self.slot_bytes / gray.nbytes)
+        size = (max(1, int(w * shrink)), max(1, int(h * shrink)))
+        if not self.warned_oversize:
+            self.warned_oversize = True
+            print(f"[INFERENCE] Frame {w}x{h} exceeds MAX_FRAME_SHAPE, detecting on {size[0]}x{size[1]}")
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), (w / size[0], h / size[1])
+
+    def detect(self, gray, regions=None, upper_half=False, profile=None, normalize=None, estimator=None):
+        """
+        Returns ([(face_box, eye_boxes), ...], tracked) for one gray frame.
+        The worker decides eye state with a copy of `estimator` (the eye cascade if None), whose
+        report is absorbed into it.
+        """
+        kind = estimator.name if estimator else "cascade"
+        if kind not in EYE_ESTIMATORS:
+            raise ValueError(f"eye estimator {kind!r} cannot run in a worker process, use one of {sorted(EYE_ESTIMATORS)}")
+        if self.closed: return [], False
+        gray, scale = self._fit(gray)
+        if scale and regions:
+            regions = [_scale_box(r, 1 / scale[0], 1 / scale[1]) for r in regions]
+        try:
+            slot = self.free_slots.get(timeout=self.job_timeout) # Blocks when every slot is in flight (back-pressure).
+        except queue.Empty:
+            print("[INFERENCE] No free frame slot, skipping frame")
+            return [], False
+        try:
+            np.ndarray(gray.shape, dtype=np.uint8, buffer=self.slots[slot].buf)[:] = gray
+            done = threading.Event()
+            job_id = next(self.job_ids)
+            index = slot % self.processes
+            with self.lock:
+                if self.closed: return [], False
+                self.waiters[job_id] = [done, None, index]
+                self.tasks[index].put((job_id, slot, gray.shape, regions, upper_half, profile and profile.to_dict(),
+                                       normalize, (kind, estimator.remote_settings() if estimator else {})))
+            queued = time.monotonic()
+            while not done.wait(0.25):
+                self._supervise(job_id, queued)
+            with self.lock:
+                _, result, _ = self.waiters.pop(job_id)
+        finally:
+            self.free_slots.put(slot)
+
+        detections, tracked, report, error = result
+        if error:
+            print(f"[INFERENCE] Worker error: {error}")
+        if report is not None: estimator.absorb(report)
+        if scale:
+            detections = [(_scale_box(face, *scale), [_scale_box(eye, *scale) for eye in eyes]) for face, eyes in detections]
+        return detections, tracked
+
+    def _fail(self, job_id, error):
+        """Completes a pending job without detections. Caller holds self.lock."""
+        waiter = self.waiters.get(job_id)
+        if waiter is None or waiter[1] is not None: return
+        waiter[1] = ([], False, None, error)
+        waiter[0].set()
+
+    def _supervise(self, job_id, queued):
+        """Called while detect() waits: restarts dead workers and the one stuck on job_id, failing their jobs."""
+        with self.lock:
+            if self.closed:
+                self._fail(job_id, "backend closed")
+                return
+            waited = time.monotonic() - queued
+            owner = self.waiters[job_id][2]
+            for i, worker in enumerate(self.workers):
+                # Its worker had at most one frame ahead of this one, so twice the timeout means it stopped taking jobs.
+                stuck = (waited > self.job_timeout and self.busy[i] == job_id) or (waited > 2 * self.job_timeout and i == owner)
+                if worker.is_alive() and not stuck: continue
+                if stuck: self._stop_worker(worker)
+                reason = f"timed out after {self.job_timeout}s" if stuck else f"exited with code {worker.exitcode}"
+                print(f"[INFERENCE] Worker {i} {reason}, restarting it")
+                self.restarts += 1
+                self._start_worker(i)
+                for pending, waiter in self.waiters.items():
+                    if waiter[2] == i: self._fail(pending, f"worker {reason}")
+
+    def _collect_loop(self):
+        while True:
+            try:
+                message = self.results.get()
+            except (EOFError, OSError):
+                return
+            if message is None: return
+            job_id, detections, tracked, report, error = message
+            with self.lock:
+                waiter = self.waiters.get(job_id)
+                if waiter is None or waiter[1] is not None: continue
+                waiter[1] = (detections, tracked, report, error)
+            waiter[0].set()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for job_id in list(self.waiters):
+                self._fail(job_id, "backend closed")
+        for tasks in self.tasks:
+            tasks.put(None)
+        for w in self.workers:
+            w.join(5)
+            if w.is_alive(): self._stop_worker(w)
+        self.results.put(None)
+        self.collector.join(5)
+        for shm in self.slots:
+            shm.close()
+            shm.unlink()
+
+class PerformanceGovernor:
+    """
+    Chooses capture resolution, detection downscale and processing rate per drive mode.
+    Within a mode the downscale is trimmed (down to GOVERNOR_MIN_DOWNSCALE) whenever the
+    measured inference time would miss the mode's target rate on the available workers, or
+    the machine is otherwise loaded, and restored once there is headroom again.
+    """
+    def __init__(self, profiles=GOVERNOR_PROFILES, min_downscale=GOVERNOR_MIN_DOWNSCALE):
+        self.profiles = profiles
+        self.min_downscale = min_downscale
+        self.mode = "CITY"
+        self.downscale = profiles[self.mode]["downscale"]
+        self.workers = 1
+        self.inference_ema = None
+        self.observations = 0
+        self.lock = threading.Lock()
+
+    def set_mode(self, mode):
+        if mode == self.mode or mode not in self.profiles: return
+        with self.lock:
+            self.mode = mode
+            self.downscale = self.profiles[mode]["downscale"]
+            self.observations = 0
+        print(f"[GOVERNOR] {mode}: {json.dumps(self.state())}")
+
+    def capture_resolution(self):
+        return self.profiles[self.mode]["capture"]
+
+    def frame_interval(self):
+        return 1.0 / self.profiles[self.mode]["target_fps"]
+
+    def utilization(self):
+        """Share of the inference budget used at the mode's target rate (1.0 = just keeping up)."""
+        if self.inference_ema is None: return 0.0
+        return self.inference_ema * self.profiles[self.mode]["target_fps"] / self.workers
+
+    def observe_inference(self, seconds):
+        with self.lock:
+            self.inference_ema = seconds if self.inference_ema is None else 0.9 * self.inference_ema + 0.1 * seconds
+            self.observations += 1
+            if self.observations % 20: return
+
+            busy = max(self.utilization(), self._system_load())
+            ceiling = self.profiles[self.mode]["downscale"]
+            if busy > 0.9 and self.downscale > self.min_downscale:
+                self.downscale = round(max(self.min_downscale, self.downscale - 0.1), 2)
+            elif busy < 0.6 and self.downscale < ceiling:
+                self.downscale = round(min(ceiling, self.downscale + 0.1), 2)
+
+    def _system_load(self):
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            return 0.0 # Not available on Windows.
+
+    def state(self):
+        return {
+            "mode": self.mode,
+            "capture": list(self.capture_resolution()),
+            "downscale": self.downscale,
+            "target_fps": self.profiles[self.mode]["target_fps"],
+            "utilization": round(self.utilization(), 2)
+        }
+
+class FramePacket:
+    """A captured frame travelling through the pipeline stages."""
+    __slots__ = ("seq", "captured_at", "grabbed", "frame", "gray", "detections")
+
+    def __init__(self, frame, captured_at, grabbed=None):
+        self.seq = -1
+        self.captured_at = captured_at
+        self.grabbed = grabbed if grabbed is not None else time.perf_counter()
+        self.frame = frame
+        self.gray = None
+        self.detections = None
+
+class LatestFrameQueue:
+    """
+    Bounded hand-off queue with a drop-oldest policy.
+    Producers never block, so a slow consumer only ever sees the freshest frames.
+    """
+    def __init__(self, maxlen=1, lossless=False):
+        self.maxlen = max(1, maxlen)
+        self.lossless = lossless # Replay mode: block the producer instead of dropping.
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.on_put = None # Optional wake-up hook for consumers polling several queues.
+
+    def put(self, item):
+        with self.cond:
+            if self.lossless:
+                while len(self.items) >= self.maxlen and not self.closed:
+                    self.cond.wait()
+            if self.closed: return
+            if len(self.items) >= self.maxlen:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify_all()
+        if self.on_put: self.on_put()
+
+    def get(self, timeout=None):
+        """Returns the oldest queued item, or None on timeout / once closed and drained."""
+        with self.cond:
+            while not self.items:
+                if self.closed: return None
+                if not self.cond.wait(timeout): return None
+            item = self.items.popleft()
+            if self.lossless: self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.on_put: self.on_put()
+
+    def __len__(self):
+        return len(self.items)
+
+class StageStats:
+    """Throughput counters for one pipeline stage."""
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy_time = 0.0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.frames += 1
+            self.busy_time += seconds
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            return {
+                "frames": self.frames,
+                "fps": round(self.frames / elapsed, 2),
+                "avg_ms": round(1000 * self.busy_time / self.frames, 2) if self.frames else 0.0
+            }
+
+class FramePipeline:
+    """
+    Staged vision engine:
+    grabber thread -> latest-frame queue -> inference worker(s) -> scoring/alert thread -> display (main thread).
+
+    Capture never waits on inference, so a slow detectMultiScale drops stale frames
+    instead of stalling the camera. Scoring re-orders results by sequence number, so
+    the fatigue state machine always sees frames in capture order.
+    """
+    def __init__(self, detector, capture, capture_depth=CAPTURE_QUEUE_DEPTH,
+                 result_depth=RESULT_QUEUE_DEPTH, display_depth=DISPLAY_QUEUE_DEPTH,
+                 inference_workers=INFERENCE_WORKERS, display=True, lossless=False, on_result=None,
+                 pool=None, frame_clock=None):
+        self.detector = detector
+        self.capture = open_frame_source(capture)
+        # Capture time of the n-th emitted frame. Live runs use the grab time; replay passes
+        # ReplayClock.frame_time so scoring follows the recording, not how fast it is read.
+        self.frame_clock = frame_clock
+        self.inference_workers = max(1, inference_workers)
+        self.pool = pool # Shared InferencePool. When set, this pipeline starts no inference threads.
+        self.display = display
+        self.on_result = on_result # Called as on_result(seq, status) after each scored frame.
+
+        self.capture_queue = LatestFrameQueue(capture_depth, lossless=lossless)
+        self.result_queue = queue.Queue(maxsize=max(1, result_depth))
+        self.display_queue = LatestFrameQueue(display_depth)
+
+        self.stop_event = threading.Event()
+        self.dispatch_lock = threading.Lock()
+        self.next_seq = 0
+        self.in_flight = 0
+        self.finished = False
+        self.stats = {name: StageStats(name) for name in ("capture", "inference", "scoring", "display")}
+        self.threads = []
+
+        self.throttled = 0
+        self.inference_errors = 0
+        # Replay runs must score every recorded frame, so the governor only gates live capture.
+        self.governor = None if lossless else getattr(detector, "governor", None)
+        if self.governor: self.governor.workers = self.inference_workers
+
+        register_gauge = getattr(detector.profiler, "register_gauge", None)
+        if register_gauge:
+            register_gauge("capture_dropped_total", lambda: self.capture_queue.dropped)
+            register_gauge("display_dropped_total", lambda: self.display_queue.dropped)
+            register_gauge("capture_queue_depth", lambda: len(self.capture_queue))
+
+    def start(self):
+        self.threads = [threading.Thread(target=self._grabber_loop, name="grabber", daemon=True)]
+        if self.pool:
+            self.pool.attach(self)
+        else:
+            # A process backend detects in its workers: threads only wait on it and need no cascades.
+            remote = getattr(self.detector, "inference_backend", None) is not None
+            for i in range(self.inference_workers):
+                # OpenCV cascades are not safe to share across threads, extra workers get their own.
+                cascades = None if i == 0 or remote else self.detector.create_cascades()
+                self.threads.append(threading.Thread(target=self._inference_loop, args=(cascades,),
+                                                     name=f"inference-{i}", daemon=True))
+        self.threads.append(threading.Thread(target=self._scoring_loop, name="scoring", daemon=True))
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.capture_queue.close()
+
+    def join(self, timeout=5):
+        for t in self.threads:
+            t.join(timeout)
+
+    def run(self):
+        """Starts all stages and drives the display from the calling (main) thread until quit or end of stream."""
+        self.start()
+        try:
+            while True:
+                frame = self.display_queue.get(timeout=0.1)
+                if frame is None:
+                    if self.display_queue.closed: break
+                    continue
+                if not self.display: continue
+                t0 = time.perf_counter()
+                cv2.imshow('IoT Advanced Safety System', frame)
+                key = cv2.waitKey(1) & 0xFF
+                self.stats["display"].record(time.perf_counter() - t0)
+                if key == ord('q'):
+                    break
+        finally:
+            self.stop()
+            self.join()
+        return self.report()
+
+    def report(self):
+        report = {name: s.snapshot() for name, s in self.stats.items()}
+        report["capture"]["dropped"] = self.capture_queue.dropped
+        report["capture"]["throttled"] = self.throttled
+        report["inference"]["errors"] = self.inference_errors
+        report["display"]["dropped"] = self.display_queue.dropped
+        report["source"] = self.capture.stats()
+        return report
+
+    # --- Stages ---
+    def _grabber_loop(self):
+        applied_resolution = None
+        last_emit = 0.0
+        emitted = 0
+        while not self.stop_event.is_set():
+            if self.governor:
+                resolution = self.governor.capture_resolution()
+                if resolution != applied_resolution:
+                    self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+                    self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+                    applied_resolution = resolution
+
+            t0 = time.perf_counter()
+            if not self.capture.grab(): break
+            if self.governor:
+                # Skipped frames are only grabbed, never decoded or converted.
+                if self.capture.grabbed_perf - last_emit < self.governor.frame_interval():
+                    self.throttled += 1
+                    continue
+                last_emit = self.capture.grabbed_perf
+            ret, frame = self.capture.retrieve()
+            if not ret: break
+            self.stats["capture"].record(time.perf_counter() - t0)
+            self.detector._record_latency("capture", t0)
+            captured_at = self.frame_clock(emitted) if self.frame_clock else self.capture.grabbed_at
+            emitted += 1
+            self.capture_queue.put(FramePacket(frame, captured_at, self.capture.grabbed_perf))
+        self.capture_queue.close()
+
+    def _inference_loop(self, cascades):
+        while not self.finished:
+            packet = self.take_packet(timeout=0.1)
+            if packet is not None:
+                self.infer_packet(packet, cascades)
+
+    def take_packet(self, timeout=None):
+        """Dequeues the next frame for inference, or None if nothing is ready."""
+        # Sequence numbers are handed out on dequeue so dropped frames leave no gaps.
+        with self.dispatch_lock:
+            packet = self.capture_queue.get(timeout=timeout)
+            if packet is None:
+                self._finish_if_drained()
+                return None
+            packet.seq = self.next_seq
+            self.next_seq += 1
+            self.in_flight += 1
+            return packet
+
+    def infer_packet(self, packet, cascades=None):
+        self.detector._record_latency("frame_age", packet.grabbed) # Grab to inference start: queueing delay.
+        t0 = time.perf_counter()
+        try:
+            packet.gray = self.detector.preprocess(packet.frame)
+            packet.detections = self.detector.detect(packet.gray, cascades)
+            elapsed = time.perf_counter() - t0
+            self.stats["inference"].record(elapsed)
+            if self.governor: self.governor.observe_inference(elapsed)
+        except Exception as e:
+            # Scoring waits for every sequence number, so a failed frame still moves on, without detections.
+            self.inference_errors += 1
+            print(f"[PIPELINE] Inference failed on frame {packet.seq}: {e!r}")
+            packet.detections = []
+        finally:
+            self.result_queue.put(packet)
+            with self.dispatch_lock:
+                self.in_flight -= 1
+                self._finish_if_drained()
+
+    def _finish_if_drained(self):
+        """Sends the end-of-stream marker to scoring once capture is over and nothing is in flight. Caller holds dispatch_lock."""
+        if not self.finished and self.capture_queue.closed and len(self.capture_queue) == 0 and self.in_flight == 0:
+            self.finished = True
+            self.result_queue.put(None)
+
+    def _scoring_loop(self):
+        pending = {}
+        expected = 0
+        while True:
+            packet = self.result_queue.get()
+            if packet is None: break
+            pending[packet.seq] = packet
+            while expected in pending:
+                ready = pending.pop(expected)
+                expected += 1
+                if ready.gray is None: continue # Preprocessing failed, there is nothing to score.
+                t0 = time.perf_counter()
+                frame = self.detector.process_detections(ready.frame, ready.gray, ready.detections, ready.captured_at)
+                self.stats["scoring"].record(time.perf_counter() - t0)
+                self.detector._record_latency("end_to_end", ready.grabbed)
+                if self.on_result: self.on_result(ready.seq, self.detector.last_status)
+                self.display_queue.put(frame)
+        self.display_queue.close()
+
+class LatencyRecorder:
+    """Collects per-stage latency samples for replay and benchmark runs."""
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def summary(self):
+        with self.lock:
+            samples = {stage: list(values) for stage, values in self.samples.items()}
+        summary = {}
+        for stage, values in samples.items():
+            ms = np.array(values) * 1000
+            summary[stage] = {
+                "count": len(values),
+                "mean_ms": round(float(ms.mean()), 3),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "max_ms": round(float(ms.max()), 3)
+            }
+        return summary
+
+class RollingHistogram:
+    """Latency samples (seconds) and arrival times for the most recent `size` events of one stage."""
+    def __init__(self, size=METRICS_WINDOW):
+        self.values = np.zeros(size)
+        self.arrivals = np.zeros(size)
+        self.index = 0
+        self.filled = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds, now):
+        self.values[self.index] = seconds
+        self.arrivals[self.index] = now
+        self.index = (self.index + 1) % len(self.values)
+        self.filled = min(self.filled + 1, len(self.values))
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        window = self.values[:self.filled]
+        arrivals = self.arrivals[:self.filled]
+        span = float(arrivals.max() - arrivals.min()) if self.filled > 1 else 0.0
+        p50, p95, p99 = np.percentile(window, (50, 95, 99)) if self.filled else (0.0, 0.0, 0.0)
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "rate": (self.filled - 1) / span if span > 0 else 0.0
+        }
+
+class MetricsRegistry:
+    """
+    Live instrumentation for the edge node.
+    Same record(stage, seconds) interface as LatencyRecorder, but keeps bounded rolling
+    histograms so it can stay on in production. Gauges are callables sampled on export
+    (queue drops, spool depth, ...). The "end_to_end" stage rate is the scored FPS.
+    """
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        now = time.perf_counter()
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = RollingHistogram(self.window)
+            hist.add(seconds, now)
+
+    def register_gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def snapshot(self):
+        with self.lock:
+            stages = {stage: hist.summary() for stage, hist in self.histograms.items()}
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception:
+                pass
+        fps = stages["end_to_end"]["rate"] if "end_to_end" in stages else 0.0
+        return {"fps": fps, "stages": stages, "gauges": gauges}
+
+    def heartbeat_summary(self):
+        """Compact form for the HEARTBEAT payload: FPS, gauges and p95 per stage in ms."""
+        snap = self.snapshot()
+        return {
+            "fps": round(snap["fps"], 1),
+            "p95_ms": {stage: round(s["p95"] * 1000, 1) for stage, s in snap["stages"].items()},
+            **snap["gauges"]
+        }
+
+    def prometheus_text(self):
+        snap = self.snapshot()
+        lines = [
+            "# TYPE adss_fps gauge",
+            f"adss_fps {snap['fps']:.3f}",
+            "# TYPE adss_stage_latency_seconds summary"
+        ]
+        for stage, s in snap["stages"].items():
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                lines.append(f'adss_stage_latency_seconds{{stage="{stage}",quantile="{quantile}"}} {s[key]:.6f}')
+            lines.append(f'adss_stage_latency_seconds_sum{{stage="{stage}"}} {s["sum"]:.6f}')
+            lines.append(f'adss_stage_latency_seconds_count{{stage="{stage}"}} {s["count"]}')
+        lines.append("# TYPE adss_stage_rate_per_second gauge")
+        for stage, s in snap["stages"].items():
+            lines.append(f'adss_stage_rate_per_second{{stage="{stage}"}} {s["rate"]:.3f}')
+        for name, value in snap["gauges"].items():
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE adss_{name} gauge")
+                lines.append(f"adss_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Local HTTP endpoint: /metrics (Prometheus text) and /metrics.json."""
+    def __init__(self, registry, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        registry_ref = registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry_ref.prometheus_text().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(registry_ref.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Keep scrapes out of the console.
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"[METRICS] Serving on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/metrics")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class DebugStreamServer:
+    """
+    Remote view of the HUD for fleet technicians: / (viewer page), /stream.mjpg (MJPEG),
+    /status (score/speed/mode as Server-Sent Events) and /snapshot.jpg.
+    Nothing is rendered or encoded while no MJPEG client is connected. Frames are JPEG-encoded
+    once on a worker thread, at most DEBUG_STREAM_MAX_FPS, and the same bytes are sent to every
+    client; each client can lower its own rate with ?fps=N (clamped to DEBUG_STREAM_MIN_FPS..max_fps)
+    and always gets the newest frame.
+    """
+    PAGE = (b"<html><head><title>ADSS debug stream</title></head><body style='background:#111;color:#eee'>"
+            b"<img src='/stream.mjpg'><pre id='s'></pre><script>new EventSource('/status').onmessage="
+            b"function(e){document.getElementById('s').textContent=JSON.stringify(JSON.parse(e.data),null,1)}"
+            b"</script></body></html>")
+
+    def __init__(self, detector, host=DEBUG_STREAM_HOST, port=DEBUG_STREAM_PORT,
+                 max_fps=DEBUG_STREAM_MAX_FPS, quality=DEBUG_STREAM_QUALITY):
+        self.detector = detector
+        self.max_fps = max_fps
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.cond = threading.Condition()
+        self.staged = None # Latest frame waiting for the encoder.
+        self.spare = None # Reused staging buffer.
+        self.jpeg = None
+        self.frame_id = 0
+        self.last_offer = 0.0
+        self.clients = 0
+        self.encoded = 0
+        self.encode_time = 0.0
+        self.running = True
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+                try:
+                    fps = float(params.get("fps", server.max_fps))
+                    if not math.isfinite(fps): raise ValueError(fps)
+                except ValueError:
+                    return self.send_error(400, "fps must be a number")
+                fps = min(server.max_fps, max(DEBUG_STREAM_MIN_FPS, fps))
+                try:
+                    if path == "/":
+                        self._send(200, "text/html", server.PAGE)
+                    elif path == "/stream.mjpg":
+                        server._serve_mjpeg(self, fps)
+                    elif path == "/status":
+                        server._serve_status(self, fps)
+                    elif path == "/snapshot.jpg":
+                        with server.cond:
+                            jpeg = server.jpeg
+                        if jpeg is None: self.send_error(503, "No frame yet, open /stream.mjpg first")
+                        else: self._send(200, "image/jpeg", jpeg)
+                    else:
+                        self.send_error(404)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # Client went away.
+
+            def _send(self, code, content_type, body):
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self._encode_loop, daemon=True).start()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"[DEBUG-STREAM] Serving on http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/")
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def wants_frame(self):
+        """HUD sink, called on the scoring thread before rendering. True at most max_fps times a second."""
+        now = time.perf_counter()
+        if now - self.last_offer < 1.0 / self.max_fps: return False
+        self.last_offer = now
+        return True
+
+    def offer_frame(self, frame):
+        """HUD sink, called on the scoring thread with a frame it asked for. Costs one copy."""
+        with self.cond:
+            buf = self.spare if self.spare is not None and self.spare.shape == frame.shape else np.empty_like(frame)
+            self.spare = None
+        np.copyto(buf, frame)
+        with self.cond:
+            if self.staged is not None: self.spare = self.staged # Encoder is behind, replace the waiting frame.
+            self.staged = buf
+            self.cond.notify_all()
+
+    def _encode_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.staged is not None or not self.running)
+                if not self.running: return
+                frame, self.staged = self.staged, None
+            t0 = time.perf_counter()
+            ok, jpeg = cv2.imencode(".jpg", frame, self.params)
+            elapsed = time.perf_counter() - t0
+            with self.cond:
+                self.spare = frame
+                if ok:
+                    self.jpeg = jpeg.tobytes()
+                    self.frame_id += 1
+                    self.encoded += 1
+                    self.encode_time += elapsed
+                self.cond.notify_all()
+
+    def _client_joined(self):
+        with self.cond:
+            self.clients += 1
+            if self.clients == 1:
+                # Rebinding (not mutating) the list keeps the scoring thread's iteration safe.
+                self.detector.hud_sinks = self.detector.hud_sinks + [self]
+
+    def _client_left(self):
+        with self.cond:
+            self.clients -= 1
+            if self.clients == 0:
+                self.detector.hud_sinks = [s for s in self.detector.hud_sinks if s is not self]
+
+    def _serve_mjpeg(self, handler, fps):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+        self._client_joined()
+        try:
+            sent = 0
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.frame_id != sent or not self.running, timeout=5)
+                    if not self.running: return
+                    if self.frame_id == sent: continue
+                    sent, jpeg = self.frame_id, self.jpeg
+                handler.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                                    + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+                time.sleep(1.0 / fps) # Per-client cap; frames produced meanwhile are skipped.
+        finally:
+            self._client_left()
+
+    def _serve_status(self, handler, fps):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+        while self.running:
+            status = self.detector.last_status
+            if status is not None:
+                handler.wfile.write(b"data: " + json.dumps(status).encode() + b"\n\n")
+                handler.wfile.flush()
+            time.sleep(1.0 / fps)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "clients": self.clients,
+                "encoded": self.encoded,
+                "avg_encode_ms": round(1000 * self.encode_time / self.encoded, 2) if self.encoded else 0.0
+            }
+
+class ReplayClock:
+    """
+    Simulated wall clock for replay runs.
+    Advances a fixed step per scored frame, so blink windows, heartbeats and cooldowns
+    behave as they would live no matter how fast frames are replayed.
+    """
+    def __init__(self, fps=10.0, start=0.0):
+        self.step = 1.0 / fps
+        self.start = start
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def frame_time(self, index):
+        """Capture time of the index-th frame: the clock reads this while that frame is scored."""
+        return self.start + index * self.step
+
+    def tick(self):
+        self.now += self.step
+
+class FrameSource:
+    """
+    Base class for everything the grabber reads frames from.
+    grab() advances the stream without decoding or converting; retrieve() produces the
+    grabbed frame. Frames the governor skips are only grabbed, so they cost no decode,
+    colour conversion or copy. read() keeps the cv2.VideoCapture interface.
+    With grayscale=True frames are single-channel luma and preprocess() skips cvtColor.
+    """
+    name = "source"
+    fps = None # Nominal stream rate, if known.
+
+    def __init__(self, grayscale=False):
+        self.grayscale = grayscale
+        self.grabbed_at = None   # Wall-clock time of the last successful grab.
+        self.grabbed_perf = None # perf_counter() of the same instant, for latency accounting.
+        self.grabbed = 0
+        self.retrieved = 0
+
+    def grab(self):
+        if not self._grab(): return False
+        self.grabbed_perf = time.perf_counter()
+        self.grabbed_at = time.time()
+        self.grabbed += 1
+        return True
+
+    def retrieve(self):
+        ok, frame = self._retrieve()
+        if ok: self.retrieved += 1
+        return ok, frame
+
+    def read(self):
+        if not self.grab(): return False, None
+        return self.retrieve()
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+    def stats(self):
+        return {
+            "source": self.name,
+            "grayscale": self.grayscale,
+            "grabbed": self.grabbed,
+            "retrieved": self.retrieved,
+            "skipped": self.grabbed - self.retrieved
+        }
+
+    def _grab(self):
+        raise NotImplementedError
+
+    def _retrieve(self):
+        raise NotImplementedError
+
+class CaptureFrameSource(FrameSource):
+    """
+    Webcam, video file or network stream through cv2.VideoCapture (or any object with its interface).
+    For cameras, grayscale=True asks the driver for unconverted frames: a mono (GREY) sensor
+    or the Y plane of YUYV is handed on without a BGR round trip. Backends that ignore the
+    request fall back to one cvtColor per retrieved frame.
+    """
+    def __init__(self, source=0, grayscale=False, api=cv2.CAP_ANY):
+        super().__init__(grayscale)
+        if hasattr(source, "read"):
+            self.cap = source
+            self.name = type(source).__name__
+        else:
+            self.cap = cv2.VideoCapture(source, api)
+            self.name = f"camera:{source}" if isinstance(source, int) else str(source)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if hasattr(self.cap, "get") else 0
+        self.fps = fps if fps and fps > 0 else None
+        self.native_luma = False
+        self.pending = (False, None)
+        if grayscale and isinstance(source, int):
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"YUYV"))
+            self.native_luma = bool(self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+    def stats(self):
+        return dict(super().stats(), native_luma=self.native_luma)
+
+    def _grab(self):
+        if hasattr(self.cap, "grab"): return self.cap.grab()
+        self.pending = self.cap.read() # Reader without grab/retrieve: decode now, hand over on retrieve().
+        return self.pending[0]
+
+    def _retrieve(self):
+        ok, frame = self.cap.retrieve() if hasattr(self.cap, "grab") else self.pending
+        if not ok or not self.grayscale: return ok, frame
+        if self.native_luma:
+            if frame.ndim == 2 and frame.shape[0] > 1: return ok, frame # Mono sensor.
+            if frame.ndim == 3 and frame.shape[2] == 2: return ok, np.ascontiguousarray(frame[:, :, 0]) # YUYV: Y is every other byte.
+            # Not a layout we can read luma from; go back to converted frames.
+            self.native_luma = False
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            ok, frame = self.cap.retrieve()
+            if not ok: return ok, frame
+        return ok, frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+class ImageDirectorySource(FrameSource):
+    """Frames from the image files of a directory, in name order. Skipped images are never read from disk."""
+    EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".pgm", ".ppm", ".tif", ".tiff")
+
+    def __init__(self, path, grayscale=False, loop=False, fps=None):
+        super().__init__(grayscale)
+        self.name = f"images:{path}"
+        self.fps = fps
+        self.loop = loop
+        self.files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(self.EXTENSIONS))
+        self.index = -1
+
+    def isOpened(self):
+        return bool(self.files)
+
+    def _grab(self):
+        if self.index + 1 >= len(self.files):
+            if not self.loop or not self.files: return False
+            self.index = -1
+        self.index += 1
+        return True
+
+    def _retrieve(self):
+        # Grayscale decodes straight to luma; no BGR image is ever built.
+        frame = cv2.imread(self.files[self.index], cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR)
+        return frame is not None, frame
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Deterministic stand-in for a camera.
+    Yields jittered copies of a still image (or of a seeded gradient/noise pattern), so replay
+    runs are reproducible without a camera or a recorded clip.
+    """
+    name = "synthetic"
+
+    def __init__(self, count=300, size=(640, 480), seed=0, image=None, grayscale=False):
+        super().__init__(grayscale)
+        self.count = count
+        self.index = 0
+        self.rng = np.random.default_rng(seed)
+        self.jitter = None
+        width, height = size
+        if image is not None:
+            self.base = cv2.resize(image, (width, height))
+            if grayscale and self.base.ndim == 3: self.base = cv2.cvtColor(self.base, cv2.COLOR_BGR2GRAY)
+        else:
+            gradient = np.tile(np.linspace(40, 200, width, dtype=np.uint8), (height, 1))
+            noise = self.rng.integers(0, 40, (height, width), dtype=np.uint8)
+            self.base = cv2.add(gradient, noise)
+            if not grayscale: self.base = cv2.cvtColor(self.base, cv2.COLOR_GRAY2BGR)
+
+    def _grab(self):
+        if self.index >= self.count: return False
+        self.index += 1
+        dx, dy = self.rng.integers(-4, 5, 2)
+        self.jitter = (int(dy), int(dx), int(self.rng.integers(0, 20)))
+        return True
+
+    def _retrieve(self):
+        dy, dx, brightness = self.jitter
+        frame = np.roll(self.base, (dy, dx), axis=(0, 1))
+        return True, cv2.add(frame, (brightness,) * 3 if frame.ndim == 3 else brightness)
+
+class LiveStreamStandIn(FrameSource):
+    """
+    Paces any source like a live RTSP camera, for offline tests of live-capture behaviour.
+    Frames are due at `fps` in real time whether or not anyone reads them: grab() waits for
+    the next due frame, and frames that came due while the consumer was busy are grabbed
+    past without being decoded, the way a network stream drops them.
+    """
+    def __init__(self, inner, fps=None):
+        super().__init__(inner.grayscale)
+        self.inner = inner
+        self.name = f"live:{inner.name}"
+        self.fps = fps or inner.fps or LIVE_STANDIN_FPS
+        self.started = None
+        self.position = -1 # Index of the inner frame last grabbed.
+        self.dropped = 0
+
+    def isOpened(self):
+        return self.inner.isOpened()
+
+    def set(self, prop, value):
+        return self.inner.set(prop, value)
+
+    def release(self):
+        self.inner.release()
+
+    def stats(self):
+        return dict(super().stats(), dropped_live=self.dropped, inner=self.inner.stats())
+
+    def _grab(self):
+        if self.started is None: self.started = time.perf_counter()
+        due = int((time.perf_counter() - self.started) * self.fps)
+        if due <= self.position:
+            time.sleep(max(0.0, self.started + (self.position + 1) / self.fps - time.perf_counter()))
+            due = self.position + 1
+        self.dropped += due - self.position - 1
+        while self.position < due:
+            if not self.inner.grab(): return False
+            self.position += 1
+        return True
+
+    def _retrieve(self):
+        return self.inner.retrieve()
+
+def open_frame_source(spec=None, grayscale=None):
+    """
+    Builds a FrameSource from a config value:
+    a camera index (int or digit string), a video file or rtsp://... URL, a directory of images,
+    "synthetic:N" for N generated frames, or "live:<any of these>" for a real-time paced stand-in.
+    FrameSources are returned as they are; other VideoCapture-like objects are wrapped.
+    """
+    spec = FRAME_SOURCE if spec is None else spec
+    grayscale = CAPTURE_LUMA if grayscale is None else grayscale
+    if isinstance(spec, FrameSource): return spec
+    if hasattr(spec, "read"): return CaptureFrameSource(spec, grayscale)
+    if isinstance(spec, str):
+        if spec.isdigit(): return CaptureFrameSource(int(spec), grayscale)
+        if spec.startswith("live:"): return LiveStreamStandIn(open_frame_source(spec[5:], grayscale))
+        if spec.startswith("synthetic:"): return SyntheticFrameSource(count=int(spec[10:]), grayscale=grayscale)
+        if os.path.isdir(spec): return ImageDirectorySource(spec, grayscale)
+    return CaptureFrameSource(spec, grayscale)
+
+def install_stop_signals(stop):
+    """
+    Routes SIGINT/SIGTERM to `stop` so a headless run shuts down cleanly (incident file closed,
+    log and spool flushed) instead of dying mid-frame. Returns a callable restoring the old handlers.
+    """
+    if threading.current_thread() is not threading.main_thread(): return lambda: None
+    previous = {}
+    for name in ("SIGINT", "SIGTERM"):
+        signum = getattr(signal, name, None)
+        if signum is None: continue
+        previous[signum] = signal.signal(signum, lambda received, frame: stop())
+    def restore():
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return restore
+
+_cascade_paths = {}
+
+def resolve_cascade(filename, search_dirs=None):
+    """Absolute path of a cascade file, searched in CASCADE_DIRS. Resolved once per process."""
+    if os.path.isabs(filename): return filename
+    if filename in _cascade_paths: return _cascade_paths[filename]
+    searched = [d for d in (search_dirs or CASCADE_DIRS) if d]
+    for directory in searched:
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            _cascade_paths[filename] = path
+            return path
+    raise FileNotFoundError(f"Cascade '{filename}' not found in {searched}")
+
+def load_cascade(filename):
+    """Loads and validates one cascade. An unreadable file fails here, not as 'no face' on every frame."""
+    path = resolve_cascade(filename)
+    cascade = cv2.CascadeClassifier()
+    try:
+        loaded = cascade.load(path)
+    except cv2.error:
+        loaded = False
+    if not loaded or cascade.empty():
+        raise ValueError(f"Cascade '{path}' could not be parsed")
+    return cascade
+
+class CascadeParams:
+    """detectMultiScale settings for one cascade. None sizes leave OpenCV's defaults."""
+    FIELDS = ("scale_factor", "min_neighbors", "min_size", "max_size")
+
+    def __init__(self, scale_factor=1.1, min_neighbors=3, min_size=None, max_size=None):
+        if scale_factor <= 1.0: raise ValueError(f"scale_factor must be > 1, got {scale_factor}")
+        if min_neighbors < 0: raise ValueError(f"min_neighbors must be >= 0, got {min_neighbors}")
+        self.scale_factor = float(scale_factor)
+        self.min_neighbors = int(min_neighbors)
+        self.min_size = tuple(int(v) for v in min_size) if min_size else None
+        self.max_size = tuple(int(v) for v in max_size) if max_size else None
+        self.cv_kwargs = {"scaleFactor": self.scale_factor, "minNeighbors": self.min_neighbors}
+        if self.min_size: self.cv_kwargs["minSize"] = self.min_size
+        if self.max_size: self.cv_kwargs["maxSize"] = self.max_size
+
+    def detect(self, cascade, gray):
+        return cascade.detectMultiScale(gray, **self.cv_kwargs)
+
+    def replace(self, **changes):
+        return CascadeParams(**dict(self.to_dict(), **changes))
+
+    def to_dict(self):
+        return {
+            "scale_factor": self.scale_factor,
+            "min_neighbors": self.min_neighbors,
+            "min_size": list(self.min_size) if self.min_size else None,
+            "max_size": list(self.max_size) if self.max_size else None
+        }
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown: raise ValueError(f"Unknown cascade parameters {sorted(unknown)}")
+        return cls(**dict(base.to_dict() if base else {}, **data))
+
+class DetectorProfile:
+    """Face and eye cascade parameters for one camera / vehicle model (see detector_profiles.json)."""
+    def __init__(self, name, face, eye):
+        self.name = name
+        self.face = face
+        self.eye = eye
+
+    def to_dict(self):
+        return {"face": self.face.to_dict(), "eye": self.eye.to_dict()}
+
+    @classmethod
+    def from_dict(cls, name, data, base=None):
+        """Fields missing from `data` are taken from `base`."""
+        unknown = set(data) - {"face", "eye", "description"}
+        if unknown: raise ValueError(f"Profile '{name}': unknown sections {sorted(unknown)}")
+        try:
+            return cls(name, CascadeParams.from_dict(data.get("face", {}), base and base.face),
+                       CascadeParams.from_dict(data.get("eye", {}), base and base.eye))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Profile '{name}': {e}") from None
+
+# The parameters this node always used, and the base every file profile extends.
+DEFAULT_DETECTOR_PROFILE = DetectorProfile("default",
+                                           CascadeParams(scale_factor=1.1, min_neighbors=5, min_size=(25, 25)),
+                                           CascadeParams(scale_factor=1.1, min_neighbors=10))
+
+_profile_files = {}
+
+def load_detector_profiles(path=None):
+    """
+    Reads a profile file: {"profiles": {name: {"face": {...}, "eye": {...}}}, "cameras": {device_id: name}}.
+    Profiles extend "default" (the file's, or DEFAULT_DETECTOR_PROFILE). A missing file yields only
+    the built-in default; a malformed one fails here rather than as missed faces. Read once per process.
+    """
+    path = path or DETECTOR_PROFILE_FILE
+    if path in _profile_files: return _profile_files[path]
+    data = {}
+    if os.path.isfile(path):
+        with open(path) as file:
+            data = json.load(file)
+    raw = data.get("profiles", {})
+    default = DetectorProfile.from_dict("default", raw.get("default", {}), DEFAULT_DETECTOR_PROFILE)
+    profiles = {name: DetectorProfile.from_dict(name, spec, default) for name, spec in raw.items()}
+    profiles["default"] = default
+    _profile_files[path] = (profiles, dict(data.get("cameras", {})))
+    return _profile_files[path]
+
+def detector_profile(name=None, device_id=None, path=None):
+    """The named profile, else the one the file assigns to device_id, else DETECTOR_PROFILE."""
+    profiles, cameras = load_detector_profiles(path)
+    name = name or cameras.get(device_id) or DETECTOR_PROFILE
+    if name not in profiles:
+        raise ValueError(f"Detector profile '{name}' not found in {path or DETECTOR_PROFILE_FILE}")
+    return profiles[name]
+
+def save_detector_profile(profile, path=None, cameras=(), description=None):
+    """Adds or replaces `profile` in the profile file and assigns it to `cameras`."""
+    path = path or DETECTOR_PROFILE_FILE
+    data = {"profiles": {}, "cameras": {}}
+    if os.path.isfile(path):
+        with open(path) as file:
+            data = json.load(file)
+    spec = profile.to_dict()
+    if description: spec["description"] = description
+    data.setdefault("profiles", {})[profile.name] = spec
+    data.setdefault("cameras", {}).update({device_id: profile.name for device_id in cameras})
+    with open(path + ".tmp", "w") as file:
+        json.dump(data, file, indent=2)
+    os.replace(path + ".tmp", path)
+    _profile_files.pop(path, None)
+
+class EyeState:
+    """What EyeStateEngine.process_frame() concluded about one frame."""
+    def __init__(self, timestamp, face_detected, eyes_detected, eyes_closed, closure, score, perclos, env,
+                 luminance, detections):
+        self.timestamp = timestamp
+        self.face_detected = face_detected
+        self.eyes_detected = eyes_detected # Raw reading of this frame.
+        self.eyes_closed = eyes_closed     # Smoothed, hysteresis-switched state (see FatigueScorer).
+        self.closure = closure             # Seconds the eyes were closed, on the frame they reopen; else None.
+        self.score = score
+        self.perclos = perclos
+        self.env = env
+        self.luminance = luminance
+        self.detections = detections       # [(face_box, eye_boxes), ...] in gray-frame coordinates.
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "face_detected": self.face_detected,
+            "eyes_detected": self.eyes_detected,
+            "eyes_closed": self.eyes_closed,
+            "closure": self.closure,
+            "score": round(self.score, 3),
+            "perclos": round(self.perclos, 4),
+            "env": self.env,
+            "luminance": round(self.luminance, 1),
+            "faces": [[int(v) for v in face] for face, _ in self.detections],
+            "eyes": [[[int(v) for v in eye] for eye in eyes] for _, eyes in self.detections]
+        }
+
+class EyeStateEngine:
+    """
+    The detection and scoring fast path on its own: face/eye search, lighting and fatigue state
+    for one driver, without a window, audio, microphone, telemetry, control plane or threads.
+    process_frame(gray) -> EyeState. DrowsinessDetector runs the same engine and adds those
+    services around it. One engine per stream: it keeps tracking and fatigue state.
+    """
+    def __init__(self, profile=None, cascades=None, clock=None, device_id=DEVICE_ID,
+                 tracking=TRACKING_MODE, eye_estimator=EYE_STATE_ESTIMATOR):
+        self.clock = clock or time.time
+        self.profile = profile if isinstance(profile, DetectorProfile) else detector_profile(profile, device_id)
+        self.face_cascade, self.eye_cascade = cascades or (load_cascade(FACE_CASCADE_FILE), load_cascade(EYE_CASCADE_FILE))
+        self.tracker = FaceTracker(params=self.profile.face) if tracking else None
+        self.eye_estimator = self.create_eye_estimator(eye_estimator)
+        self.environment = EnvironmentAnalyzer()
+        self.fatigue = FatigueScorer()
+
+    def create_eye_estimator(self, kind):
+        upper_half = self.tracker is not None
+        if kind == "gradient":
+            return GradientEyeEstimator(upper_half=upper_half, params=self.profile.eye)
+        return CascadeEyeEstimator(upper_half=upper_half, params=self.profile.eye)
+
+    def detect(self, gray, cascades=None, record=None):
+        """Returns [(face_box, eye_boxes), ...] for every face found. record(stage, started) receives stage timings."""
+        face_cascade, eye_cascade = cascades or (self.face_cascade, self.eye_cascade)
+        t0 = time.perf_counter()
+        faces = self.tracker.track(gray, face_cascade) if self.tracker else None
+        if faces is None:
+            faces = DrowsinessDetector.find_faces(gray, face_cascade, self.profile.face)
+            if self.tracker: self.tracker.update_keyframe(faces, gray.shape)
+        if record: record("face_cascade", t0)
+
+        t0 = time.perf_counter()
+        detections = self.eye_estimator.estimate(gray, faces, eye_cascade, self.environment.roi_normalization())
+        if record: record("eye_" + self.eye_estimator.name, t0)
+        return detections
+
+    def assess(self, gray, detections, now=None):
+        """Lighting and fatigue update for a frame whose detections are known. Frames must arrive in capture order."""
+        now = self.clock() if now is None else now
+        luminance, env = self.environment.update(gray)
+        face_detected = len(detections) > 0
+        eyes_detected = any(len(eyes) > 0 for _, eyes in detections)
+        closure = self.fatigue.update(now, face_detected, eyes_detected)
+        return EyeState(now, face_detected, eyes_detected, self.fatigue.eyes_closed, closure, self.fatigue.score,
+                        self.fatigue.perclos_value(), env, luminance, detections)
+
+    def process_frame(self, gray, now=None):
+        """
+        Detection and scoring for one frame (luma; BGR frames are converted).
+        `now` is the frame's capture time, e.g. FrameSource.grabbed_at. It defaults to the clock,
+        which is only right when the frame was grabbed just before this call.
+        """
+        if gray.ndim == 3: gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+        return self.assess(gray, self.detect(gray), now)
+
+def _engine_attribute(name):
+    return property(lambda self: getattr(self.engine, name), lambda self, value: setattr(self.engine, name, value))
+
+class DrowsinessDetector:
+    # Detection and eye-state scoring live in self.engine (EyeStateEngine).
+    profile = _engine_attribute("profile")
+    tracker = _engine_attribute("tracker")
+    eye_estimator = _engine_attribute("eye_estimator")
+    environment = _engine_attribute("environment")
+    fatigue = _engine_attribute("fatigue")
+
+    def __init__(self, capture=None, clock=None, device_id=DEVICE_ID, log_file=LOG_FILE,
+                 evidence_dir=EVIDENCE_DIR, spool_path=SPOOL_PATH, cascades=None, control=None, profile=None):
+        # Replay and benchmarks inject a recorded source and a simulated clock.
+        # CabinSupervisor gives every stream its own identity, files and spool.
+        self.clock = clock or time.time
+        self.device_id = device_id
+        self.profiler = MetricsRegistry() if METRICS_ENABLED else None # Near-zero cost when None.
+        self.last_status = None
+        self.headless = HEADLESS
+        self.hud_sinks = [] # Receivers of HUD-rendered frames (e.g. a debug stream): wants_frame() and offer_frame(frame).
+        self.startup_ms = {}
+        self.first_frame_ms = None
+        init_started = time.perf_counter()
+        # Telemetry link, evidence upload, speech and the heartbeat timer run on the control plane.
+        self.control = control or ControlPlane(f"control-{device_id}")
+        self.owns_control = control is None
+
+        # The camera and the cascades gate the first frame, so they load concurrently while the
+        # remaining subsystems are built; TTS and the microphone finish in the background.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup") as startup:
+            camera = startup.submit(self._timed_startup, "camera", open_frame_source) if capture is None else None
+            loaded = startup.submit(self._timed_startup, "cascades", self.create_cascades) if cascades is None else None
+
+            self.iot = self._timed_startup("iot", lambda: IoTClient(device_id, self, spool=TelemetrySpool(spool_path),
+                                                                    control=self.control))
+            self.vehicle = VehicleTelemetry(clock=self.clock)
+            self.voice = DriverVoiceAssistant(self.control)
+            self.alarm = create_alarm()
+            self.listener = DriverVoiceListener(self) # NEW: Voice Listener
+            self.log_sink = TelemetryLogSink(log_file, device_id)
+            self.black_box = BlackBoxRecorder(fps=10, evidence_dir=evidence_dir)
+
+            self.cap = camera.result() if camera else open_frame_source(capture)
+            self.face_cascade, self.eye_cascade = loaded.result() if loaded else cascades
+        self.startup_ms["init"] = round((time.perf_counter() - init_started) * 1000, 1)
+
+        # Alert side effects run on the bus, never on the frame loop.
+        self.bus = EventBus()
+        self.voice.attach(self.bus)
+        self.iot.attach(self.bus)
+        self.black_box.attach(self.bus, clock=self.clock)
+        self.bus.subscribe("alarm", lambda event: self.play_alarm(), ("ALERT",), coalesce=("ALERT",))
+        self.bus.subscribe("log", self._log_event, ("ALERT",))
+        self.bus.subscribe("sos", self._on_blink, ("BLINK",))
+
+        self.inference_backend = None # ProcessInferenceBackend when INFERENCE_BACKEND == "process".
+        self.engine = EyeStateEngine(profile, (self.face_cascade, self.eye_cascade), self.clock, device_id)
+        self.governor = PerformanceGovernor() if GOVERNOR_ENABLED else None
+
+        self.score = 0
+        self.threshold = 15
+        self.font = cv2.FONT_HERSHEY_COMPLEX_SMALL
+        self.last_heartbeat = self.clock()
+        self.heartbeat_timer = None # Live runs: control-plane timer. Replay: heartbeats follow the replay clock.
+        self.last_scored = time.monotonic()
+        
+        self.blink_timestamps = deque(maxlen=10) 
+        self.last_advisory_time = 0
+        self.last_alert_event_time = 0
+        self.current_env = "DAY"
+        self.sos_verification_pending = False # Prevents spamming
+
+        if hasattr(self.profiler, "register_gauge"):
+            self.profiler.register_gauge("incident_frames_dropped_total", lambda: self.black_box.encoder.dropped)
+            self.profiler.register_gauge("telemetry_pending", lambda: len(self.iot.pending))
+            self.profiler.register_gauge("events_pending", self.bus.pending)
+
+    def log_locally(self, event, score, speed):
+        self.log_sink.log(event, score, speed)
+
+    def _log_event(self, event):
+        self.log_locally(event.type, event.payload["score"], event.payload["speed"])
+
+    def _on_blink(self, event):
+        self.blink_timestamps.append(event.payload["time"])
+        self.check_blink_patterns()
+
+    def update_threshold(self, new_val):
+        self.threshold = new_val
+
+    def play_alarm(self):
+        try:
+            self.alarm.beep(*ALARM_TONE)
+        except Exception:
+            print("\a")
+            
+    def check_blink_patterns(self):
+        if len(self.blink_timestamps) < 4: return
+        times = list(self.blink_timestamps)[-4:]
+        if times[-1] - times[0] < 2.5:
+            if not self.sos_verification_pending:
+                print("\n*** RAPID BLINK DETECTED: REQUESTING CONFIRMATION ***")
+                self.request_sos_confirmation()
+            self.blink_timestamps.clear() 
+
+    def request_sos_confirmation(self):
+        self.sos_verification_pending = True
+        self.bus.publish("SOS_REQUEST")
+
+    def trigger_sos_manual(self, method):
+        self.sos_verification_pending = False
+        self.voice.speak("SOS Signal Confirmed. Sending Emergency Alert.", priority=True)
+        self.bus.publish("DRIVER_SIGNAL", {"type": "SOS", "method": method})
+
+    def cancel_sos(self):
+        self.sos_verification_pending = False
+        self.voice.speak("SOS Request Cancelled.", priority=True)
+
+    def reset_alert_state(self, source):
+        self.fatigue.reset_score()
+        self.score = 0
+        self.bus.publish("STATUS_RESET", {"source": source})
+
+    def analyze_environment(self, gray_frame):
+        avg_brightness, status = self.environment.update(gray_frame)
+
+        # Voice Trigger for Environment Change
+        if status != self.current_env:
+             self.bus.publish("ENV_CHANGE", {"env": status})
+             self.current_env = status
+             
+        return avg_brightness, status
+
+    @staticmethod
+    def load_cascades():
+        return load_cascade(FACE_CASCADE_FILE), load_cascade(EYE_CASCADE_FILE)
+
+    def create_cascades(self):
+        return self.load_cascades()
+
+    def _timed_startup(self, name, factory, *args):
+        t0 = time.perf_counter()
+        result = factory(*args)
+        self.startup_ms[name] = round((time.perf_counter() - t0) * 1000, 1)
+        return result
+
+    def start_heartbeat(self, interval=HEARTBEAT_INTERVAL):
+        """Moves heartbeats to a control-plane timer, so they keep coming (as 'stalled') if frames stop."""
+        self.heartbeat_timer = self.control.every(interval, self._timed_heartbeat, "heartbeat")
+
+    def _timed_heartbeat(self):
+        status = self.last_status # Replaced, never mutated, by the scoring thread.
+        if status is None: return
+        stalled = time.monotonic() - self.last_scored > HEARTBEAT_INTERVAL
+        self.publish_heartbeat(status["speed"], status["mode"], status["perclos"], "stalled" if stalled else "ok")
+
+    def publish_heartbeat(self, speed, mode, perclos, state="ok"):
+        heartbeat = {
+            "status": state,
+            "speed": speed,
+            "mode": mode,
+            "perclos": round(perclos, 3)
+        }
+        if hasattr(self.profiler, "heartbeat_summary"):
+            heartbeat["metrics"] = self.profiler.heartbeat_summary()
+        if self.governor:
+            heartbeat["governor"] = self.governor.state()
+        self.bus.publish("HEARTBEAT", heartbeat)
+
+    def startup_report(self):
+        return {
+            "since_boot_ms": self.first_frame_ms,
+            "phases_ms": dict(self.startup_ms),
+            "detector_profile": self.profile.name,
+            "tts_ms": self.voice.init_ms,
+            "microphone_ms": self.listener.init_ms
+        }
+
+    # --- Pipeline Stages ---
+    def _record_latency(self, stage, started):
+        if self.profiler: self.profiler.record(stage, time.perf_counter() - started)
+
+    def preprocess(self, frame):
+        if frame.ndim == 2:
+            gray = frame # Luma capture, nothing to convert.
+        else:
+            t0 = time.perf_counter()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            self._record_latency("cvtColor", t0)
+        if self.governor and self.governor.downscale < 1.0:
+            # Detection runs on the downscaled image, render_hud maps boxes back to the frame.
+            scale = self.governor.downscale
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    @staticmethod
+    def find_faces(gray, face_cascade, params=None):
+        return (params or DEFAULT_DETECTOR_PROFILE.face).detect(face_cascade, gray)
+
+    @staticmethod
+    def find_eyes(gray, faces, eye_cascade, upper_half=False, params=None, normalize=None):
+        """
+        Returns [(face_box, eye_boxes), ...]. In tracking mode eyes are only searched in the upper half of the face.
+        `normalize` ("clahe" / "equalize") contrast-normalizes each face ROI first, for NIGHT and GLARE frames.
+        """
+        detections = []
+        for (x, y, w, h) in faces:
+            eye_h = h // 2 if upper_half else h
+            roi_gray = gray[y:y+eye_h, x:x+w]
+            if normalize: roi_gray = normalize_contrast(roi_gray, normalize)
+            eyes = (params or DEFAULT_DETECTOR_PROFILE.eye).detect(eye_cascade, roi_gray)
+            detections.append(((x, y, w, h), eyes))
+        return detections
+
+    def detect(self, gray, cascades=None):
+        """Inference stage. Returns [(face_box, eye_boxes), ...] for every face found."""
+        if self.inference_backend:
+            return self._detect_remote(gray)
+
+        return self.engine.detect(gray, cascades, self._record_latency)
+
+    def create_eye_estimator(self, kind):
+        return self.engine.create_eye_estimator(kind)
+
+    def _detect_remote(self, gray):
+        regions = self.tracker.regions(gray.shape) if self.tracker else None
+        t0 = time.perf_counter()
+        detections, tracked = self.inference_backend.detect(gray, regions, self.tracker is not None, self.profile,
+                                                            self.environment.roi_normalization(), self.eye_estimator)
+        self._record_latency("process_inference", t0)
+        if self.tracker:
+            faces = [face for face, _ in detections]
+            if tracked:
+                self.tracker.update_tracked(faces)
+            else:
+                if regions: self.tracker.mark_lost()
+                self.tracker.update_keyframe(faces, gray.shape)
+        return detections
+
+    def process_detections(self, frame, gray, detections, captured_at=None):
+        """Scoring, alerting and HUD stage. Stateful, so it must see frames in capture order."""
+        status = self.update_state(frame, gray, detections, captured_at)
+        if self.first_frame_ms is None:
+            self.first_frame_ms = round((time.perf_counter() - BOOT_TIME) * 1000, 1)
+            report = self.startup_report()
+            print(f"[STARTUP] {self.device_id} first frame analyzed: {json.dumps(report)}")
+            self.bus.publish("STARTUP", report)
+
+        # The HUD is only drawn when someone looks at it: the window, a HUD sink or the black box.
+        if not BLACK_BOX_HUD: self._buffer_evidence(frame)
+        # Sinks rebind (never mutate) this list, so iterating is safe. Throttled sinks decline most frames.
+        sinks = [sink for sink in self.hud_sinks if sink.wants_frame()] if self.hud_sinks else ()
+        if BLACK_BOX_HUD or sinks or not self.headless:
+            t0 = time.perf_counter()
+            if frame.ndim == 2: frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) # Luma capture: colour only for the HUD.
+            self.render_hud(frame, detections, status)
+            self._record_latency("hud_draw", t0)
+            for sink in sinks:
+                sink.offer_frame(frame)
+        if BLACK_BOX_HUD: self._buffer_evidence(frame)
+        self.last_status = status
+        return frame
+
+    def _buffer_evidence(self, frame):
+        t0 = time.perf_counter()
+        self.black_box.add_frame(frame)
+        self._record_latency("black_box", t0)
+
+    def update_state(self, frame, gray, detections, captured_at=None):
+        """
+        Fatigue scoring, alerting and telemetry for one frame. Returns the frame status used by the HUD.
+        Time-based scoring runs on captured_at, so queueing and inference delay do not stretch or
+        squeeze closures; it falls back to the clock for frames without a capture time.
+        """
+        height, width = frame.shape[:2]
+        now = self.clock() if captured_at is None else captured_at
+        current_speed = self.vehicle.update()
+
+        # ADAPTIVE THRESHOLD LOGIC
+        if current_speed < 5:
+            self.threshold = 999 # Parked
+            drive_mode = "PARKED"
+        elif current_speed > 80:
+            self.threshold = 10 # Highway
+            drive_mode = "HIGHWAY"
+        else:
+            self.threshold = 20 # City
+            drive_mode = "CITY"
+        if self.governor: self.governor.set_mode(drive_mode)
+
+        t0 = time.perf_counter()
+        luminance, env_status = self.analyze_environment(gray)
+        self._record_latency("analyze_environment", t0)
+
+        self.last_scored = time.monotonic()
+        if self.heartbeat_timer is None and now - self.last_heartbeat > HEARTBEAT_INTERVAL:
+            self.publish_heartbeat(current_speed, drive_mode, self.fatigue.perclos_value())
+            self.last_heartbeat = now
+
+        face_detected = len(detections) > 0
+        eyes_detected = any(len(eyes) > 0 for _, eyes in detections)
+
+        # Scoring Logic (time-based, see FatigueScorer)
+        closure = self.fatigue.update(now, face_detected, eyes_detected)
+        if closure is not None and SOS_BLINK_RANGE[0] <= closure <= SOS_BLINK_RANGE[1]:
+            self.bus.publish("BLINK", {"time": now, "duration": closure})
+        self.score = int(self.fatigue.score)
+
+        # Predictive Analytics
+        avg_fatigue = self.fatigue.avg_score()
+        perclos = self.fatigue.perclos_value()
+
+        # --- CHATBOT LOGIC ---
+        # 1. Predictive "Take a Break" Chat
+        advisory = (avg_fatigue > 5 or perclos > PERCLOS_ADVISORY) and current_speed > 30
+        if advisory:
+            if now - self.last_advisory_time > 60: # Chat only once every minute
+                self.bus.publish("ADVISORY", {"avg_fatigue": avg_fatigue, "perclos": perclos})
+                self.last_advisory_time = now
+
+        # 2. Critical Alert: voice warning, alarm, evidence, telemetry and log are bus subscribers.
+        alert = self.score > self.threshold and drive_mode != "PARKED"
+        if alert and now - self.last_alert_event_time >= ALERT_EVENT_INTERVAL:
+            self.last_alert_event_time = now
+            self.bus.publish("ALERT", {"score": self.score, "speed": current_speed})
+
+        return {
+            "speed": current_speed,
+            "mode": drive_mode,
+            "env": env_status,
+            "face_detected": face_detected,
+            "eyes_detected": eyes_detected,
+            "score": self.score,
+            "threshold": self.threshold,
+            "avg_fatigue": avg_fatigue,
+            "perclos": perclos,
+            "eyes_closed": self.fatigue.eyes_closed,
+            "advisory": advisory,
+            "alert": alert,
+            "box_scale": width / gray.shape[1] # Detection boxes are in gray (possibly downscaled) coordinates.
+        }
+
+    def render_hud(self, frame, detections, status):
+        height, width = frame.shape[:2]
+        cv2.rectangle(frame, (0,height-60), (width,height), (0,0,0), -1)
+        cv2.rectangle(frame, (0,0), (width, 40), (0,0,0), -1)
+
+        k = status["box_scale"]
+        for face, eyes in detections:
+            x, y, w, h = (int(v * k) for v in face)
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (100, 100, 100), 1)
+            for eye in eyes:
+                ex, ey, ew, eh = (int(v * k) for v in eye)
+                cv2.rectangle(frame[y:y+h, x:x+w], (ex, ey), (ex+ew, ey+eh), (0, 255, 0), 2)
+
+        if not status["face_detected"]:
+            cv2.putText(frame, "NO DRIVER", (10, height-20), self.font, 1, (255, 255, 255), 2)
+        elif status["eyes_closed"]:
+            cv2.putText(frame, "EYES CLOSED", (10, height-20), self.font, 1, (0, 0, 255), 2)
+        else:
+            cv2.putText(frame, "DRIVER ACTIVE", (10, height-20), self.font, 1, (0, 255, 0), 2)
+
+        # Display Dashboard Data
+        cv2.putText(frame, f"SPD: {status['speed']} km/h", (10, 30), self.font, 1, (0, 255, 255), 2)
+        cv2.putText(frame, f"MODE: {status['mode']}", (width-200, 30), self.font, 1, (200, 200, 200), 1)
+        cv2.putText(frame, f"PERCLOS: {status['perclos']:.0%}", (width//2 - 80, 30), self.font, 1, (200, 200, 200), 1)
+
+        score, threshold = status["score"], status["threshold"]
+        color = (0, 255, 0)
+        if score > threshold * 0.5: color = (0, 165, 255)
+        if score > threshold: color = (0, 0, 255)
+
+        limit_text = "INF" if threshold == 999 else str(threshold)
+        cv2.putText(frame, f'FATIGUE: {score} / {limit_text}', (width-250, height-20), self.font, 1, color, 1)
+
+        if status["advisory"]:
+            cv2.putText(frame, "ADVISORY: TAKE A BREAK", (width//2 - 150, height//2), self.font, 1.2, (0, 255, 255), 2)
+
+        if status["alert"]:
+            cv2.rectangle(frame, (0,0), (width, height), (0,0,255), 10)
+
+        # Show Verification Pending on UI
+        if self.sos_verification_pending:
+             cv2.putText(frame, "SAY 'CONFIRM' TO SEND SOS", (width//2 - 200, height//2 + 50), self.font, 1.2, (0, 0, 255), 2)
+
+    def run(self):
+        if not self.cap.isOpened():
+            print("Error: Webcam not found.")
+            return
+
+        self.listener.start() # Start listening in background
+        self.start_heartbeat()
+        self.voice.speak("System Online. Voice Commands Active.")
+        print(f"System Active. CAN Bus Link Established.")
+
+        metrics_server = None
+        if hasattr(self.profiler, "register_gauge") and METRICS_PORT is not None:
+            try:
+                metrics_server = MetricsServer(self.profiler)
+                metrics_server.start()
+            except OSError as e:
+                print(f"[METRICS] Endpoint disabled: {e}")
+
+        debug_stream = None
+        if DEBUG_STREAM_PORT is not None:
+            try:
+                debug_stream = DebugStreamServer(self, port=DEBUG_STREAM_PORT)
+                debug_stream.start()
+            except OSError as e:
+                print(f"[DEBUG-STREAM] Disabled: {e}")
+
+        workers = INFERENCE_WORKERS
+        if INFERENCE_BACKEND == "process":
+            self.inference_backend = ProcessInferenceBackend()
+            workers = self.inference_backend.slot_count
+
+        pipeline = FramePipeline(self, self.cap, inference_workers=workers, display=not self.headless)
+        restore = install_stop_signals(pipeline.stop)
+        try:
+            report = pipeline.run()
+        finally:
+            restore()
+        if metrics_server: metrics_server.stop()
+        if debug_stream:
+            debug_stream.stop()
+            print(f"[DEBUG-STREAM] {json.dumps(debug_stream.stats())}")
+        print(f"[PIPELINE] Stage throughput: {json.dumps(report)}")
+        if self.tracker:
+            print(f"[PIPELINE] Face tracking: {json.dumps(self.tracker.stats())}")
+        print(f"[PIPELINE] Eye state: {json.dumps(self.eye_estimator.stats())}")
+        print(f"[PIPELINE] Lighting: {json.dumps(self.environment.stats())}")
+
+        self.shutdown()
+        self.cap.release()
+        if not self.headless: cv2.destroyAllWindows()
+
+    def shutdown(self):
+        """Delivers queued events, finishes any incident file and flushes the local log and telemetry spool."""
+        self.bus.drain() # A queued ALERT may still start an incident file.
+        self.black_box.stop_recording()
+        self.black_box.encoder.flush(timeout=10)
+        self.bus.close() # After the flush, so the EVIDENCE_SAVED of the last file still reaches the uploader.
+        print(f"[EVENTS] {self.device_id}: {json.dumps(self.bus.stats())}")
+        self.black_box.encoder.stop(timeout=1)
+        print(f"[BLACK-BOX] {self.device_id} encoder: {json.dumps(self.black_box.encoder.stats())}")
+        print(f"[BLACK-BOX] {self.device_id} pre-incident buffer: {json.dumps(self.black_box.buffer_stats())}")
+        self.log_sink.close()
+        print(f"[FORENSICS] {self.device_id} evidence upload: {json.dumps(self.iot.uploader.stats())}")
+        self.listener.stop()
+        self.voice.close()
+        self.iot.close()
+        if self.owns_control:
+            self.control.stop()
+            print(f"[CONTROL] {self.device_id}: {json.dumps(self.control.stats())}")
+        if self.inference_backend:
+            self.inference_backend.close()
+            self.inference_backend = None
+
+class InferencePool:
+    """
+    Inference workers shared by several FramePipelines.
+    Each worker loads one cascade pair (cascades are not thread-safe) and serves every
+    attached stream round-robin, so N cameras cost `workers` classifier instances instead
+    of N, and throughput scales with cores rather than with the number of cameras.
+    """
+    def __init__(self, workers=os.cpu_count() or 1, cascade_factory=None):
+        self.workers = max(1, workers)
+        self.cascade_factory = cascade_factory or DrowsinessDetector.load_cascades
+        self.pipelines = []
+        self.lock = threading.Lock()
+        self.work_available = threading.Event()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def attach(self, pipeline):
+        pipeline.capture_queue.on_put = self.work_available.set
+        with self.lock:
+            self.pipelines.append(pipeline)
+        self.work_available.set()
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, args=(self.cascade_factory(), i),
+                                 name=f"pool-inference-{i}", daemon=True)
+            self.threads.append(t)
+            t.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.work_available.set()
+        for t in self.threads:
+            t.join(5)
+
+    def _worker_loop(self, cascades, offset):
+        turn = offset # Workers start at different streams so one busy camera can't starve the rest.
+        while not self.stop_event.is_set():
+            self.work_available.clear()
+            with self.lock:
+                self.pipelines = [p for p in self.pipelines if not p.finished]
+                pipelines = list(self.pipelines)
+
+            worked = False
+            for i in range(len(pipelines)):
+                pipeline = pipelines[(turn + i) % len(pipelines)]
+                packet = pipeline.take_packet(timeout=0)
+                if packet is not None:
+                    pipeline.infer_packet(packet, cascades)
+                    worked = True
+            turn += 1
+
+            if not worked:
+                self.work_available.wait(0.05)
+
+class CabinSupervisor:
+    """
+    Monitors several cameras (bus seats, depot bays, ...) in one process.
+    Every stream gets its own DrowsinessDetector, so score, blink history, black box,
+    log file, spool and device identity stay separate, while inference runs on one
+    shared InferencePool and the non-vision services on one shared ControlPlane.
+
+    streams: [{"source": 0 or "rtsp-or-file", "device_id": "BUS_12_SEAT_1"}, ...]
+    (any source open_frame_source accepts; "profile" picks a detector profile)
+    """
+    def __init__(self, streams, workers=os.cpu_count() or 1, display=True):
+        self.display = display
+        self.pool = InferencePool(workers)
+        self.control = ControlPlane("cabin-control")
+        self.detectors = []
+        self.pipelines = []
+        shared_cascades = DrowsinessDetector.load_cascades()
+        for stream in streams:
+            device_id = stream["device_id"]
+            source = stream.get("source", 0)
+            capture = open_frame_source(source)
+            detector = DrowsinessDetector(
+                capture=capture,
+                device_id=device_id,
+                log_file=stream.get("log_file", f"telemetry_{device_id}.csv"),
+                evidence_dir=stream.get("evidence_dir", os.path.join(EVIDENCE_DIR, device_id)),
+                spool_path=stream.get("spool_path", f"telemetry_spool_{device_id}.db"),
+                cascades=shared_cascades,
+                control=self.control,
+                profile=stream.get("profile")
+            )
+            self.detectors.append(detector)
+            detector.headless = not display
+            self.pipelines.append(FramePipeline(detector, capture, pool=self.pool, display=display))
+
+    def run(self):
+        print(f"[SUPERVISOR] Monitoring {len(self.pipelines)} cabins on {self.pool.workers} inference workers.")
+        self.pool.start()
+        for detector, pipeline in zip(self.detectors, self.pipelines):
+            detector.start_heartbeat()
+            pipeline.start()
+        restore = install_stop_signals(lambda: [p.stop() for p in self.pipelines])
+
+        try:
+            while not all(p.display_queue.closed and len(p.display_queue) == 0 for p in self.pipelines):
+                shown = False
+                for detector, pipeline in zip(self.detectors, self.pipelines):
+                    frame = pipeline.display_queue.get(timeout=0)
+                    if frame is None or not self.display: continue
+                    cv2.imshow(detector.device_id, frame)
+                    shown = True
+                if shown:
+                    if cv2.waitKey(1) & 0xFF == ord('q'): break
+                else:
+                    time.sleep(0.005)
+        finally:
+            restore()
+            for pipeline in self.pipelines:
+                pipeline.stop()
+            for pipeline in self.pipelines:
+                pipeline.join()
+            self.pool.stop()
+
+        reports = {}
+        for detector, pipeline in zip(self.detectors, self.pipelines):
+            reports[detector.device_id] = pipeline.report()
+            detector.shutdown()
+            pipeline.capture.release()
+        self.control.stop()
+        print(f"[CONTROL] {json.dumps(self.control.stats())}")
+        if self.display: cv2.destroyAllWindows()
+        print(f"[SUPERVISOR] Stream throughput: {json.dumps(reports)}")
+        return reports
+
+def run_live(args):
+    global DEBUG_STREAM_PORT, ALARM_BACKEND
+    DEBUG_STREAM_PORT = args.debug_stream
+    ALARM_BACKEND = args.alarm
+    if CABIN_STREAMS:
+        CabinSupervisor(CABIN_STREAMS, display=not args.headless).run()
+    else:
+        detector = DrowsinessDetector(capture=args.source, profile=args.profile)
+        detector.headless = args.headless
+        detector.run()
+    return 0
+
+def run_replay(args):
+    """EyeStateEngine alone over a clip, one JSON line per frame. Time-based logic follows --fps."""
+    source = open_frame_source(args.source, grayscale=True)
+    if not source.isOpened():
+        print(f"Error: cannot open {args.source}", file=sys.stderr)
+        return 1
+    engine = EyeStateEngine(args.profile)
+    output = open(args.jsonl, "w") if args.jsonl else sys.stdout
+    frames = closed = 0
+    started = time.perf_counter()
+    try:
+        while args.max_frames is None or frames < args.max_frames:
+            ok, gray = source.read()
+            if not ok: break
+            state = engine.process_frame(gray, now=frames / args.fps)
+            output.write(json.dumps(dict(state.to_dict(), frame=frames)) + "\n")
+            frames += 1
+            closed += state.eyes_closed
+    finally:
+        source.release()
+        if output is not sys.stdout: output.close()
+    elapsed = time.perf_counter() - started
+    print(f"[REPLAY] {frames} frames at {frames / elapsed if elapsed > 0 else 0.0:.1f} FPS, "
+          f"eyes closed in {closed}.", file=sys.stderr)
+    return 0
+
+def main(argv=None):
+    """`adss` command line: live (the default, so `python drowsiness_edge_node.py --headless` still works), replay, benchmark."""
+    import argparse
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] == "benchmark":
+        import adss_benchmark # Its own options, see `adss benchmark --help`.
+        return adss_benchmark.main(argv[1:])
+    if not argv or (argv[0].startswith("-") and argv[0] not in ("-h", "--help")):
+        argv = ["live"] + argv
+
+    parser = argparse.ArgumentParser(prog="adss", description="IoT Advanced Driver Safety System edge node.")
+    modes = parser.add_subparsers(dest="mode", required=True)
+    live = modes.add_parser("live", help="Monitor a camera or stream with all services (default).")
+    live.add_argument("--headless", action="store_true", default=HEADLESS,
+                      help="No window and no HUD drawing. Stop with Ctrl+C or SIGTERM.")
+    live.add_argument("--debug-stream", type=int, metavar="PORT", default=DEBUG_STREAM_PORT,
+                      help="Serve the HUD as MJPEG (and status as SSE) on this port.")
+    live.add_argument("--source", default=None, help="Frame source (default: FRAME_SOURCE), as in open_frame_source().")
+    live.add_argument("--profile", default=None, help="Detector profile (default: by device ID, else DETECTOR_PROFILE).")
+    live.add_argument("--alarm", choices=ALARM_BACKENDS, default=ALARM_BACKEND)
+    replay = modes.add_parser("replay", help="Print the eye state of every frame of a clip; no GUI, audio or network.")
+    replay.add_argument("source", help="Video file, image directory, URL or synthetic:N.")
+    replay.add_argument("--fps", type=float, default=10.0, help="Frame rate the clip was recorded at.")
+    replay.add_argument("--profile", default=None)
+    replay.add_argument("--max-frames", type=int, default=None)
+    replay.add_argument("--jsonl", help="Write the frame states to this file instead of stdout.")
+    modes.add_parser("benchmark", help="Replay through the full pipeline and report latency (adss_benchmark.py).")
+    args = parser.parse_args(argv)
+    return run_replay(args) if args.mode == "replay" else run_live(args)
 
 if __name__ == "__main__":
-    detector = DrowsinessDetector()
-    detector.run()
\ No newline at end of file
+    sys.exit(main())
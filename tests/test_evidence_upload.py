@@ -0,0 +1,148 @@
+"""Chunked, resumable evidence upload: EvidenceUploader against a LocalEvidenceServer."""
+import os
+import time
+
+import pytest
+
+import drowsiness_edge_node as edge
+
+
+CHUNK = 1024
+
+class FlakyEvidenceServer(edge.LocalEvidenceServer):
+    """Stand-in that rejects the chunk PUTs whose (1-based) numbers are listed in fail_puts."""
+    def __init__(self, root, fail_puts=()):
+        super().__init__(root=root)
+        self.fail_puts = set(fail_puts)
+        self.puts = 0
+
+    def _store_chunk(self, digest, body):
+        self.puts += 1
+        if self.puts in self.fail_puts:
+            return 503, {"error": "injected failure"}
+        return super()._store_chunk(digest, body)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition(): return True
+        time.sleep(0.02)
+    return condition()
+
+def write_file(path, data):
+    with open(path, "wb") as file:
+        file.write(data)
+    return str(path)
+
+def assembled_files(server):
+    directory = os.path.join(server.root, "files")
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture
+def control():
+    plane = edge.ControlPlane("test-control")
+    yield plane
+    plane.stop()
+
+@pytest.fixture
+def server(tmp_path):
+    standin = edge.LocalEvidenceServer(root=str(tmp_path / "cloud"))
+    yield standin
+    standin.stop()
+
+def make_uploader(tmp_path, server, control, **kwargs):
+    progress = edge.UploadProgressStore(str(tmp_path / "progress.db"))
+    kwargs.setdefault("rate", None)
+    return edge.EvidenceUploader(progress, base_url=server.url, chunk_size=CHUNK, control=control, **kwargs)
+
+
+def test_assembled_file_is_byte_identical(tmp_path, server, control):
+    data = os.urandom(10 * CHUNK + 123)
+    path = write_file(tmp_path / "incident.avi", data)
+    uploader = make_uploader(tmp_path, server, control)
+    uploader.file_ready(path)
+
+    assert wait_for(lambda: uploader.files_uploaded == 1)
+    assert uploader.chunks_sent == 11
+    files = assembled_files(server)
+    assert len(files) == 1 and files[0].endswith("_incident.avi")
+    with open(files[0], "rb") as file:
+        assert file.read() == data
+    uploader.close()
+
+def test_upload_resumes_after_chunk_failure(tmp_path, control, monkeypatch):
+    monkeypatch.setattr(edge, "RECONNECT_BACKOFF_MIN", 60.0) # Park the worker after the failure.
+    server = FlakyEvidenceServer(str(tmp_path / "cloud"), fail_puts={4})
+    data = os.urandom(8 * CHUNK)
+    path = write_file(tmp_path / "incident.avi", data)
+    uploader = make_uploader(tmp_path, server, control)
+    uploader.file_ready(path)
+    assert wait_for(lambda: uploader.retries == 1)
+    assert uploader.chunks_sent == 3
+    uploader.close() # Like a reboot mid-upload: progress stays in the database.
+
+    uploader = make_uploader(tmp_path, server, control)
+    assert wait_for(lambda: uploader.files_uploaded == 1)
+    # Only the chunks after the failure are sent again, none twice.
+    assert uploader.chunks_sent == 5
+    assert server.chunks_received == 8
+    assert server.duplicates == 0
+    with open(assembled_files(server)[0], "rb") as file:
+        assert file.read() == data
+    uploader.close()
+    server.stop()
+
+def test_chunks_the_server_holds_are_skipped(tmp_path, server, control):
+    shared = os.urandom(4 * CHUNK)
+    first = write_file(tmp_path / "first.avi", shared + os.urandom(2 * CHUNK))
+    second = write_file(tmp_path / "second.avi", shared + os.urandom(3 * CHUNK))
+    uploader = make_uploader(tmp_path, server, control, workers=1)
+
+    uploader.file_ready(first)
+    assert wait_for(lambda: uploader.files_uploaded == 1)
+    uploader.file_ready(second)
+    assert wait_for(lambda: uploader.files_uploaded == 2)
+
+    assert uploader.chunks_skipped == 4
+    assert uploader.chunks_sent == 6 + 3
+    assert server.chunks_received == 9
+    assert server.duplicates == 0
+    assert len(assembled_files(server)) == 2
+    uploader.close()
+
+def test_bandwidth_limiter_rate():
+    limiter = edge.BandwidthLimiter(1000)
+    assert limiter.reserve(1000) == 0.0 # The initial burst is one second's worth.
+    assert limiter.reserve(500) == pytest.approx(0.5, abs=0.02)
+    assert limiter.reserve(500) == pytest.approx(1.0, abs=0.02) # Debt accumulates across callers.
+    assert limiter.throttled == pytest.approx(1.5, abs=0.04)
+    assert edge.BandwidthLimiter(None).reserve(10 ** 9) == 0.0
+
+def test_upload_respects_bandwidth_cap(tmp_path, server, control):
+    rate = 8 * CHUNK
+    path = write_file(tmp_path / "incident.avi", os.urandom(16 * CHUNK))
+    uploader = make_uploader(tmp_path, server, control, rate=rate)
+    started = time.monotonic()
+    uploader.file_ready(path)
+
+    assert wait_for(lambda: uploader.files_uploaded == 1)
+    # The first 8 chunks fit in the burst, the other 8 take one second at the capped rate.
+    assert time.monotonic() - started >= 0.9
+    assert uploader.stats()["throttled_s"] >= 0.9
+    uploader.close()
+
+def test_no_endpoint_keeps_files_local(tmp_path, control):
+    path = write_file(tmp_path / "incident.avi", os.urandom(CHUNK))
+    uploader = edge.EvidenceUploader(edge.UploadProgressStore(str(tmp_path / "progress.db")), base_url=None,
+                                     control=control)
+    uploader.file_ready(path)
+
+    assert uploader.standin is None and uploader.workers == []
+    assert uploader.stats()["files"] == {"ready": 1} # Still queued for a run that has an endpoint.
+    assert not os.path.exists("evidence_cloud_standin")
+    uploader.close()
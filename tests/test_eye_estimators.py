@@ -0,0 +1,50 @@
+"""Eye-state estimators, in the parent and in ProcessInferenceBackend workers."""
+import cv2
+import numpy as np
+
+import drowsiness_edge_node as edge
+
+
+def drawn_face():
+    """A cartoon face the frontal-face cascade finds: light oval, dark eyes, nose and mouth."""
+    gray = np.full((240, 320), 90, np.uint8)
+    cv2.ellipse(gray, (160, 120), (55, 72), 0, 0, 360, 200, -1)
+    for x in (137, 183):
+        cv2.ellipse(gray, (x, 105), (14, 8), 0, 0, 360, 60, -1)
+        cv2.circle(gray, (x, 105), 5, 20, -1)
+    cv2.line(gray, (160, 110), (160, 140), 150, 5)
+    cv2.ellipse(gray, (160, 160), (20, 7), 0, 0, 360, 70, -1)
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
+def test_worker_copy_applies_parent_calibration():
+    _, eye_cascade = edge.DrowsinessDetector.load_cascades() # For faces scored close to the threshold.
+    gray = drawn_face()
+    face = (85, 47, 151, 151)
+    parent = edge.GradientEyeEstimator(calibration_frames=5)
+    for _ in range(5):
+        parent.estimate(gray, [face], eye_cascade)
+    assert parent.open_level is not None
+
+    settings = parent.remote_settings()
+    worker = edge.EYE_ESTIMATORS[parent.name](**settings)
+    assert worker.open_level == parent.open_level
+    worker.estimate(gray, [face], eye_cascade)
+    decisions = parent.decisions
+    parent.absorb(worker.worker_report())
+    assert parent.decisions == decisions + 1
+    assert len(parent.history) == 6 # The worker's scores feed the parent's calibration.
+
+def test_process_backend_runs_the_selected_estimator():
+    backend = edge.ProcessInferenceBackend(processes=1)
+    try:
+        estimator = edge.GradientEyeEstimator(calibration_frames=3)
+        for _ in range(6):
+            detections, _ = backend.detect(drawn_face(), estimator=estimator)
+            assert len(detections) == 1
+    finally:
+        backend.close()
+    stats = estimator.stats()
+    assert stats["open_level"] is not None
+    assert stats["decisions"] + stats["cascade_fallbacks"] >= 6
+    assert stats["decisions"] > 0
@@ -0,0 +1,37 @@
+"""Time-based eye-state scoring: FatigueScorer."""
+import pytest
+
+import drowsiness_edge_node as edge
+
+
+def test_first_sample_seeds_the_level():
+    scorer = edge.FatigueScorer()
+    scorer.update(100.0, face_detected=True, eyes_detected=False)
+    assert scorer.closed_level == 1.0
+    assert scorer.eyes_closed
+
+def test_repeated_timestamps_do_not_replace_the_level():
+    scorer = edge.FatigueScorer()
+    for i in range(21):
+        scorer.update(100.0 + i * 0.1, face_detected=True, eyes_detected=True)
+    assert scorer.closed_level == 0.0 and not scorer.eyes_closed
+
+    # A burst of closed readings stamped with the last time (or a clock stepped back) has no weight.
+    for now in (102.0, 102.0, 102.0, 101.5):
+        scorer.update(now, face_detected=True, eyes_detected=False)
+    assert scorer.closed_level == 0.0
+    assert not scorer.eyes_closed
+    assert scorer.score == 0.0
+
+    # Once time moves on the reading counts at the rate the time constant allows.
+    scorer.update(102.1, face_detected=True, eyes_detected=False)
+    assert 0.0 < scorer.closed_level < 1.0
+
+def test_score_follows_elapsed_time_not_frame_count():
+    slow, fast = edge.FatigueScorer(), edge.FatigueScorer()
+    for i in range(11):
+        slow.update(i * 0.2, face_detected=True, eyes_detected=False)
+    for i in range(41):
+        fast.update(i * 0.05, face_detected=True, eyes_detected=False)
+    assert slow.score == pytest.approx(edge.SCORE_RATE * 2.0)
+    assert fast.score == pytest.approx(edge.SCORE_RATE * 2.0)
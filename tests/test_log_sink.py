@@ -0,0 +1,28 @@
+"""Local redundant log: TelemetryLogSink batching and rotation."""
+import csv
+import glob
+import time
+
+import drowsiness_edge_node as edge
+
+
+def test_rotations_in_the_same_second_keep_every_file(tmp_path):
+    path = str(tmp_path / "log.csv")
+    sink = edge.TelemetryLogSink(path, device_id="DEV", flush_batch=1, max_bytes=1, binary=True)
+    for i in range(8):
+        sink.log("HEARTBEAT", i, 50)
+        deadline = time.monotonic() + 5
+        while sink.rows_written <= i and time.monotonic() < deadline:
+            time.sleep(0.005) # One flush, and so one rotation, per row.
+    sink.close()
+
+    csv_files = glob.glob(str(tmp_path / "log*.csv"))
+    bin_files = glob.glob(str(tmp_path / "log*.bin"))
+    assert len(csv_files) == len(bin_files) == 8
+    scores = []
+    for name in csv_files:
+        with open(name, newline="") as file:
+            scores += [int(row["Score"]) for row in csv.DictReader(file)]
+    assert sorted(scores) == list(range(8))
+    records = [record for name in bin_files for record in edge.read_binary_log(name)[1]]
+    assert sorted(score for _, _, score, _ in records) == list(range(8))
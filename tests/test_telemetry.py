@@ -0,0 +1,155 @@
+"""Store-and-forward telemetry: TelemetrySpool, IoTClient and the LocalBrokerStandIn."""
+import os
+import time
+
+import pytest
+
+import drowsiness_edge_node as edge
+
+
+class ScriptedBroker(edge.LocalBrokerStandIn):
+    """Broker stand-in without random outages: reachable only while `up` is set."""
+    def __init__(self, up=True, ack_limit=None, **kwargs):
+        super().__init__(outage_rate=0.0, **kwargs)
+        self.up = up
+        self.ack_limit = ack_limit
+        self.connect_times = []
+
+    def connect(self):
+        self.connect_times.append(time.monotonic())
+        if not self.up:
+            raise ConnectionError("broker unreachable")
+        self.online = True
+
+    def publish_batch(self, envelope, count):
+        if not self.up:
+            raise ConnectionError("link dropped during publish")
+        return super().publish_batch(envelope, min(count, self.ack_limit or count))
+
+
+def message(seq):
+    return {"device_id": "DEV", "timestamp": "2024-05-01T08:00:00", "event": "HEARTBEAT", "data": {"seq": seq}}
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition(): return True
+        time.sleep(0.02)
+    return condition()
+
+def received_messages(capture_dir):
+    messages = []
+    for name in sorted(os.listdir(capture_dir)):
+        with open(os.path.join(capture_dir, name), "rb") as file:
+            device_id, batch = edge.decode_telemetry(file.read())
+        messages.extend(batch)
+    return messages
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture
+def control():
+    plane = edge.ControlPlane("test-control")
+    yield plane
+    plane.stop()
+
+
+def test_spool_survives_restart(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = edge.TelemetrySpool(path)
+    spool.extend([{"seq": i} for i in range(5)])
+    spool.close()
+
+    spool = edge.TelemetrySpool(path)
+    assert len(spool) == 5
+    batch = spool.peek_batch(3)
+    assert [m["seq"] for _, m in batch] == [0, 1, 2]
+    spool.ack(batch[-1][0])
+    spool.close()
+
+    spool = edge.TelemetrySpool(path)
+    assert [m["seq"] for _, m in spool.peek_batch(10)] == [3, 4]
+    spool.close()
+
+def test_spool_evicts_oldest_beyond_capacity(tmp_path):
+    spool = edge.TelemetrySpool(str(tmp_path / "spool.db"), max_messages=4)
+    spool.extend([{"seq": i} for i in range(6)])
+    assert spool.evicted == 2
+    assert [m["seq"] for _, m in spool.peek_batch(10)] == [2, 3, 4, 5]
+    spool.close()
+
+def test_client_spools_while_offline_and_next_run_delivers(tmp_path, control):
+    path = str(tmp_path / "spool.db")
+    client = edge.IoTClient("DEV", None, broker=ScriptedBroker(up=False), spool=edge.TelemetrySpool(path),
+                            control=control)
+    for i in range(3):
+        client.publish_telemetry("HEARTBEAT", {"seq": i})
+    client.close()
+
+    broker = ScriptedBroker(capture_dir=str(tmp_path / "captures"))
+    client = edge.IoTClient("DEV", None, broker=broker, spool=edge.TelemetrySpool(path), control=control)
+    assert wait_for(lambda: broker.received == 3)
+    assert [m["data"]["seq"] for m in received_messages(broker.capture_dir)] == [0, 1, 2]
+    client.close()
+
+def test_spool_is_published_in_acknowledged_batches(tmp_path, control, monkeypatch):
+    monkeypatch.setattr(edge, "PUBLISH_BATCH_SIZE", 10)
+    spool = edge.TelemetrySpool(str(tmp_path / "spool.db"))
+    spool.extend([message(i) for i in range(25)])
+    broker = ScriptedBroker(capture_dir=str(tmp_path / "captures"))
+    client = edge.IoTClient("DEV", None, broker=broker, spool=spool, control=control)
+
+    assert wait_for(lambda: client.published == 25)
+    assert broker.batches == 3
+    assert len(spool) == 0
+    assert [m["data"]["seq"] for m in received_messages(broker.capture_dir)] == list(range(25))
+    client.close()
+
+def test_unacknowledged_messages_stay_spooled(tmp_path, control, monkeypatch):
+    monkeypatch.setattr(edge, "PUBLISH_BATCH_SIZE", 10)
+    spool = edge.TelemetrySpool(str(tmp_path / "spool.db"))
+    spool.extend([message(i) for i in range(10)])
+    broker = ScriptedBroker(ack_limit=4, capture_dir=str(tmp_path / "captures"))
+    client = edge.IoTClient("DEV", None, broker=broker, spool=spool, control=control)
+
+    # Every batch is only partly acknowledged; the rest is sent again from the spool.
+    assert wait_for(lambda: client.published == 10)
+    assert broker.batches == 3
+    assert len(spool) == 0
+    client.close()
+
+def test_spool_drains_after_outage(tmp_path, control, monkeypatch):
+    monkeypatch.setattr(edge, "RECONNECT_BACKOFF_MIN", 0.05)
+    monkeypatch.setattr(edge, "RECONNECT_BACKOFF_MAX", 0.2)
+    broker = ScriptedBroker(up=False, capture_dir=str(tmp_path / "captures"))
+    client = edge.IoTClient("DEV", None, broker=broker, spool=edge.TelemetrySpool(str(tmp_path / "spool.db")),
+                            control=control)
+    for i in range(20):
+        client.publish_telemetry("ALERT", {"seq": i})
+    assert wait_for(lambda: len(client.spool) == 20)
+    assert broker.received == 0
+
+    broker.up = True # No new message is published: the link task must reconnect on its own.
+    assert wait_for(lambda: broker.received == 20)
+    assert len(client.spool) == 0
+    assert [m["data"]["seq"] for m in received_messages(broker.capture_dir)] == list(range(20))
+    client.close()
+
+def test_reconnect_backs_off_on_failing_broker(tmp_path, control, monkeypatch):
+    monkeypatch.setattr(edge, "RECONNECT_BACKOFF_MIN", 0.05)
+    monkeypatch.setattr(edge, "RECONNECT_BACKOFF_MAX", 0.4)
+    broker = ScriptedBroker(up=False)
+    client = edge.IoTClient("DEV", None, broker=broker, spool=edge.TelemetrySpool(str(tmp_path / "spool.db")),
+                            control=control)
+    client.publish_telemetry("HEARTBEAT", {})
+    time.sleep(1.5)
+    client.close()
+
+    attempts = broker.connect_times
+    gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+    # 0.05 s doubling to the 0.4 s cap (each jittered down to half) allows roughly ten attempts, not a busy loop.
+    assert 3 <= len(attempts) <= 15
+    assert max(gaps) >= 0.2 - 0.02
+    assert not client.connected
@@ -0,0 +1,202 @@
+"""
+Offline tuner for detector profiles.
+
+Decodes recorded clips once, runs the face and eye cascades over them for every combination
+of scaleFactor / minNeighbors / minSize / maxSize in a grid, and measures detection time and
+recall. Picks the fastest setting that meets the recall target, reports the speed/recall
+Pareto frontier as JSON, and can write the chosen setting into detector_profiles.json as a
+profile for one vehicle model.
+
+Frames without a label are scored against what the base profile detects on them. Eyes are
+searched in the upper half of each face box when TRACKING_MODE is on, as the live node does;
+--whole-face / --upper-half override that.
+
+    python tune_profiles.py --clip cabin.avi,cabin_labels.csv --target 0.95
+    python tune_profiles.py --clip van_a.avi --clip van_b.avi --save-as van_2024 --cameras VAN_7_DRIVER
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import cv2
+
+import adss_benchmark
+import drowsiness_edge_node as edge
+
+
+METRICS = ("face_recall", "closed_recall", "accuracy")
+
+def parse_list(text, cast=float):
+    return [cast(v) for v in text.split(",") if v.strip()]
+
+def parse_sizes(text):
+    """'none,40,60x48' -> [None, (40, 40), (60, 48)]."""
+    sizes = []
+    for v in text.split(","):
+        v = v.strip().lower()
+        if v in ("", "none", "0"):
+            sizes.append(None)
+        elif "x" in v:
+            w, h = v.split("x")
+            sizes.append((int(w), int(h)))
+        else:
+            sizes.append((int(v), int(v)))
+    return sizes
+
+def load_frames(clips, stride=1, max_frames=None):
+    """Decodes every clip once into luma frames. Returns [(gray, label or None), ...]."""
+    frames = []
+    for spec in clips:
+        video, _, labels_path = spec.partition(",")
+        labels = adss_benchmark.load_labels(labels_path) if labels_path else {}
+        source = edge.open_frame_source(video, grayscale=True)
+        if not source.isOpened():
+            raise OSError(f"cannot open {video}")
+        index = 0
+        while (max_frames is None or len(frames) < max_frames) and source.grab():
+            if index % stride == 0: # Skipped frames are grabbed, never decoded.
+                ok, gray = source.retrieve()
+                if not ok: break
+                frames.append((gray, labels.get(index)))
+            index += 1
+        source.release()
+    return frames
+
+def detect_states(profile, frames, cascades, upper_half=edge.TRACKING_MODE):
+    """Eye state per frame ('open' / 'closed' / 'none') and mean detection time in ms."""
+    face_cascade, eye_cascade = cascades
+    states = []
+    started = time.perf_counter()
+    for gray, _ in frames:
+        faces = edge.DrowsinessDetector.find_faces(gray, face_cascade, profile.face)
+        detections = edge.DrowsinessDetector.find_eyes(gray, faces, eye_cascade, upper_half, profile.eye)
+        states.append(adss_benchmark.eye_state({
+            "face_detected": len(detections) > 0,
+            "eyes_detected": any(len(eyes) > 0 for _, eyes in detections)
+        }))
+    elapsed = time.perf_counter() - started
+    return states, 1000 * elapsed / max(1, len(frames))
+
+def score(predicted, expected):
+    def ratio(hits, total):
+        return round(hits / total, 4) if total else None
+    face_present = [p for p, e in zip(predicted, expected) if e != "none"]
+    closed = [p for p, e in zip(predicted, expected) if e == "closed"]
+    return {
+        "face_recall": ratio(sum(p != "none" for p in face_present), len(face_present)),
+        "closed_recall": ratio(sum(p == "closed" for p in closed), len(closed)),
+        "accuracy": ratio(sum(p == e for p, e in zip(predicted, expected)), len(expected))
+    }
+
+def candidate_profiles(base, scale_factors, min_neighbors, min_sizes, max_sizes, eye_min_neighbors):
+    for sf, mn, lo, hi, eye_mn in itertools.product(scale_factors, min_neighbors, min_sizes, max_sizes,
+                                                     eye_min_neighbors):
+        if lo and hi and (hi[0] <= lo[0] or hi[1] <= lo[1]): continue
+        face = base.face.replace(scale_factor=sf, min_neighbors=mn, min_size=lo, max_size=hi)
+        yield edge.DetectorProfile("candidate", face, base.eye.replace(min_neighbors=eye_mn))
+
+def pareto_frontier(results, metric):
+    """Results no other result beats on both speed and `metric`, fastest first."""
+    frontier = []
+    best = None
+    for r in sorted(results, key=lambda r: r["ms_per_frame"]):
+        value = r[metric] if r[metric] is not None else -1.0
+        if best is None or value > best:
+            frontier.append(r)
+            best = value
+    return frontier
+
+def run_tuning(frames, base, grid, metric="face_recall", target=0.95, upper_half=edge.TRACKING_MODE):
+    cascades = edge.DrowsinessDetector.load_cascades()
+    reference, base_ms = detect_states(base, frames, cascades, upper_half)
+    expected = [label if label is not None else ref for (_, label), ref in zip(frames, reference)]
+    baseline = dict(score(reference, expected), ms_per_frame=round(base_ms, 3), **base.to_dict())
+
+    results = []
+    for profile in candidate_profiles(base, *grid):
+        states, ms = detect_states(profile, frames, cascades, upper_half)
+        results.append(dict(score(states, expected), ms_per_frame=round(ms, 3), **profile.to_dict()))
+
+    eligible = [r for r in results if r[metric] is not None and r[metric] >= target]
+    chosen = min(eligible, key=lambda r: r["ms_per_frame"]) if eligible else None
+    if chosen and base_ms > 0:
+        chosen = dict(chosen, speedup_vs_base=round(base_ms / chosen["ms_per_frame"], 2) if chosen["ms_per_frame"] else None)
+    return {
+        "frames": len(frames),
+        "labelled_frames": sum(label is not None for _, label in frames),
+        "base_profile": base.name,
+        "metric": metric,
+        "target": target,
+        "eye_search": "upper_half" if upper_half else "whole_face",
+        "candidates": len(results),
+        "baseline": baseline,
+        "chosen": chosen,
+        "pareto": pareto_frontier(results, metric),
+        "all": results,
+        "environment": {"opencv": cv2.__version__, "threads": cv2.getNumThreads()}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep cascade parameters on recorded clips and pick a detector profile.")
+    parser.add_argument("--clip", action="append", required=True, metavar="VIDEO[,LABELS]",
+                        help="Clip to tune on, optionally with a frame,state ground truth CSV. Repeatable.")
+    parser.add_argument("--base", default="default", help="Profile the sweep starts from and compares against.")
+    parser.add_argument("--profiles", default=None, help="Profile file (default: DETECTOR_PROFILE_FILE).")
+    parser.add_argument("--metric", choices=METRICS, default="face_recall")
+    parser.add_argument("--target", type=float, default=0.95, help="Minimum value of --metric for the chosen setting.")
+    parser.add_argument("--scale-factors", default="1.05,1.1,1.2,1.3")
+    parser.add_argument("--min-neighbors", default="3,5,8")
+    parser.add_argument("--min-sizes", default="25,60,100", help="Face minSize values: N, WxH or none.")
+    parser.add_argument("--max-sizes", default="none", help="Face maxSize values: N, WxH or none.")
+    parser.add_argument("--eye-min-neighbors", default="10")
+    parser.add_argument("--stride", type=int, default=1, help="Use every Nth frame of each clip.")
+    parser.add_argument("--max-frames", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=1, help="OpenCV threads; 1 matches one inference worker.")
+    eye_search = parser.add_mutually_exclusive_group()
+    eye_search.add_argument("--upper-half", dest="upper_half", action="store_true",
+                            help="Search eyes in the upper half of the face box (live default with TRACKING_MODE).")
+    eye_search.add_argument("--whole-face", dest="upper_half", action="store_false",
+                            help="Search eyes in the whole face box (live default without TRACKING_MODE).")
+    parser.set_defaults(upper_half=edge.TRACKING_MODE)
+    parser.add_argument("--save-as", metavar="NAME", help="Write the chosen setting to the profile file under this name.")
+    parser.add_argument("--cameras", default="", help="Device IDs to assign the saved profile to (comma separated).")
+    parser.add_argument("--json", help="Write the report to this file instead of stdout.")
+    parser.add_argument("--all", action="store_true", help="Include every candidate in the report, not just the frontier.")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(args.threads)
+    base = edge.detector_profile(args.base, path=args.profiles)
+    frames = load_frames(args.clip, max(1, args.stride), args.max_frames)
+    if not frames:
+        print("Error: no frames decoded")
+        return 1
+    grid = (parse_list(args.scale_factors), parse_list(args.min_neighbors, int), parse_sizes(args.min_sizes),
+            parse_sizes(args.max_sizes), parse_list(args.eye_min_neighbors, int))
+    report = run_tuning(frames, base, grid, args.metric, args.target, args.upper_half)
+    if not args.all: del report["all"]
+
+    chosen = report["chosen"]
+    if chosen and args.save_as:
+        profile = edge.DetectorProfile.from_dict(args.save_as, {"face": chosen["face"], "eye": chosen["eye"]})
+        cameras = [c.strip() for c in args.cameras.split(",") if c.strip()]
+        edge.save_detector_profile(profile, args.profiles, cameras,
+                                   description=f"tune_profiles.py: {args.metric} {chosen[args.metric]} at "
+                                               f"{chosen['ms_per_frame']} ms/frame on {report['frames']} frames")
+        report["saved_as"] = args.save_as
+
+    text = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(text)
+        print(f"[TUNER] {report['candidates']} settings on {report['frames']} frames. Report written to {args.json}")
+    else:
+        print(text)
+    if chosen is None:
+        print(f"[TUNER] No setting reaches {args.metric} >= {args.target}.", file=sys.stderr)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())